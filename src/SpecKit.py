@@ -10,6 +10,7 @@ Created on Thu May 15 13:20:18 2025
 
 import tkinter as tk
 from tkinter import ttk
+from multiprocessing import freeze_support
 
 # These will be replaced with modular classes we are about to create
 #from cross_section_input_generator import CrossSectionInputFrame
@@ -58,6 +59,7 @@ class SpecKitApp:
 
 
 if __name__ == "__main__":
+    freeze_support()   # Worker processes of the parallel inversion in the packaged .exe
     root = tk.Tk()
     app = SpecKitApp(root)
     root.mainloop()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark harness of the unfolding engine.
+
+Runs the solver on the bundled cases and writes a JSON report, so that solver
+speed and accuracy can be compared from one commit to the next:
+
+    double_peak, quasi_single_peak   benchmark/<case>: 10 foils, MCNP true spectrum
+    Ma_60, Ma_113, Ma_240            manuscript_2026_energy_group_resolution matrices
+
+For every case and solver method the report holds wall time (best of
+--repeat), epochs, matrix products, peak traced memory (tracemalloc, separate
+run), final loss, chi-square, activity ERRE and, when the true spectrum is
+known, the relative flux error ABS(calculated - true) / true in the thermal,
+epithermal and fast regions (README, Benchmark -- Error Analysis), next to the
+same error of the prior.
+
+    python -m benchmark_suite -o report.json
+    python -m benchmark_suite --cases double_peak --methods gradient fista --compare report.json
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from solver_backends import activity_erre
+from unfolding_engine import SOLVER_METHODS, SpectrumUnfolder, load_prior, load_problem
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPORT_VERSION = 1
+
+# Energy regions of the error analysis (MeV, thermal up to 0.0258 eV as in the README benchmark);
+# a group belongs to the region of its upper boundary
+REGIONS = (("thermal", 1e-11, 2.58e-8), ("epithermal", 2.58e-8, 1.0), ("fast", 1.0, 30.0))
+
+
+def _mcnp_case(name):
+    folder = os.path.join(REPO_ROOT, "benchmark", name)
+    true_outputs = glob.glob(os.path.join(folder, "MCNP_input", "true", "*o"))
+    return {
+        "problem": os.path.join(folder, "result", "Ma_parameter", "a_parameter_tot.csv"),
+        "prior": os.path.join(folder, "prior.txt"),
+        "true": true_outputs[0] if true_outputs else None,
+    }
+
+
+def _manuscript_case(groups, prior_name):
+    folder = os.path.join(REPO_ROOT, "manuscript_2026_energy_group_resolution")
+    return {
+        "problem": os.path.join(folder, "Ma", f"Ma_{groups}groups.csv"),
+        "prior": os.path.join(folder, "prior_spectra", prior_name),
+        "true": None,
+    }
+
+
+CASES = {
+    "double_peak": _mcnp_case("double_peak"),
+    "quasi_single_peak": _mcnp_case("quasi_single_peak"),
+    "Ma_60": _manuscript_case(60, "prior_60groups.txt"),
+    "Ma_113": _manuscript_case(113, "prior_113group.txt"),
+    "Ma_240": _manuscript_case(240, "prior_240groups.txt"),
+}
+
+
+def read_mcnp_spectrum(path):
+    """(energies, flux) of the last tally table (energy, value, relative error) of an MCNP output."""
+    tables = []
+    rows = None
+    with open(path, 'r', errors='replace') as file:
+        for line in file:
+            parts = line.split()
+            if parts == ["energy"]:
+                rows = []
+                continue
+            if rows is None:
+                continue
+            if parts and parts[0] == "total":
+                tables.append(rows)
+                rows = None
+                continue
+            try:
+                rows.append((float(parts[0]), float(parts[1])))
+            except (IndexError, ValueError):
+                if rows:
+                    tables.append(rows)
+                rows = None
+    if rows:
+        tables.append(rows)
+    if not tables:
+        raise ValueError(f"No energy tally table found in {path}.")
+    table = np.array(tables[-1])
+    return table[:, 0], table[:, 1]
+
+
+def chi_square(A, x, b, b_error):
+    """Σ ((Ax - b) / σ)², σ = b_error (unit weight where b_error is 0, as in the loss)."""
+    sigma = np.ravel(b_error).astype(np.float64)
+    sigma = np.where(sigma > 0, sigma, 1.0)
+    residual = np.asarray(A, dtype=np.float64) @ np.ravel(x) - np.ravel(b)
+    return float(np.sum(np.square(residual / sigma)))
+
+
+def region_errors(energies, x, x_true):
+    """{region: ABS(Σx - Σx_true) / Σx_true} over the groups of every region, plus "total"."""
+    energies = np.asarray(energies, dtype=np.float64)
+    x = np.ravel(x).astype(np.float64)
+    x_true = np.ravel(x_true).astype(np.float64)
+    errors = {}
+    for name, low, high in REGIONS:
+        # Groups are (E_j-1, E_j]: column j belongs to the region of E_j
+        inside = (energies > low * (1 + 1e-6)) & (energies <= high * (1 + 1e-6))
+        reference = x_true[inside].sum()
+        errors[name] = float(abs(x[inside].sum() - reference) / reference) if reference > 0 else None
+    errors["total"] = float(abs(x.sum() - x_true.sum()) / x_true.sum()) if x_true.sum() > 0 else None
+    return errors
+
+
+def run_case(name, method="gradient", repeat=1, **solver_options):
+    """Benchmark record of one case solved with one method."""
+    case = CASES[name]
+    problem = load_problem(case["problem"])
+    x0 = load_prior(case["prior"], problem.A.shape[1]).reshape(1, -1)
+    unfolder = SpectrumUnfolder(problem.A, problem.loss_threshold, method=method, b_error=problem.b_error,
+                                **solver_options)
+
+    times = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = unfolder.solve(x0, problem.b)
+        times.append(time.perf_counter() - start)
+
+    # Peak memory from its own run: tracing slows the solver down
+    tracemalloc.start()
+    unfolder.solve(x0, problem.b)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    record = {
+        "case": name,
+        "method": method,
+        "groups": int(problem.A.shape[1]),
+        "foils": int(problem.A.shape[0]),
+        "wall_time_s": min(times),
+        "wall_times_s": times,
+        "epochs": int(result.epochs),
+        "matrix_products": int(result.matrix_products),
+        "peak_memory_bytes": int(peak),
+        "stop_reason": result.stop_reason,
+        "final_loss": float(result.final_loss),
+        "loss_threshold": float(problem.loss_threshold),
+        "chi_square": chi_square(problem.A, result.x, problem.b, problem.b_error),
+        "activity_erre": float(activity_erre(problem.A, result.x, problem.b)),
+        "total_flux": float(result.x.sum()),
+        "spectrum_error": None,
+        "prior_spectrum_error": None,
+    }
+    if case["true"] is not None:
+        _, x_true = read_mcnp_spectrum(case["true"])
+        if len(x_true) != problem.A.shape[1]:
+            raise ValueError(f"{case['true']} has {len(x_true)} groups, the problem has {problem.A.shape[1]}.")
+        record["spectrum_error"] = region_errors(problem.energies, result.x, x_true)
+        record["prior_spectrum_error"] = region_errors(problem.energies, x0, x_true)
+    return record
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(cases=None, methods=("gradient",), repeat=1, **solver_options):
+    """Report dict of every case x method."""
+    records = []
+    for name in cases or CASES:
+        for method in methods:
+            record = run_case(name, method, repeat, **solver_options)
+            records.append(record)
+            print(f"{name:>18} {method:>8}: {record['wall_time_s']:8.3f} s  {record['epochs']:>7} epochs  "
+                  f"{record['matrix_products']:>7} products  {record['peak_memory_bytes'] / 1024:8.0f} KiB  "
+                  f"ERRE={record['activity_erre']:.2%}  ({record['stop_reason']})")
+    return {
+        "version": REPORT_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "solver_options": solver_options,
+        "repeat": repeat,
+        "results": records,
+    }
+
+
+def compare_reports(previous, current):
+    """Lines comparing wall time, epochs and ERRE of the records present in both reports."""
+    old = {(r["case"], r["method"]): r for r in previous["results"]}
+    lines = [f"Compared with {previous.get('commit') or 'previous report'} ({previous.get('created')}):"]
+    for record in current["results"]:
+        before = old.get((record["case"], record["method"]))
+        if before is None:
+            continue
+        lines.append(f"{record['case']:>18} {record['method']:>8}: time x{record['wall_time_s'] / before['wall_time_s']:.2f}  "
+                     f"epochs {before['epochs']} -> {record['epochs']}  "
+                     f"ERRE {before['activity_erre']:.2%} -> {record['activity_erre']:.2%}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark_suite",
+                                     description="Time and score the unfolding engine on the bundled cases.")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--methods", nargs="+", choices=SOLVER_METHODS, default=["gradient"])
+    parser.add_argument("--max-epochs", type=int, default=500000)
+    parser.add_argument("--learning-rate", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=1, help="timed solves per case (best is reported)")
+    parser.add_argument("-o", "--output", default="benchmark_report.json")
+    parser.add_argument("--compare", default=None, help="previous report to compare with")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.cases, args.methods, args.repeat,
+                       max_epochs=args.max_epochs, learning_rate=args.learning_rate)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=1)
+    print(f"Report written to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            previous = json.load(file)
+        print("\n".join(compare_reports(previous, report)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+Sharded Monte Carlo campaigns coordinated through files on a shared filesystem.
+
+A campaign directory holds a copy of the problem and prior, campaign.json
+(runs, shard size, seed, solver options) and one set of files per shard of
+consecutive run IDs:
+
+    shards/shard_00012.lock   claimed (O_EXCL create) with a unique owner token,
+                              touched before every run by its owner only
+    shards/shard_00012.csv    Run_<id> spectra (+ _runs.csv / _loss.csv sidecars)
+    shards/shard_00012.done   all runs of the shard written
+
+Any number of worker processes, on any number of nodes, run `work` on the
+same directory; each claims free shards until none is left. Run `id` always
+uses the stream (seed, id), so a shard gives the same spectra whichever
+worker computes it, and an interrupted shard is resumed where it stopped.
+A worker whose lock was taken over (stale_after) stops writing the shard as
+soon as it notices that the token in the lock file is no longer its own.
+
+    python -m campaign init camp/ parameters.csv prior.txt --runs 100000 --shard-size 500
+    python -m campaign work camp/ --processes 8        # on every node
+    python -m campaign status camp/
+    python -m campaign merge camp/ -o result.csv       # Error Bar Viewer input
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import time
+import uuid
+
+import numpy as np
+
+from monte_carlo import base_seed, perturb_activities
+from problem_bundle import BUNDLE_FILE
+from result_store import LOSS_SIDECAR_SUFFIX, RUNS_SIDECAR_SUFFIX, complete_length, open_result_sink
+from unfolding_engine import (FORMULATIONS, SMOOTHNESS_WEIGHT, SOLVER_METHODS,
+                              SpectrumUnfolder, load_prior, load_problem)
+
+
+CAMPAIGN_FILE = "campaign.json"
+CAMPAIGN_VERSION = 1
+SHARD_DIR = "shards"
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as file:
+        json.dump(data, file, indent=1)
+    os.replace(tmp, path)
+
+
+def _worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def load_campaign(campaign_dir):
+    with open(os.path.join(campaign_dir, CAMPAIGN_FILE), 'r') as file:
+        config = json.load(file)
+    if config.get("version", 0) > CAMPAIGN_VERSION:
+        raise ValueError(f"Campaign version {config['version']} is newer than this program supports.")
+    return config
+
+
+def num_shards(config):
+    return -(-config["runs"] // config["shard_size"])
+
+
+def shard_runs(config, shard):
+    """Run IDs of one shard."""
+    start = shard * config["shard_size"]
+    return range(start, min(start + config["shard_size"], config["runs"]))
+
+
+def shard_path(campaign_dir, shard, suffix):
+    return os.path.join(campaign_dir, SHARD_DIR, f"shard_{shard:05d}{suffix}")
+
+
+def init_campaign(campaign_dir, problem_file, prior_file=None, runs=1, shard_size=100, seed=None,
+                  loss_threshold=None, **solver_options):
+    """Create a campaign directory; the problem and prior are copied into it."""
+    if os.path.exists(os.path.join(campaign_dir, CAMPAIGN_FILE)):
+        raise FileExistsError(f"{campaign_dir} already holds a campaign.")
+    if runs < 1 or shard_size < 1:
+        raise ValueError("runs and shard_size must be positive.")
+    problem = load_problem(problem_file)
+    if prior_file is None and problem.prior is None:
+        raise ValueError("A prior file is required unless the problem bundle contains one.")
+    if prior_file is not None:
+        load_prior(prior_file, problem.A.shape[1])   # fail now rather than on the nodes
+
+    if os.path.basename(problem_file) == BUNDLE_FILE:
+        problem_file = os.path.dirname(problem_file)
+
+    os.makedirs(os.path.join(campaign_dir, SHARD_DIR), exist_ok=True)
+    # Copies: every node reads exactly the same input, whatever happens to the originals
+    problem_name = "problem" + (os.path.splitext(problem_file.rstrip("/\\"))[1] or ".csv")
+    if os.path.isdir(problem_file):
+        shutil.copytree(problem_file, os.path.join(campaign_dir, problem_name), dirs_exist_ok=True)
+    else:
+        shutil.copyfile(problem_file, os.path.join(campaign_dir, problem_name))
+    prior_name = None
+    if prior_file is not None:
+        prior_name = "prior" + (os.path.splitext(prior_file)[1] or ".txt")
+        shutil.copyfile(prior_file, os.path.join(campaign_dir, prior_name))
+
+    config = {
+        "version": CAMPAIGN_VERSION,
+        "runs": runs,
+        "shard_size": shard_size,
+        "seed": base_seed(seed),
+        "problem": problem_name,
+        "prior": prior_name,
+        "loss_threshold": float(loss_threshold if loss_threshold is not None else problem.loss_threshold),
+        "solver": solver_options,
+    }
+    # campaign.json is written last: workers ignore a directory without it
+    _write_json(os.path.join(campaign_dir, CAMPAIGN_FILE), config)
+    return config
+
+
+def claim_shard(campaign_dir, shard, stale_after=None):
+    """
+    Try to take a shard: the owner token written into its lock file, None if
+    the shard is taken.
+
+    A lock not touched for stale_after seconds (worker killed) is taken over;
+    leave stale_after at None unless it is safely longer than one run.
+    """
+    lock = shard_path(campaign_dir, shard, ".lock")
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        if stale_after is None or not _take_over_stale_lock(lock, stale_after):
+            return None
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+    token = uuid.uuid4().hex
+    with os.fdopen(fd, 'w') as file:
+        file.write(f"{_worker_name()} {token} {time.time():.0f}\n")
+        file.flush()
+        os.fsync(file.fileno())
+    return token
+
+
+def _take_over_stale_lock(lock, stale_after):
+    try:
+        if time.time() - os.path.getmtime(lock) < stale_after:
+            return False
+        # Only one of several workers can rename the lock away
+        staged = f"{lock}.stale-{_worker_name().replace(':', '-')}"
+        os.rename(lock, staged)
+    except FileNotFoundError:
+        return False
+    if time.time() - os.path.getmtime(staged) < stale_after:
+        # The lock was renewed in between: give it back to its owner
+        try:
+            os.link(staged, lock)
+        except FileExistsError:
+            pass
+        os.remove(staged)
+        return False
+    os.remove(staged)
+    return True
+
+
+def _owns_lock(lock, token):
+    try:
+        with open(lock, 'r') as file:
+            fields = file.read().split()
+    except FileNotFoundError:
+        return False
+    return len(fields) > 1 and fields[1] == token
+
+
+def _heartbeat(lock, token):
+    # False if the lock was taken over: the shard belongs to another worker now,
+    # whose lock must not be kept alive by this one
+    if not _owns_lock(lock, token):
+        return False
+    try:
+        os.utime(lock)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def work(campaign_dir, stale_after=None, verbose=False):
+    """Claim and compute shards until none is left; returns the number of runs computed."""
+    config = load_campaign(campaign_dir)
+    problem = load_problem(os.path.join(campaign_dir, config["problem"]))
+    if config["prior"] is not None:
+        x0 = load_prior(os.path.join(campaign_dir, config["prior"]), problem.A.shape[1]).reshape(1, -1)
+    else:
+        x0 = np.array(problem.prior, dtype=np.float32).reshape(1, -1)
+    unfolder = SpectrumUnfolder(problem.A, config["loss_threshold"], b_error=problem.b_error,
+                                verbose=verbose, **config["solver"])
+    seed = config["seed"]
+    computed = 0
+
+    for shard in range(num_shards(config)):
+        if os.path.exists(shard_path(campaign_dir, shard, ".done")):
+            continue
+        token = claim_shard(campaign_dir, shard, stale_after)
+        if token is None:
+            continue
+        lock = shard_path(campaign_dir, shard, ".lock")
+        finished = True
+        # resume=True: runs left by a previous owner of the shard are kept
+        with open_result_sink(shard_path(campaign_dir, shard, ".csv"), problem.energies,
+                              problem.b.shape[0], resume=True) as sink:
+            for run in shard_runs(config, shard):
+                if run in sink.completed:
+                    continue
+                if not _heartbeat(lock, token):
+                    print(f"[{_worker_name()}] lost the lock of shard {shard}, leaving it")
+                    finished = False
+                    break
+                perturbed = perturb_activities(problem.b, problem.b_error, seed, run)
+                result = unfolder.solve(x0, perturbed)
+                if not _owns_lock(lock, token):
+                    # Taken over during the solve: the new owner is appending to the shard
+                    print(f"[{_worker_name()}] lost the lock of shard {shard}, run {run + 1} not written")
+                    finished = False
+                    break
+                sink.write(run, result.x, result.final_loss, result.epochs, result.stop_reason,
+                           seed, perturbed, loss_trace=result.loss_history)
+                computed += 1
+        if finished and _owns_lock(lock, token):
+            _write_json(shard_path(campaign_dir, shard, ".done"),
+                        {"worker": _worker_name(), "runs": len(shard_runs(config, shard)), "time": time.time()})
+            try:
+                os.remove(lock)
+            except FileNotFoundError:
+                pass
+            print(f"[{_worker_name()}] shard {shard} done (runs {shard_runs(config, shard).start + 1}"
+                  f"-{shard_runs(config, shard).stop})")
+    return computed
+
+
+def _count_rows(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as file:
+        return max(0, sum(block.count(b"\n") for block in iter(lambda: file.read(1 << 20), b"")) - 1)
+
+
+def campaign_status(campaign_dir):
+    """{"done", "running", "pending"}: shard lists; "runs_done": runs on disk; "locks": {shard: (owner, age s)}."""
+    config = load_campaign(campaign_dir)
+    status = {"done": [], "running": [], "pending": [], "runs_done": 0, "locks": {}}
+    now = time.time()
+    for shard in range(num_shards(config)):
+        if os.path.exists(shard_path(campaign_dir, shard, ".done")):
+            status["done"].append(shard)
+            status["runs_done"] += len(shard_runs(config, shard))
+            continue
+        lock = shard_path(campaign_dir, shard, ".lock")
+        try:
+            with open(lock, 'r') as file:
+                owner = file.read().split()[0]
+            status["locks"][shard] = (owner, now - os.path.getmtime(lock))
+            status["running"].append(shard)
+        except (FileNotFoundError, IndexError):
+            status["pending"].append(shard)
+        status["runs_done"] += _count_rows(shard_path(campaign_dir, shard, ".csv"))
+    return status
+
+
+def _append_rows(source, target, header, complete_only=False, runs=None):
+    """
+    Copy a shard CSV into target; the header line is written once and must agree across shards.
+
+    complete_only: the shard may still be written, copy its complete lines only;
+    runs: copy only the rows of these Run_<id> labels. Returns (header, labels copied).
+    """
+    end = complete_length(source) if complete_only else None
+    copied = set()
+    with open(source, 'rb') as file:
+        first = file.readline()
+        if end is not None and end < len(first):
+            return header, copied   # not even the header is complete yet
+        if header is None:
+            target.write(first)
+        elif first != header:
+            raise ValueError(f"{source} has a different header from the previous shards.")
+        if end is None and runs is None:
+            shutil.copyfileobj(file, target)
+            return first, None
+        position = len(first)
+        for line in iter(file.readline, b""):
+            position += len(line)
+            if end is not None and position > end:
+                break
+            label = line.split(b",", 1)[0]
+            if runs is None or label in runs:
+                target.write(line)
+                copied.add(label)
+    return first, copied
+
+
+def merge_campaign(campaign_dir, output, partial=False):
+    """
+    Concatenate the shard files into one Run_<id> CSV (plus sidecars); returns the number of runs.
+
+    Unfinished shards (partial=True) are cut back to their last complete
+    spectrum row, and their sidecar rows to the runs of those spectra.
+    """
+    config = load_campaign(campaign_dir)
+    shards = [shard for shard in range(num_shards(config))
+              if os.path.exists(shard_path(campaign_dir, shard, ".csv"))]
+    missing = [shard for shard in range(num_shards(config))
+               if not os.path.exists(shard_path(campaign_dir, shard, ".done"))]
+    if missing and not partial:
+        raise ValueError(f"{len(missing)} of {num_shards(config)} shards are not finished "
+                         f"(first: {missing[0]}); use partial=True to merge what is there.")
+    if not shards:
+        raise ValueError("No shard has results yet.")
+
+    stem = os.path.splitext(output)[0]
+    targets = [("", output), (RUNS_SIDECAR_SUFFIX, stem + RUNS_SIDECAR_SUFFIX),
+               (LOSS_SIDECAR_SUFFIX, stem + LOSS_SIDECAR_SUFFIX)]
+    runs = 0
+    unfinished = set(missing)
+    written = {}   # unfinished shard -> Run_<id> labels of its complete spectrum rows
+    for suffix, path in targets:
+        tmp = path + ".tmp"
+        header = None
+        found = False
+        with open(tmp, 'wb') as target:
+            for shard in shards:
+                source = shard_path(campaign_dir, shard, suffix or ".csv")
+                if not os.path.exists(source):
+                    continue
+                found = True
+                if shard not in unfinished:
+                    header, _ = _append_rows(source, target, header)
+                elif not suffix:
+                    header, written[shard] = _append_rows(source, target, header, complete_only=True)
+                else:
+                    header, _ = _append_rows(source, target, header, complete_only=True,
+                                             runs=written.get(shard, set()))
+        if not found:
+            os.remove(tmp)
+            continue
+        os.replace(tmp, path)
+        if not suffix:
+            runs = _count_rows(path)
+    return runs
+
+
+def _run_workers(campaign_dir, processes, stale_after, verbose):
+    # Local test / single node: several worker processes on the same campaign
+    from multiprocessing import Process
+
+    workers = [Process(target=work, args=(campaign_dir, stale_after, verbose)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return all(worker.exitcode == 0 for worker in workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m campaign",
+                                     description="Sharded Monte Carlo campaign over a shared directory.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    init = commands.add_parser("init", help="create a campaign directory")
+    init.add_argument("campaign", help="campaign directory (on the shared filesystem)")
+    init.add_argument("problem", help="activation product parameter CSV (A, b, b_error) or problem bundle")
+    init.add_argument("prior", nargs="?", default=None,
+                      help="initial spectrum file; optional for a bundle with a prior")
+    init.add_argument("--runs", type=int, required=True, help="number of Monte Carlo runs")
+    init.add_argument("--shard-size", type=int, default=100, help="runs per shard")
+    init.add_argument("--seed", type=int, default=None, help="seed of the activity perturbations")
+    init.add_argument("--loss-threshold", type=float, default=None,
+                      help="stopping loss (default: 95%% chi-square quantile)")
+    init.add_argument("--learning-rate", type=float, default=1.0)
+    init.add_argument("--max-epochs", type=int, default=500000)
+    init.add_argument("--smoothness", type=float, default=SMOOTHNESS_WEIGHT)
+    init.add_argument("--method", choices=SOLVER_METHODS, default="gradient", help="solver backend")
+    init.add_argument("--formulation", choices=FORMULATIONS, default="auto")
+
+    worker = commands.add_parser("work", help="compute shards until none is left")
+    worker.add_argument("campaign")
+    worker.add_argument("--processes", type=int, default=1, help="worker processes on this node")
+    worker.add_argument("--stale-after", type=float, default=None,
+                        help="take over locks not refreshed for this many seconds (longer than one run)")
+    worker.add_argument("-v", "--verbose", action="store_true")
+
+    status = commands.add_parser("status", help="show finished, running and pending shards")
+    status.add_argument("campaign")
+
+    merge = commands.add_parser("merge", help="merge the shards into one Run_<id> CSV")
+    merge.add_argument("campaign")
+    merge.add_argument("-o", "--output", required=True)
+    merge.add_argument("--partial", action="store_true", help="merge even if some shards are not finished")
+    args = parser.parse_args(argv)
+
+    if args.command == "init":
+        try:
+            config = init_campaign(args.campaign, args.problem, args.prior, args.runs, args.shard_size, args.seed,
+                                   args.loss_threshold, learning_rate=args.learning_rate,
+                                   max_epochs=args.max_epochs, smoothness=args.smoothness,
+                                   method=args.method, formulation=args.formulation)
+        except (FileExistsError, ValueError) as e:
+            parser.error(str(e))
+        print(f"{config['runs']} runs in {num_shards(config)} shards, seed {config['seed']}")
+    elif args.command == "work":
+        if args.processes > 1:
+            return 0 if _run_workers(args.campaign, args.processes, args.stale_after, args.verbose) else 1
+        print(f"{work(args.campaign, args.stale_after, args.verbose)} runs computed")
+    elif args.command == "status":
+        config = load_campaign(args.campaign)
+        state = campaign_status(args.campaign)
+        print(f"Runs on disk: {state['runs_done']} / {config['runs']}")
+        print(f"Shards: {len(state['done'])} done, {len(state['running'])} running, "
+              f"{len(state['pending'])} pending (of {num_shards(config)})")
+        for shard, (owner, age) in sorted(state["locks"].items()):
+            print(f"  shard {shard}: {owner}, lock refreshed {age:.0f} s ago")
+    elif args.command == "merge":
+        try:
+            runs = merge_campaign(args.campaign, args.output, args.partial)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"{runs} runs merged into {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
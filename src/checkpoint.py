@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of a running Monte Carlo campaign.
+
+Finished runs are already on disk (result_store), but one gradient run can
+take up to max_epochs = 500000 epochs. A Checkpointer handed to
+SpectrumUnfolder.solve saves the complete loop state of the current run
+(x, epoch, LossTrace, plateau windows, restart counters) at most every
+`interval` seconds, together with its context: run ID, seed, perturbed
+activities, starting spectrum, the completed run IDs and the solver settings
+the loop state depends on (SOLVER_SETTINGS). The perturbation of a run is
+drawn from its own (seed, run) stream, so the seed is the whole RNG state.
+A checkpoint written with other solver settings is not continued.
+
+The state goes to one .npz file, written to <file>.tmp and moved over the
+previous checkpoint with os.replace: a crash while saving leaves the last
+complete checkpoint. Passing the saved state back to solve() continues the
+run bit for bit where it stopped.
+"""
+
+import os
+import time
+
+import numpy as np
+
+
+CHECKPOINT_SUFFIX = "_checkpoint.npz"
+CHECKPOINT_INTERVAL = 60.0   # seconds between two checkpoints
+CHECKPOINT_VERSION = 1
+# SpectrumUnfolder attributes a saved loop state is only valid for
+SOLVER_SETTINGS = ("method", "learning_rate", "loss_threshold", "smoothness", "formulation", "rescale")
+
+
+def checkpoint_path(path):
+    """Checkpoint file written next to a result file."""
+    return os.path.splitext(path)[0] + CHECKPOINT_SUFFIX
+
+
+class Checkpointer:
+    """Time-throttled, atomic .npz checkpoints of one campaign."""
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.context = {}             # saved with every state: run, seed, b, x0, completed
+        self._last = time.monotonic()
+
+    def due(self):
+        return time.monotonic() - self._last >= self.interval
+
+    def save(self, state):
+        """Write context + state atomically."""
+        arrays = dict(self.context, **state)
+        arrays["version"] = CHECKPOINT_VERSION
+        temporary = self.path + ".tmp"
+        with open(temporary, 'wb') as file:
+            np.savez(file, **arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+        self._last = time.monotonic()
+
+    def load(self):
+        """Saved arrays as a dict, None without a checkpoint."""
+        if not os.path.exists(self.path):
+            return None
+        with np.load(self.path) as data:
+            saved = {name: data[name] for name in data.files}
+        if int(saved["version"]) != CHECKPOINT_VERSION:
+            raise ValueError(f"{self.path}: unsupported checkpoint version {int(saved['version'])}.")
+        return saved
+
+    def remove(self):
+        for path in (self.path, self.path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def solver_settings(unfolder):
+    """The SOLVER_SETTINGS of a SpectrumUnfolder, as saved in its checkpoints."""
+    return {name: getattr(unfolder, name) for name in SOLVER_SETTINGS}
+
+
+def settings_changed(saved, settings):
+    """Names of the solver settings that differ from those of a saved checkpoint (all of them if not saved)."""
+    return [name for name, value in settings.items()
+            if "solver_" + name not in saved or saved["solver_" + name].item() != value]
+
+
+def run_context(run, seed, b_vector, x0, completed, settings=None):
+    """Context of a Monte Carlo run, saved with each of its checkpoints; settings: solver_settings()."""
+    context = {
+        "run": run,
+        "seed": str(seed),   # SeedSequence entropy can exceed 64 bits
+        "b": np.asarray(b_vector, dtype=np.float64),
+        "x0": np.asarray(x0, dtype=np.float64),
+        "completed": np.array(sorted(completed), dtype=np.int64),
+    }
+    for name, value in (settings or {}).items():
+        context["solver_" + name] = value
+    return context
+
+
+def run_state(saved, run, seed, b_vector, x0, settings=None):
+    """The saved solver state if it belongs to this run of this campaign and these settings, else None."""
+    if saved is None or int(saved["run"]) != run or str(saved["seed"]) != str(seed):
+        return None
+    if settings is not None and settings_changed(saved, settings):
+        return None
+    if not (np.array_equal(saved["b"], np.asarray(b_vector, dtype=np.float64))
+            and np.array_equal(saved["x0"], np.asarray(x0, dtype=np.float64))):
+        return None
+    return saved
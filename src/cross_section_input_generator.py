@@ -12,8 +12,23 @@ import tkinter as tk
 from tkinter import filedialog, messagebox
 import numpy as np
 import csv
-import math
 import os
+from threading import Thread
+from cross_section_processing import process_file, read_energy_bins, read_group_structure
+from response_matrix_builder import build_response_matrices, output_paths, read_manifest, write_parameter_csv
+
+
+BATCH_POLL_MS = 100   # how often the Tk side checks whether a manifest build has finished
+
+
+# Group collapse choices of the tab: label -> (method, weighting)
+COLLAPSE_OPTIONS = {
+    "Point average (original)": ("average", "flat"),
+    "Integrated, flat weight": ("integral", "flat"),
+    "Integrated, 1/E weight": ("integral", "1/E"),
+    "Integrated, Maxwellian + 1/E + fission": ("integral", "maxwell-1/E-fission"),
+    "Integrated, weighted by the energy bin file flux": ("integral", "prior"),
+}
 
 
 def create_cross_section_tab(parent):
@@ -21,7 +36,9 @@ def create_cross_section_tab(parent):
 
     file_path_var = tk.StringVar()
     energy_file_path_var = tk.StringVar()
+    collapse_var = tk.StringVar(value=next(iter(COLLAPSE_OPTIONS)))
     entries = {}
+    batch = {"thread": None, "saved": None, "error": None}   # running manifest build and its outcome
     
     
     def select_file():
@@ -42,77 +59,11 @@ def create_cross_section_tab(parent):
             messagebox.showerror("Error", "The specified energy bin file does not exist. Please select again.")
             return []
         try:
-            bins = []
-            with open(energy_file_path, 'r') as file:
-                lines = file.readlines()[1:]  # Skip the first line, start from the second line
-                for line in lines:
-                    parts = line.strip().split()
-                    if len(parts) >= 3:  # Ensure each line has at least 3 numbers
-                        try:
-                            value = float(parts[0]) * 1e6  # Take the first number and convert to eV
-                            bins.append(value)
-                        except ValueError:
-                            continue
-            return bins
+            return read_energy_bins(energy_file_path).tolist()  # 1st column in MeV -> eV
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred while reading the energy bin file: {e}")
             return []
 
-    def process_file(file_path, material_mass, atomic_mass, half_life, irradiation_time, cooling_time, energy_bins):
-        with open(file_path, 'r') as file:
-            lines = file.readlines()  #Read the entire file at once and store each line as an element in a list
-        
-        data = []
-        start_index = 8  # Assume the data starts from line 9
-        for line in lines[start_index:]:
-            parts = line.strip().split()  #line.strip(): Remove all leading and trailing whitespace characters from the line.
-                                          #.split(): Split the string into a list using whitespace as the delimiter.
-            if len(parts) >= 2:
-                try:
-                    x1 = float(parts[0].replace('D', 'E'))
-                    x2 = float(parts[1].replace('D', 'E'))
-                    data.append((x1, x2)) #Store the first and second values of each line into data (x1, x2)
-                except ValueError:
-                    continue
-        
-        result_list = [0]
-        for i in range(len(energy_bins) - 1):
-            lower, upper = energy_bins[i], energy_bins[i + 1]
-            filtered_values = [x2 for x1, x2 in data if lower <= x1 < upper]
-
-            if filtered_values:
-                avg_value = sum(filtered_values) / len(filtered_values)
-            else:
-                # This bin has no data; determine whether linear interpolation is possible.
-                midpoint = (lower + upper) / 2
-                left = None
-                right = None
-
-                for x1, x2 in data:
-                    if x1 < midpoint:
-                        left = (x1, x2)
-                    elif x1 > midpoint and right is None:
-                        right = (x1, x2)
-                        break
-
-                if left and right:
-                    # Interpolable
-                    x0, y0 = left
-                    x1, y1 = right
-                    avg_value = y0 + (midpoint - x0) * (y1 - y0) / (x1 - x0)
-                else:
-                    # Not interpolable (at boundary)
-                    avg_value = 0
-
-            result_list.append(avg_value)
-        
-        decay_constant = 0.693 / half_life
-        avogadro_number = 6.022e23
-        last_input = (material_mass / atomic_mass) * avogadro_number * (1 - math.exp(-decay_constant * irradiation_time)) * math.exp(-decay_constant * cooling_time) * 10**-24
-        result_list = [x * last_input for x in result_list]
-        
-        return result_list
-
     def process_and_save():
         file_path = file_path_var.get()
         energy_file_path = energy_file_path_var.get()
@@ -133,7 +84,10 @@ def create_cross_section_tab(parent):
             if not energy_bins:
                 return
             
-            results = process_file(file_path, mass, atomic_mass, half_life, irradiation_time, cooling_time, energy_bins)
+            method, weighting = COLLAPSE_OPTIONS[collapse_var.get()]
+            prior = read_group_structure(energy_file_path) if weighting == "prior" else None
+            results = process_file(file_path, mass, atomic_mass, half_life, irradiation_time, cooling_time, energy_bins,
+                                   method=method, weighting=weighting, prior=prior)
             
             output_filename = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")], title="Select Save Location", confirmoverwrite=False )
             if not output_filename:
@@ -153,6 +107,52 @@ def create_cross_section_tab(parent):
             messagebox.showinfo("Save Complete", f"Results have been saved to {output_filename}")
         except ValueError:
             messagebox.showerror("Error", "Please ensure all input values are valid numbers!")
+    def batch_build():
+        # Whole foil set from a manifest CSV, for one or more energy bin files at once
+        manifest_path = filedialog.askopenfilename(title="Select Foil Manifest", filetypes=[("CSV files", "*.csv")])
+        if not manifest_path:
+            return
+        group_files = filedialog.askopenfilenames(title="Select Energy Bin File(s) (Unit: MeV)", filetypes=[("Text files", "*.txt")])
+        if not group_files:
+            return
+        output_dir = filedialog.askdirectory(title="Select Output Folder")
+        if not output_dir:
+            messagebox.showwarning("Save Canceled", "No save location selected. The result was not saved.")
+            return
+        # The process pool runs on a worker thread so that the window stays responsive
+        method, weighting = COLLAPSE_OPTIONS[collapse_var.get()]
+        batch.update(saved=None, error=None)
+        batch["thread"] = Thread(target=batch_worker, args=(manifest_path, list(group_files), output_dir,
+                                                            method, weighting), daemon=True)
+        batch_button.config(state=tk.DISABLED, text="Batch Processing... please wait")
+        batch["thread"].start()
+        frame.after(BATCH_POLL_MS, poll_batch)
+
+    def batch_worker(manifest_path, group_files, output_dir, method, weighting):
+        # Worker thread: no Tk calls here, poll_batch reports the outcome
+        try:
+            foils = read_manifest(manifest_path)
+            matrices = build_response_matrices(foils, group_files, method, weighting)
+            saved = []
+            for group_file, path in output_paths(manifest_path, group_files, output_dir).items():
+                energy_bins, rows = matrices[group_file]
+                write_parameter_csv(path, energy_bins, rows)
+                saved.append(path)
+            batch["saved"] = saved
+        except Exception as e:
+            batch["error"] = e
+
+    def poll_batch():
+        if batch["thread"].is_alive():
+            frame.after(BATCH_POLL_MS, poll_batch)
+            return
+        batch["thread"] = None
+        batch_button.config(state=tk.NORMAL, text="Batch Processing from Foil Manifest")
+        if batch["error"] is not None:
+            messagebox.showerror("Error", f"Batch processing failed: {batch['error']}")
+        else:
+            messagebox.showinfo("Save Complete", "Results have been saved to:\n" + "\n".join(batch["saved"]))
+
     # --- UI ---
     tk.Button(frame, text="Select Reaction Cross-Section Data File", command=select_file).pack(pady=5)
     tk.Button(frame, text="Select Energy Bin File (Unit: MeV)", command=select_energy_file).pack(pady=5)
@@ -178,7 +178,14 @@ def create_cross_section_tab(parent):
         entry.pack(side="left", padx=5)
         entries[key] = entry
 
+    row = tk.Frame(frame)
+    row.pack(pady=3)
+    tk.Label(row, text="Group cross-section collapse").pack(side="left")
+    tk.OptionMenu(row, collapse_var, *COLLAPSE_OPTIONS).pack(side="left", padx=5)
+
     tk.Button(frame, text="Start Processing", command=process_and_save, bg="lightblue").pack(pady=15)
+    batch_button = tk.Button(frame, text="Batch Processing from Foil Manifest", command=batch_build)
+    batch_button.pack(pady=5)
 
     return frame    
 #%%
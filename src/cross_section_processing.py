@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Group collapsing of pointwise cross sections (no GUI).
+
+Used by the Data Preparation tab (cross_section_input_generator.py) and by
+batch tools that build response matrices without a display.
+"""
+
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from endf_reader import INTERPOLATION_LAWS, CrossSectionHeader, read_cross_section_file, read_group_file
+
+
+AVOGADRO_NUMBER = 6.022e23
+BARN = 1e-24              # cm²
+
+COLLAPSE_METHODS = ("average", "integral")
+WEIGHTINGS = ("flat", "1/E", "maxwell-1/E-fission", "prior")
+
+# Parsed tables are cached in this folder next to the cross-section files:
+# <name>.npy holds the rows energy / sigma / interpolation code (memory-mapped on load),
+# <name>.json the size, mtime and SHA-256 of the source and its header metadata
+CACHE_DIR = ".speckit_cache"
+CACHE_VERSION = 2
+
+
+def _file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_paths(file_path):
+    folder, name = os.path.split(os.path.abspath(file_path))
+    cache_dir = os.path.join(folder, CACHE_DIR)
+    return cache_dir, os.path.join(cache_dir, name + ".npy"), os.path.join(cache_dir, name + ".json")
+
+
+def _write_cache(table_path, meta_path, table, meta):
+    # Written to temporary files first so that a concurrent reader never sees half a cache entry
+    os.makedirs(os.path.dirname(table_path), exist_ok=True)
+    tmp = f"{table_path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as file:
+        np.save(file, table)
+    os.replace(tmp, table_path)
+    tmp = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as file:
+        json.dump(meta, file, indent=1)
+    os.replace(tmp, meta_path)
+
+
+def load_cross_section(file_path, use_cache=True):
+    """
+    Energy (eV), cross section (b), interpolation codes and CrossSectionHeader of a file.
+
+    With use_cache the parsed table is kept in CACHE_DIR next to the file and
+    memory-mapped on later loads. An entry is reused while the file size and
+    mtime are unchanged; if only the mtime changed the SHA-256 decides.
+    A read-only folder simply means no cache.
+    """
+    if not use_cache:
+        return read_cross_section_file(file_path)
+
+    stat = os.stat(file_path)
+    _, table_path, meta_path = _cache_paths(file_path)
+    try:
+        with open(meta_path, 'r') as file:
+            meta = json.load(file)
+        if meta.get("version") != CACHE_VERSION or not os.path.exists(table_path):
+            meta = None
+    except (OSError, ValueError):
+        meta = None
+
+    digest = None
+    if meta is not None and (meta["size"], meta["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+        digest = _file_digest(file_path)
+        if meta["sha256"] == digest:
+            meta.update(mtime_ns=stat.st_mtime_ns)   # touched, not changed
+            try:
+                _write_cache(table_path, meta_path, np.load(table_path), meta)
+            except OSError:
+                pass
+        else:
+            meta = None
+
+    if meta is not None:
+        try:
+            table = np.load(table_path, mmap_mode='r')
+            return table[0], table[1], table[2].astype(np.int8), CrossSectionHeader.from_dict(meta["header"])
+        except (OSError, ValueError):
+            pass   # damaged entry: parse again
+
+    energy, sigma, laws, header = read_cross_section_file(file_path)
+    meta = {
+        "version": CACHE_VERSION,
+        "source": os.path.basename(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest or _file_digest(file_path),
+        "header": header.to_dict(),
+    }
+    try:
+        _write_cache(table_path, meta_path, np.vstack([energy, sigma, laws]), meta)
+    except OSError:
+        pass
+    return energy, sigma, laws, header
+
+
+def read_cross_section_table(file_path, use_cache=True):
+    """Energy (eV), cross section (b) and ENDF interpolation code of every data line."""
+    energy, sigma, laws, _ = load_cross_section(file_path, use_cache)
+    return energy, sigma, laws
+
+
+def read_cross_section(file_path):
+    """Energy (eV) and cross section (b) columns of a cross-section file."""
+    energy, sigma, _ = read_cross_section_table(file_path)
+    return energy, sigma
+
+
+def read_group_structure(energy_file_path):
+    """Group boundaries (eV, 1st column in MeV) and prior flux (2nd column) of an energy bin file."""
+    energy, flux = read_group_file(energy_file_path)
+    return energy * 1e6, flux
+
+
+def read_energy_bins(energy_file_path):
+    """Group boundaries (eV) from the 1st column (MeV) of an energy bin file, skipping the header line."""
+    return read_group_structure(energy_file_path)[0]
+
+
+def collapse_to_groups(energy, sigma, energy_bins):
+    """
+    Average cross section of every group [E_i, E_i+1).
+
+    Groups without data points take the linear interpolation at the group
+    midpoint between the nearest points on either side (0 at the ends of the
+    data). The returned array starts with a 0 for the first boundary, so it has
+    one value per entry of energy_bins.
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    sigma = np.asarray(sigma, dtype=np.float64)
+    energy_bins = np.asarray(energy_bins, dtype=np.float64)
+    num_groups = len(energy_bins) - 1
+    if num_groups < 1:
+        return np.zeros(len(energy_bins))
+
+    # Group index of every point; points outside [E_0, E_last) are dropped
+    group = np.searchsorted(energy_bins, energy, side='right') - 1
+    inside = (group >= 0) & (group < num_groups)
+    counts = np.bincount(group[inside], minlength=num_groups)
+    sums = np.bincount(group[inside], weights=sigma[inside], minlength=num_groups)
+
+    values = np.zeros(num_groups)
+    filled = counts > 0
+    values[filled] = sums[filled] / counts[filled]
+
+    empty = np.flatnonzero(~filled)
+    if len(empty) and len(energy):
+        order = np.argsort(energy, kind='stable')
+        e_sorted = energy[order]
+        s_sorted = sigma[order]
+        midpoint = (energy_bins[empty] + energy_bins[empty + 1]) / 2
+        # Nearest point strictly below and strictly above the midpoint
+        left = np.searchsorted(e_sorted, midpoint, side='left') - 1
+        right = np.searchsorted(e_sorted, midpoint, side='right')
+        ok = (left >= 0) & (right < len(e_sorted))
+        x0, y0 = e_sorted[left[ok]], s_sorted[left[ok]]
+        x1, y1 = e_sorted[right[ok]], s_sorted[right[ok]]
+        values[empty[ok]] = y0 + (midpoint[ok] - x0) * (y1 - y0) / (x1 - x0)
+
+    return np.concatenate(([0.0], values))
+
+
+# Gauss-Legendre nodes on [-1, 1], applied in ln(E) on every integration panel
+_GAUSS_NODES, _GAUSS_WEIGHTS = np.polynomial.legendre.leggauss(8)
+
+# Maxwellian + 1/E + fission weighting (NJOY iwt=4 constants, eV)
+THERMAL_TEMPERATURE = 0.0253
+THERMAL_BREAK = 0.1
+FISSION_BREAK = 820.3e3
+FISSION_TEMPERATURE = 1.415e6
+
+
+def _maxwell_1e_fission(E):
+    # Pieces scaled to join continuously at the two break energies
+    c_thermal = 1.0 / (THERMAL_BREAK ** 2 * np.exp(-THERMAL_BREAK / THERMAL_TEMPERATURE))
+    c_fission = 1.0 / (FISSION_BREAK ** 1.5 * np.exp(-FISSION_BREAK / FISSION_TEMPERATURE))
+    return np.where(E < THERMAL_BREAK, c_thermal * E * np.exp(-E / THERMAL_TEMPERATURE),
+                    np.where(E < FISSION_BREAK, 1.0 / E,
+                             c_fission * np.sqrt(E) * np.exp(-E / FISSION_TEMPERATURE)))
+
+
+def prior_weighting(prior_energy, prior_flux):
+    """
+    Weighting function w(E) from a group prior (energies in eV, one flux per group upper boundary).
+
+    The flux per lethargy of each group is placed at the group's geometric
+    midpoint and interpolated linearly in ln(E); groups where the prior is
+    zero fall back to a 1/E shape.
+    """
+    prior_energy = np.asarray(prior_energy, dtype=np.float64)
+    prior_flux = np.asarray(prior_flux, dtype=np.float64)
+    lethargy_width = np.log(prior_energy[1:] / prior_energy[:-1])
+    per_lethargy = prior_flux[1:] / lethargy_width
+    midpoint = 0.5 * (np.log(prior_energy[1:]) + np.log(prior_energy[:-1]))
+    floor = 1e-12 * max(per_lethargy.max(), 1e-300)
+
+    def weighting(E):
+        return (np.interp(np.log(E), midpoint, per_lethargy) + floor) / E
+
+    return weighting
+
+
+def weighting_function(weighting, prior=None):
+    """w(E) for one of WEIGHTINGS; prior is (energy_eV, flux) and is needed for "prior"."""
+    if weighting == "flat":
+        return np.ones_like
+    if weighting == "1/E":
+        return np.reciprocal
+    if weighting == "maxwell-1/E-fission":
+        return _maxwell_1e_fission
+    if weighting == "prior":
+        if prior is None:
+            raise ValueError("Prior weighting needs a prior spectrum")
+        return prior_weighting(*prior)
+    raise ValueError(f"Unknown weighting '{weighting}', expected one of {', '.join(WEIGHTINGS)}")
+
+
+def _interpolate(x0, y0, x1, y1, law, x):
+    """σ at x inside panels [x0, x1] following the ENDF interpolation law of each panel."""
+    t_lin = (x - x0) / (x1 - x0)
+    t_log = np.log(x / x0) / np.log(x1 / x0)
+    positive = (y0 > 0) & (y1 > 0)
+    safe_y0 = np.where(positive, y0, 1.0)
+    safe_y1 = np.where(positive, y1, 1.0)
+    linear = y0 + (y1 - y0) * t_lin
+    result = np.select(
+        [law == INTERPOLATION_LAWS["histogram"], law == INTERPOLATION_LAWS["lin-log"],
+         (law == INTERPOLATION_LAWS["log-lin"]) & positive, (law == INTERPOLATION_LAWS["log-log"]) & positive],
+        [y0, y0 + (y1 - y0) * t_log,
+         safe_y0 * (safe_y1 / safe_y0) ** t_lin,
+         safe_y0 * (safe_y1 / safe_y0) ** t_log],
+        default=linear)
+    return result
+
+
+def integrate_to_groups(energy, sigma, laws, energy_bins, weighting="flat", prior=None):
+    """
+    Weighted group cross sections ∫σ(E)w(E)dE / ∫w(E)dE.
+
+    σ(E) follows the tabulated interpolation law between data points and is 0
+    outside the tabulated range. The integration grid is the union of data
+    points and group boundaries, so every panel lies inside one group and one
+    data interval; each panel is integrated with 8-point Gauss-Legendre in
+    ln(E). Returns the same layout as collapse_to_groups (leading 0).
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    sigma = np.asarray(sigma, dtype=np.float64)
+    laws = np.asarray(laws)
+    energy_bins = np.asarray(energy_bins, dtype=np.float64)
+    num_groups = len(energy_bins) - 1
+    if num_groups < 1:
+        return np.zeros(len(energy_bins))
+    w = weighting_function(weighting, prior)
+
+    order = np.argsort(energy, kind='stable')
+    energy, sigma, laws = energy[order], sigma[order], laws[order]
+
+    lo, hi = energy_bins[0], energy_bins[-1]
+    grid = np.unique(np.concatenate((energy_bins, energy[(energy > lo) & (energy < hi)])))
+    left, right = grid[:-1], grid[1:]
+    group = np.searchsorted(energy_bins, left, side='right') - 1
+
+    # Gauss points of every panel in u = ln(E)
+    u_left, u_right = np.log(left), np.log(right)
+    half_width = 0.5 * (u_right - u_left)
+    u = 0.5 * (u_left + u_right)[:, None] + half_width[:, None] * _GAUSS_NODES[None, :]
+    E = np.exp(u)
+    jacobian = (half_width[:, None] * _GAUSS_WEIGHTS[None, :]) * E     # dE = E du
+    weight = w(E) * jacobian
+
+    # Data interval containing each panel (last point at or below its left edge)
+    k = np.searchsorted(energy, left, side='right') - 1
+    covered = (k >= 0) & (k < len(energy) - 1)
+    kk = np.clip(k, 0, max(len(energy) - 2, 0))
+    cross_section = np.zeros_like(E)
+    if len(energy) >= 2:
+        x0, x1 = energy[kk][:, None], energy[kk + 1][:, None]
+        y0, y1 = sigma[kk][:, None], sigma[kk + 1][:, None]
+        law = laws[kk][:, None]
+        valid = covered[:, None] & (x1 > x0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cross_section = np.where(valid, _interpolate(x0, y0, x1, y1, law, E), 0.0)
+
+    numerator = np.bincount(group, weights=(cross_section * weight).sum(axis=1), minlength=num_groups)
+    denominator = np.bincount(group, weights=weight.sum(axis=1), minlength=num_groups)
+    values = np.divide(numerator, denominator, out=np.zeros(num_groups), where=denominator > 0)
+    return np.concatenate(([0.0], values))
+
+
+def activation_factor(material_mass, atomic_mass, half_life, irradiation_time, cooling_time):
+    """Number of target atoms × saturation × decay × barn conversion (times in hours)."""
+    decay_constant = 0.693 / half_life
+    return ((material_mass / atomic_mass) * AVOGADRO_NUMBER
+            * (1 - math.exp(-decay_constant * irradiation_time))
+            * math.exp(-decay_constant * cooling_time) * BARN)
+
+
+def group_cross_sections(file_path, energy_bins, method="average", weighting="flat", prior=None):
+    """
+    Group cross sections of one reaction file.
+
+    method "average" averages the points inside each group (original behaviour),
+    "integral" integrates under the tabulated interpolation law with a weighting
+    spectrum (see integrate_to_groups).
+    """
+    if method == "average":
+        energy, sigma = read_cross_section(file_path)
+        return collapse_to_groups(energy, sigma, energy_bins)
+    if method == "integral":
+        energy, sigma, laws = read_cross_section_table(file_path)
+        return integrate_to_groups(energy, sigma, laws, energy_bins, weighting, prior)
+    raise ValueError(f"Unknown collapse method '{method}', expected one of {', '.join(COLLAPSE_METHODS)}")
+
+
+def process_file(file_path, material_mass, atomic_mass, half_life, irradiation_time, cooling_time, energy_bins,
+                 method="average", weighting="flat", prior=None):
+    """One row of the A matrix: group cross sections of file_path times the activation factor."""
+    groups = group_cross_sections(file_path, energy_bins, method, weighting, prior)
+    last_input = activation_factor(material_mass, atomic_mass, half_life, irradiation_time, cooling_time)
+    return [x * last_input for x in groups.tolist()]
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Leave-one-foil-out cross-validation of an unfolded spectrum.
+
+A foil whose measured activity is off (wrong mass, wrong cooling time) is
+absorbed quietly by the unfolding. Solving the problem again without foil i
+and predicting its activity a_i·x⁽⁻ⁱ⁾ from the other foils shows whether it
+agrees with them:
+
+    z_i = (b_i - ρ_i a_i·x⁽⁻ⁱ⁾) / sqrt(b_error_i² + Var(ρ_i a_i·x⁽⁻ⁱ⁾))
+
+The gradient solver stops at an absolute loss threshold that the largest
+activities dominate, so the full solution itself can miss whole groups of
+foils by a common factor (e.g. every fast foil at A·x/b ≈ 0.77). ρ_i is that
+misfit b_j / a_j·x of the full solution around foil i: the median over the
+other foils weighted by the overlap of their reaction-rate distributions
+a_j∘x / a_j·x with that of foil i. Only disagreement beyond it is scored.
+
+All m subproblems are solved together from one factorization. With the
+active set F and the row Gram matrix K = A_F A_Fᵀ of the full solution
+(see linear_uncertainty), subproblem i is the gradient run on the rows
+j ≠ i, i.e. a Landweber iteration on K without row and column i: the m
+(m-1, m-1) matrices are diagonalized in one stacked eigh, the epoch at which
+each run reaches the data loss of the full solution is found from the
+eigenvalues, and x⁽⁻ⁱ⁾ = x + (x_k⁽⁻ⁱ⁾ - x_k) on F, the difference of the
+linearized subproblem and full runs. exact=True runs the m subproblems
+through SpectrumUnfolder.solve_batch instead (row_mask): one batched solve,
+a few times the time of a single one.
+
+Foils with a leverage ∂(a_i·x)/∂b_i above LEVERAGE_LIMIT are the only ones
+constraining their groups (e.g. Au-197 for the thermal region); the others
+cannot predict them and they are reported as unchecked, not inconsistent.
+
+    python -m cross_validation problem.csv prior.txt
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from linear_uncertainty import active_row_gram, landweber_gain
+from unfolding_engine import MIN_FLUX, SpectrumUnfolder, load_prior, load_problem
+
+
+# |z| above which a foil is reported as inconsistent with the others
+Z_LIMIT = 3.0
+# Leverage ∂(a_i·x)/∂b_i above which the foil is the only one constraining its groups:
+# the others cannot predict it, and a large |z| says nothing about its activity
+LEVERAGE_LIMIT = 0.5
+
+
+class LeaveOneOut:
+    """Prediction of every foil from the others and its influence on the spectrum."""
+
+    def __init__(self, names, energies, x, measured, b_error, predicted, prediction_std, leverage, spectra,
+                 fitted, misfit, misfit_rsd, exact=False):
+        self.names = list(names)
+        self.energies = np.asarray(energies, dtype=np.float64)
+        self.x = np.ravel(np.asarray(x, dtype=np.float64))   # spectrum with all foils
+        self.measured = measured              # b (m,)
+        self.b_error = b_error                # (m,)
+        self.predicted = predicted            # a_i·x⁽⁻ⁱ⁾ (m,)
+        self.prediction_std = prediction_std  # linearized std of the prediction (m,)
+        self.leverage = leverage              # ∂(a_i·x)/∂b_i of the full solution (m,)
+        self.spectra = spectra                # x⁽⁻ⁱ⁾ (m, n)
+        self.fitted = fitted                  # a_i·x of the full solution (m,)
+        self.misfit = misfit                  # ρ_i: b_j / a_j·x of the full solution around foil i (m,)
+        self.misfit_rsd = misfit_rsd          # relative std of ρ_i (m,)
+        self.exact = exact                    # spectra from solve_batch rather than the linearization
+
+    @property
+    def expected(self):
+        """Prediction from the other foils, corrected by the misfit of the full solution around the foil."""
+        return self.misfit * self.predicted
+
+    @property
+    def z(self):
+        sigma = np.sqrt(np.square(self.b_error) + np.square(self.misfit * self.prediction_std)
+                        + np.square(self.expected * self.misfit_rsd))
+        return np.divide(self.measured - self.expected, sigma, out=np.full(len(sigma), np.nan), where=sigma > 0)
+
+    @property
+    def flux_change(self):
+        """Relative change of the total flux when the foil is left out."""
+        return self.spectra.sum(axis=1) / self.x.sum() - 1.0
+
+    @property
+    def spectrum_shift(self):
+        """Fraction of the flux moved between groups: Σ|x⁽⁻ⁱ⁾ - x| / Σx."""
+        return np.abs(self.spectra - self.x).sum(axis=1) / self.x.sum()
+
+    def inconsistent(self, limit=Z_LIMIT):
+        """Foils the others predict with |z| > limit (foils above LEVERAGE_LIMIT are not judged)."""
+        return [name for name, z, h in zip(self.names, self.z, self.leverage) if abs(z) > limit and h < LEVERAGE_LIMIT]
+
+    def unchecked(self):
+        """Foils above LEVERAGE_LIMIT: no other foil constrains their groups."""
+        return [name for name, h in zip(self.names, self.leverage) if h >= LEVERAGE_LIMIT]
+
+    def table(self):
+        import pandas as pd
+
+        return pd.DataFrame({
+            "Foil": self.names,
+            "Measured": self.measured,
+            "Activity Error": self.b_error,
+            "Predicted": self.predicted,
+            "Prediction Std": self.prediction_std,
+            "Predicted/Measured": self.predicted / self.measured,
+            "Fitted": self.fitted,
+            "Regional Misfit": self.misfit,
+            "z": self.z,
+            "Leverage": self.leverage,
+            "Total Flux Change": self.flux_change,
+            "Spectrum Shift": self.spectrum_shift,
+        })
+
+    def lines(self, limit=Z_LIMIT):
+        lines = [f"{'Foil':>12} {'measured':>11} {'predicted':>11} {'pred/meas':>9} {'misfit':>7} {'z':>7} "
+                 f"{'leverage':>8} {'flux chg':>9} {'shift':>7}"]
+        for name, measured, predicted, rho, z, h, change, shift in zip(self.names, self.measured, self.predicted,
+                                                                       self.misfit, self.z, self.leverage,
+                                                                       self.flux_change, self.spectrum_shift):
+            if h >= LEVERAGE_LIMIT:
+                flag = "  (only foil constraining its groups)"
+            else:
+                flag = "  <- inconsistent" if abs(z) > limit else ""
+            lines.append(f"{name:>12} {measured:11.4e} {predicted:11.4e} {predicted / measured:9.3f} {rho:7.3f} {z:7.2f} "
+                         f"{h:8.3f} {change:9.2%} {shift:7.2%}{flag}")
+        return lines
+
+
+def _subproblem_rows(m):
+    # Row j of subproblem i: indices of the m - 1 foils other than i
+    return np.array([[j for j in range(m) if j != i] for i in range(m)], dtype=np.int64).reshape(m, m - 1)
+
+
+def _regional_misfit(A, x, b, sigma):
+    """
+    a·x of every foil, and the misfit b / a·x of the full solution around it with its relative std:
+    weighted median over the other foils, weighted by the overlap of their reaction-rate distributions.
+    """
+    fitted = A @ x
+    share = np.divide(A * x, fitted[:, None], out=np.zeros_like(A), where=fitted[:, None] > 0)
+    overlap = np.minimum(share[:, None, :], share[None, :, :]).sum(axis=2)
+    np.fill_diagonal(overlap, 0.0)
+    ratio = np.divide(b, fitted, out=np.ones(len(b)), where=fitted > 0)
+    order = np.argsort(ratio, kind="stable")
+    cumulative = np.cumsum(overlap[:, order], axis=1)
+    total = cumulative[:, -1]
+    median = order[np.argmax(cumulative >= total[:, None] / 2, axis=1)]
+    # A foil sharing no group with the others is compared with its plain prediction
+    misfit = np.where(total > 0, ratio[median], 1.0)
+    misfit_rsd = np.where(total > 0, np.divide(sigma[median], b[median], out=np.zeros(len(b)),
+                                               where=b[median] != 0), 0.0)
+    return fitted, misfit, misfit_rsd
+
+
+def _stopping_epochs(decay, projected, rows, target, max_epochs):
+    """Smallest k with Σ c^(2k) p² / rows <= target for every stack of eigen-decays c, by bisection."""
+    low = np.ones(len(target), dtype=np.int64)
+    high = np.full(len(target), max_epochs, dtype=np.int64)
+    with np.errstate(divide="ignore"):
+        log_decay = np.log(np.abs(decay))
+    for _ in range(int(np.ceil(np.log2(max(max_epochs, 2)))) + 1):
+        middle = (low + high) // 2
+        loss = np.sum(np.exp(2.0 * middle[:, None] * log_decay) * np.square(projected), axis=1) / rows
+        done = loss <= target
+        high = np.where(done, middle, high)
+        low = np.where(done, low, np.minimum(middle + 1, high))
+    return high
+
+
+def leave_one_out(unfolder, x0, b_vector, b_error, names=None, energies=None, result=None, row_gram=None,
+                  epochs=None, exact=False, callback=None):
+    """
+    Cross-validate every foil of a gradient solve of unfolder.solve(x0, b_vector).
+
+    result is the solve with all foils (solved here if None); epochs and
+    row_gram as in solution_jacobian. The subproblems keep the unfolder's
+    loss threshold.
+    """
+    if unfolder.method != "gradient":
+        raise ValueError("The leave-one-out diagnostic linearizes the gradient solver.")
+    if result is None:
+        result = unfolder.solve(x0, b_vector, callback=callback)
+    A = np.asarray(unfolder.A, dtype=np.float64)
+    m, n = A.shape
+    if m < 2:
+        raise ValueError("Leaving a foil out needs at least two foils.")
+    b = np.ravel(np.asarray(b_vector, dtype=np.float64))
+    sigma = np.ravel(np.asarray(b_error, dtype=np.float64))
+    x = np.ravel(np.asarray(result.x, dtype=np.float64))
+    x0 = np.ravel(np.asarray(x0, dtype=np.float64))
+    names = list(names) if names is not None else [f"Foil_{i+1}" for i in range(m)]
+    energies = np.arange(n) if energies is None else energies
+    epochs = result.epochs if epochs is None else epochs
+
+    active = (x0 != 0) & (x > MIN_FLUX)
+    A_active = A[:, active]
+    row_gram = active_row_gram(A, x0 != 0, active, row_gram)
+    rows = _subproblem_rows(m)
+
+    # Starting spectra of the full run and of the subproblems (epoch-0 rescaling over the rows kept)
+    x_start = np.where(x0 != 0, np.maximum(x0, MIN_FLUX), 0.0)
+    if unfolder.rescale:
+        ratio = (A @ x_start) / b
+        x_full_start = x_start / ratio.mean()
+        x_sub_start = x_start / ratio[rows].mean(axis=1, keepdims=True)
+    else:
+        x_full_start = x_start
+        x_sub_start = np.tile(x_start, (m, 1))
+    residual_full = A @ x_full_start - b
+    residual_sub = np.take_along_axis(x_sub_start @ A.T, rows, axis=1) - b[rows]
+
+    # One stacked eigendecomposition of the m leave-one-out Gram matrices, plus the full one
+    sigma2_full, U_full = np.linalg.eigh(row_gram)
+    sigma2_sub, U_sub = np.linalg.eigh(row_gram[rows[:, :, None], rows[:, None, :]])
+    sigma2_full = np.maximum(sigma2_full, 0.0)
+    sigma2_sub = np.maximum(sigma2_sub, 0.0)
+    rate_full = 2.0 * unfolder.learning_rate / m
+    rate_sub = 2.0 * unfolder.learning_rate / (m - 1)
+    projected_full = U_full.T @ residual_full
+    projected_sub = np.einsum("ikj,ik->ij", U_sub, residual_sub)
+
+    # Epochs: runs stopped by the threshold stop where their data loss reaches that of the full solution
+    if result.stop_reason == "threshold":
+        target = np.mean(np.square(A @ x - b))
+        k_full = _stopping_epochs(1.0 - np.minimum(rate_full * sigma2_full, 1.0)[None], projected_full[None],
+                                  m, np.array([target]), unfolder.max_epochs)[0]
+        k_sub = _stopping_epochs(1.0 - np.minimum(rate_sub * sigma2_sub, 1.0), projected_sub, m - 1,
+                                 np.full(m, target), unfolder.max_epochs)
+    else:
+        k_full = epochs
+        k_sub = np.full(m, epochs)
+
+    # x_k = x_s - A_Fᵀ U diag(φ/σ²) Uᵀ r_0 for the full run and every subproblem
+    gain_full = landweber_gain(sigma2_full, rate_full, k_full)
+    gain_sub = landweber_gain(sigma2_sub, rate_sub, k_sub[:, None])
+    step_full = A_active.T @ (U_full @ (gain_full * projected_full))
+    coefficients = np.einsum("ijk,ik->ij", U_sub, gain_sub * projected_sub)     # (m, m-1) weights of the rows kept
+    step_sub = np.einsum("ij,ijf->if", coefficients, A_active[rows])
+    x_full_model = x_full_start[active] - step_full
+    x_sub_model = x_sub_start[:, active] - step_sub
+
+    if exact:
+        batch = unfolder.solve_batch(x0, np.tile(b, (m, 1)), callback=callback, row_mask=~np.eye(m, dtype=bool))
+        spectra = batch.x
+    else:
+        spectra = np.tile(x, (m, 1))
+        spectra[:, active] = np.maximum(x[active] + x_sub_model - x_full_model, MIN_FLUX)
+    predicted = np.einsum("ij,ij->i", A, spectra)
+
+    # Var(a_i·x⁽⁻ⁱ⁾) = Σ_j (K_i,rows R_i)_j² b_error_j², R_i = U diag(φ/σ²) Uᵀ of subproblem i
+    K_cross = np.take_along_axis(row_gram, rows, axis=1)                        # (m, m-1)
+    sensitivity = np.einsum("ijk,ik->ij", U_sub, gain_sub * np.einsum("ikj,ik->ij", U_sub, K_cross))
+    prediction_std = np.sqrt(np.sum(np.square(sensitivity * sigma[rows]), axis=1))
+
+    # Leverage: diagonal of K R = U diag(φ) Uᵀ of the full run
+    phi = landweber_gain(sigma2_full, rate_full, epochs) * sigma2_full
+    leverage = np.square(U_full) @ phi
+    fitted, misfit, misfit_rsd = _regional_misfit(A, x, b, sigma)
+    return LeaveOneOut(names, energies, x, b, sigma, predicted, prediction_std, leverage, spectra, fitted, misfit,
+                       misfit_rsd, exact=exact)
+
+
+def write_leave_one_out(loo, stem):
+    """<stem>_loo.csv (one row per foil) and <stem>_loo_spectra.csv (spectrum without each foil)."""
+    import pandas as pd
+
+    loo.table().to_csv(stem + "_loo.csv", index=False)
+    pd.DataFrame(loo.spectra, index=loo.names, columns=loo.energies).to_csv(stem + "_loo_spectra.csv")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cross_validation",
+                                     description="Predict every foil's activity from the other foils.")
+    parser.add_argument("problem", help="activation product parameter CSV or problem bundle")
+    parser.add_argument("prior", nargs="?", default=None, help="initial spectrum file (optional for a bundle)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="output stem (default: <problem>): <stem>_loo.csv, <stem>_loo_spectra.csv")
+    parser.add_argument("--loss-threshold", type=float, default=None)
+    parser.add_argument("--learning-rate", type=float, default=1.0)
+    parser.add_argument("--max-epochs", type=int, default=500000)
+    parser.add_argument("--exact", action="store_true",
+                        help="solve the leave-one-out subproblems with the batched solver instead of linearizing")
+    parser.add_argument("--z-limit", type=float, default=Z_LIMIT)
+    args = parser.parse_args(argv)
+
+    problem = load_problem(args.problem)
+    if args.prior is not None:
+        x0 = load_prior(args.prior, problem.A.shape[1]).reshape(1, -1)
+    elif problem.prior is not None:
+        x0 = np.array(problem.prior, dtype=np.float32).reshape(1, -1)
+    else:
+        parser.error("a prior file is required unless the problem bundle contains one")
+    loss_threshold = args.loss_threshold if args.loss_threshold is not None else problem.loss_threshold
+
+    unfolder = SpectrumUnfolder(problem.A, loss_threshold, learning_rate=args.learning_rate,
+                                max_epochs=args.max_epochs, b_error=problem.b_error)
+    loo = leave_one_out(unfolder, x0, problem.b, problem.b_error, problem.names, problem.energies,
+                        exact=args.exact)
+    stem = args.output or os.path.splitext(args.problem)[0]
+    write_leave_one_out(loo, stem)
+
+    print("\n".join(loo.lines(args.z_limit)))
+    inconsistent = loo.inconsistent(args.z_limit)
+    if inconsistent:
+        print(f"Inconsistent with the other foils (|z| > {args.z_limit:g}): {', '.join(inconsistent)}")
+    else:
+        print(f"Every foil agrees with the others within |z| <= {args.z_limit:g}")
+    print(f"Saved {stem}_loo.csv and {stem}_loo_spectra.csv")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental unfolding: foils added, removed or changed one at a time.
+
+During a measurement campaign the activities arrive foil by foil. An
+IncrementalUnfolder keeps the state of the current problem between updates:
+
+- the rows of A, b and b_error, keyed by foil name;
+- the row Gram matrix K = A_F A_Fᵀ over the groups free in the prior, updated
+  with one new row and column per added foil in O(mn) instead of O(m²n);
+- the last solution, from which the next solve is warm-started
+  (SpectrumUnfolder(rescale=False), see warm_start).
+
+Each update is a warm restart of the same gradient solver, not an update of
+the solution itself: the solve never uses K, its speed-up comes from the warm
+start alone. K feeds the analytic error bars (linear_uncertainty) and
+the leave-one-out diagnostics (cross_validation); groups that end at MIN_FLUX
+are subtracted from it there (active_row_gram). The epochs of the chain of
+warm starts since the last cold solve are added up for the linearization.
+
+    python -m incremental day1.csv day2.csv day3.csv --prior prior.txt --cold
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from cross_validation import leave_one_out
+from linear_uncertainty import LinearizedUncertainty, solution_jacobian
+from unfolding_engine import SpectrumUnfolder, UnfoldingProblem, chi_square_threshold, load_prior, load_problem
+from warm_start import warm_start_spectrum
+
+
+# A warm start that has not converged after this fraction of the epochs of the
+# last cold solve is abandoned for a cold one (e.g. when removing a foil lowers
+# the threshold into directions the warm solution resolves slowly)
+WARM_BUDGET = 0.5
+
+
+def _row_keys(names):
+    # Foil names as row keys; repeated names get #2, #3, ...
+    keys, seen = [], {}
+    for name in names:
+        seen[name] = seen.get(name, 0) + 1
+        keys.append(name if seen[name] == 1 else f"{name}#{seen[name]}")
+    return keys
+
+
+class IncrementalUnfolder:
+    """Unfolding problem kept up to date row by row, solved from the previous spectrum."""
+
+    def __init__(self, problem, prior, loss_threshold=None, **solver_options):
+        self.energies = np.asarray(problem.energies)
+        self.prior = np.asarray(prior, dtype=np.float32).reshape(1, -1)
+        self.free = np.ravel(self.prior) != 0
+        self.names = []
+        self.A = np.zeros((0, len(self.energies)))
+        self.b = np.zeros(0)
+        self.b_error = np.zeros(0)
+        self.K = np.zeros((0, 0))
+        self.loss_threshold = loss_threshold   # None: 95% chi-square quantile of the current number of foils
+        self.solver_options = solver_options
+        self.x = None                 # last solution (1, n)
+        self.result = None            # its UnfoldingResult
+        self.epochs = 0               # epochs since the last cold solve
+        self.cold_epochs = None       # epochs of the last cold solve
+        self.warm = False             # whether the last solve was warm-started
+        for name, a, b, b_error in zip(_row_keys(problem.names), problem.A, np.ravel(problem.b),
+                                       np.ravel(problem.b_error)):
+            self.add_row(name, a, b, b_error)
+
+    @property
+    def problem(self):
+        return UnfoldingProblem(self.A, self.b.reshape(-1, 1), self.b_error.reshape(-1, 1), self.energies,
+                                list(self.names), loss_threshold=self.loss_threshold)
+
+    def add_row(self, name, a, b, b_error=0.0, index=None):
+        """Insert a foil at `index` (default: last)."""
+        if name in self.names:
+            raise ValueError(f"Foil '{name}' is already in the problem.")
+        index = len(self.names) if index is None else index
+        a = np.ravel(np.asarray(a, dtype=np.float64))
+        k = self.A[:, self.free] @ a[self.free]
+        c = float(a[self.free] @ a[self.free])
+
+        K = np.empty((len(k) + 1, len(k) + 1))
+        K[:-1, :-1] = self.K
+        K[:-1, -1] = K[-1, :-1] = k
+        K[-1, -1] = c
+        order = np.insert(np.arange(len(k)), index, len(k))
+        self.K = K[np.ix_(order, order)]
+
+        self.names.insert(index, name)
+        self.A = np.insert(self.A, index, a, axis=0)
+        self.b = np.insert(self.b, index, float(b))
+        self.b_error = np.insert(self.b_error, index, float(b_error))
+
+    def remove_row(self, name):
+        """Remove a foil; returns its index."""
+        index = self.names.index(name)
+        keep = np.arange(len(self.names)) != index
+        self.K = self.K[np.ix_(keep, keep)]
+        del self.names[index]
+        self.A = self.A[keep]
+        self.b = self.b[keep]
+        self.b_error = self.b_error[keep]
+        return index
+
+    def update_row(self, name, a=None, b=None, b_error=None):
+        """Change the response, activity and/or activity error of a foil."""
+        index = self.names.index(name)
+        a = self.A[index] if a is None else a
+        b = self.b[index] if b is None else b
+        b_error = self.b_error[index] if b_error is None else b_error
+        if np.array_equal(np.ravel(a), self.A[index]):
+            # Only the activity changed: K stays as it is
+            self.b[index] = float(b)
+            self.b_error[index] = float(b_error)
+            return
+        self.remove_row(name)
+        self.add_row(name, a, b, b_error, index=index)
+
+    def sync(self, problem):
+        """Apply the differences to `problem` (same group structure); returns [(action, foil name)]."""
+        if len(problem.energies) != len(self.energies) or not np.allclose(problem.energies, self.energies):
+            raise ValueError("The group structure changed: start a new IncrementalUnfolder.")
+        rows = {name: (a, b, b_error) for name, a, b, b_error in
+                zip(_row_keys(problem.names), np.asarray(problem.A, dtype=np.float64),
+                    np.ravel(problem.b), np.ravel(problem.b_error))}
+        changes = []
+        for name in [name for name in self.names if name not in rows]:
+            self.remove_row(name)
+            changes.append(("removed", name))
+        for name, (a, b, b_error) in rows.items():
+            if name not in self.names:
+                self.add_row(name, a, b, b_error)
+                changes.append(("added", name))
+                continue
+            index = self.names.index(name)
+            if (not np.array_equal(a, self.A[index]) or float(b) != self.b[index]
+                    or float(b_error) != self.b_error[index]):
+                self.update_row(name, a, b, b_error)
+                changes.append(("changed", name))
+        return changes
+
+    def threshold(self):
+        if self.loss_threshold is not None:
+            return self.loss_threshold
+        return chi_square_threshold(len(self.names))
+
+    def unfolder(self, rescale=True, cancel=None, max_epochs=None):
+        options = dict(self.solver_options)
+        if max_epochs is not None:
+            options["max_epochs"] = max_epochs
+        return SpectrumUnfolder(self.A, self.threshold(), b_error=self.b_error, rescale=rescale, cancel=cancel,
+                                **options)
+
+    def solve(self, callback=None, cancel=None, cold=False):
+        """
+        Unfold the current rows, warm-started from the last solution unless
+        cold=True or there is none; a warm start that needs more than
+        WARM_BUDGET of the last cold solve's epochs is replaced by a cold one.
+        """
+        b = self.b.reshape(-1, 1)
+        self.warm = self.x is not None and not cold
+        if self.warm:
+            budget = max(1, int(WARM_BUDGET * self.cold_epochs))
+            result = self.unfolder(rescale=False, cancel=cancel, max_epochs=budget).solve(
+                warm_start_spectrum(self.x, self.prior), b, callback=callback)
+            if result.stop_reason == "max_epochs" and budget < self.unfolder().max_epochs:
+                self.warm = False
+        if not self.warm:
+            result = self.unfolder(cancel=cancel).solve(self.prior, b, callback=callback)
+        if result.stop_reason != "cancelled":
+            self.x = result.x
+            self.result = result
+            self.epochs = (self.epochs if self.warm else 0) + result.epochs
+            if not self.warm:
+                self.cold_epochs = result.epochs
+        return result
+
+    def reset(self):
+        """Forget the last solution: the next solve starts from the prior."""
+        self.x = self.result = None
+        self.epochs = 0
+
+    def uncertainty(self):
+        """Analytic error bars of the last solution (gradient method), linearized over all epochs since the cold solve."""
+        if self.result is None:
+            raise ValueError("Nothing solved yet.")
+        jacobian = solution_jacobian(self.unfolder(), self.prior, self.b, self.result, epochs=self.epochs,
+                                     row_gram=self.K)
+        return LinearizedUncertainty(self.energies, self.result.x, jacobian, self.b_error, self.result)
+
+    def leave_one_out(self):
+        """Leave-one-foil-out diagnostic of the last solution (see cross_validation)."""
+        if self.result is None:
+            raise ValueError("Nothing solved yet.")
+        return leave_one_out(self.unfolder(), self.prior, self.b, self.b_error, self.names, self.energies,
+                             result=self.result, row_gram=self.K, epochs=self.epochs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m incremental",
+                                     description="Re-unfold a sequence of parameter files, each one warm-started "
+                                                 "from the previous solution.")
+    parser.add_argument("problems", nargs="+", help="parameter CSVs of the successive measurement states")
+    parser.add_argument("--prior", required=True, help="initial spectrum file")
+    parser.add_argument("--learning-rate", type=float, default=1.0)
+    parser.add_argument("--max-epochs", type=int, default=500000)
+    parser.add_argument("--cold", action="store_true", help="also solve every state from the prior, for comparison")
+    args = parser.parse_args(argv)
+
+    problems = [load_problem(path) for path in args.problems]
+    prior = load_prior(args.prior, problems[0].A.shape[1])
+    incremental = IncrementalUnfolder(problems[0], prior, learning_rate=args.learning_rate,
+                                      max_epochs=args.max_epochs)
+    for i, (path, problem) in enumerate(zip(args.problems, problems)):
+        changes = incremental.sync(problem)
+        start = time.perf_counter()
+        result = incremental.solve()
+        seconds = time.perf_counter() - start
+        uncertainty = incremental.uncertainty()
+        described = ", ".join(f"{action} {name}" for action, name in changes) or "initial problem"
+        print(f"{path}: {described}")
+        print(f"  {len(incremental.names)} foils, {'warm' if incremental.warm else 'cold'} start: "
+              f"{result.epochs} epochs in {seconds:.2f} s ({result.stop_reason}), "
+              f"total flux {uncertainty.mean_total_flux:.3e} ± {uncertainty.total_flux_rsd:.2%}")
+        if args.cold and i > 0:
+            start = time.perf_counter()
+            cold = incremental.unfolder().solve(incremental.prior, incremental.b.reshape(-1, 1))
+            print(f"  cold start: {cold.epochs} epochs in {time.perf_counter() - start:.2f} s ({cold.stop_reason}), "
+                  f"total flux {cold.x.sum():.3e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Analytic (linearized) error bars of the gradient solver.
+
+Instead of repeating the unfolding for num_runs perturbed activity vectors,
+the converged solution x(b) is linearized around the unperturbed b and b_error
+is propagated in one step:
+
+    Cov(x) = J diag(b_error²) Jᵀ,   J = ∂x/∂b
+
+On the active set F (groups above MIN_FLUX; groups at the bound or zero in the
+prior do not move) k epochs of fixed-step gradient descent on ‖Ax - b‖²/m are
+a Landweber iteration. With A_F = U Σ Vᵀ and step η,
+
+    J = V diag(φ/σ) Uᵀ + (I - V diag(φ) Vᵀ) ∂x_s/∂b,   φ = 1 - (1 - 2ησ²/m)^k
+
+evaluated as A_Fᵀ R and ∂x_s/∂b - A_Fᵀ R A_F ∂x_s/∂b with R = U diag(φ/σ²) Uᵀ
+from the eigenvalues σ² of the small (m, m) matrix K = A_F A_Fᵀ.
+
+The first term is the part of b the run has resolved (early stopping filters
+out the small singular values, unlike the pseudo-inverse); the second carries
+the epoch-0 rescaling x_s = x0 / mean(Ax0 / b) through the unresolved
+directions. The smoothness penalty is left out (λ is small) and the number of
+epochs is held at that of the unperturbed run.
+
+The result has the interface of spectrum_statistics.SpectrumStatistics
+(energies, mean, std(), covariance(), total-flux statistics), so it is written
+with write_summary() in the same _mean_std.csv / _covariance.csv layout as the
+Monte Carlo summary:
+
+    python -m linear_uncertainty problem.csv prior.txt --compare result_mean_std.csv
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from unfolding_engine import MIN_FLUX, SpectrumUnfolder, load_prior, load_problem
+
+
+def landweber_gain(sigma2, rate, epochs):
+    """
+    φ/σ² of k = epochs Landweber steps for the eigenvalues σ² of K (broadcast),
+    rate = 2η/m; computed without cancellation for tiny steps, → rate·k for σ → 0.
+    """
+    sigma2 = np.maximum(sigma2, 0.0)
+    with np.errstate(divide="ignore"):   # rate·σ² ≥ 1: φ = 1 after the first step
+        phi = -np.expm1(epochs * np.log1p(-np.minimum(rate * sigma2, 1.0)))
+    return np.divide(phi, sigma2, out=np.zeros(np.broadcast(phi, sigma2).shape) + rate * epochs,
+                     where=sigma2 > 0)
+
+
+def active_row_gram(A, free, active, row_gram=None):
+    """
+    K = A_a A_aᵀ over the active groups, a subset of the groups free in x0.
+
+    row_gram is K over all free groups (e.g. kept up to date by incremental);
+    the free groups that ended at MIN_FLUX are subtracted from it while they
+    are fewer than the active ones, otherwise K is computed from A.
+    """
+    dropped = free & ~active
+    if row_gram is None or np.count_nonzero(dropped) >= np.count_nonzero(active):
+        return A[:, active] @ A[:, active].T
+    A_dropped = A[:, dropped]
+    return row_gram - A_dropped @ A_dropped.T
+
+
+def solution_jacobian(unfolder, x0, b_vector, result, epochs=None, row_gram=None):
+    """
+    ∂x/∂b (n, m) of a converged gradient run `result` of unfolder.solve(x0, b_vector).
+
+    epochs overrides result.epochs (e.g. the epochs of a chain of warm starts);
+    row_gram is K = A_F A_Fᵀ over the groups free in x0 (see active_row_gram).
+    """
+    if unfolder.method != "gradient":
+        raise ValueError("Analytic error bars linearize the gradient solver; use Monte Carlo runs for "
+                         f"the '{unfolder.method}' method.")
+    A = np.asarray(unfolder.A, dtype=np.float64)
+    m, n = A.shape
+    b = np.ravel(np.asarray(b_vector, dtype=np.float64))
+    x = np.ravel(np.asarray(result.x, dtype=np.float64))
+    x0 = np.ravel(np.asarray(x0, dtype=np.float64))
+    active = (x0 != 0) & (x > MIN_FLUX)
+    A_active = A[:, active]
+    row_gram = active_row_gram(A, x0 != 0, active, row_gram)
+    epochs = result.epochs if epochs is None else epochs
+
+    sigma2, U = np.linalg.eigh(row_gram)
+    R = (U * landweber_gain(sigma2, 2.0 * unfolder.learning_rate / m, epochs)) @ U.T
+    J_active = A_active.T @ R
+
+    if unfolder.rescale:
+        x_start = np.where(x0 != 0, np.maximum(x0, MIN_FLUX), 0.0)
+        prediction = A @ x_start
+        scale = np.mean(prediction / b)
+        # x_s = x_start / scale, scale = mean(A x_start / b): ∂x_s/∂b_i = x_s (A x_start)_i / (m scale b_i²)
+        dx_start = np.outer(x_start[active] / scale, prediction / (m * scale * b ** 2))
+        J_active += dx_start - J_active @ (A_active @ dx_start)
+
+    J = np.zeros((n, m))
+    J[active] = J_active
+    return J
+
+
+class LinearizedUncertainty:
+    """Spectrum, covariance and total-flux statistics from J and b_error (SpectrumStatistics interface)."""
+
+    def __init__(self, energies, x, jacobian, b_error, result=None):
+        self.energies = np.asarray(energies, dtype=np.float64)
+        self.mean = np.ravel(np.asarray(x, dtype=np.float64))
+        self.jacobian = jacobian
+        self.b_error = np.ravel(np.asarray(b_error, dtype=np.float64))
+        self.result = result            # UnfoldingResult of the unperturbed solve
+        self._weighted = jacobian * self.b_error   # J diag(σ)
+
+    def covariance(self, ddof=None):
+        return self._weighted @ self._weighted.T
+
+    def std(self, ddof=None):
+        return np.sqrt(np.einsum("ij,ij->i", self._weighted, self._weighted))
+
+    @property
+    def mean_total_flux(self):
+        return self.mean.sum()
+
+    @property
+    def std_total_flux(self):
+        return float(np.linalg.norm(self._weighted.sum(axis=0)))
+
+    @property
+    def total_flux_rsd(self):
+        return self.std_total_flux / self.mean_total_flux
+
+
+def analytic_uncertainty(unfolder, x0, b_vector, b_error, energies, result=None, callback=None):
+    """Solve the unperturbed problem (unless `result` is given) and linearize it."""
+    if result is None:
+        result = unfolder.solve(x0, b_vector, callback=callback)
+    jacobian = solution_jacobian(unfolder, x0, b_vector, result)
+    return LinearizedUncertainty(energies, result.x, jacobian, b_error, result)
+
+
+def compare_with_monte_carlo(uncertainty, mean_std_path):
+    """Lines comparing the analytic std with a Monte Carlo _mean_std.csv of the same problem."""
+    import pandas as pd
+
+    table = pd.read_csv(mean_std_path)
+    mc_std = table["Std Dev"].to_numpy(dtype=np.float64)
+    mc_mean = table["Mean Flux"].to_numpy(dtype=np.float64)
+    std = uncertainty.std()
+    if len(mc_std) != len(std):
+        raise ValueError(f"{mean_std_path} has {len(mc_std)} groups, the problem has {len(std)}.")
+    # Groups carrying at least 1% of the largest Monte Carlo std
+    significant = mc_std > 0.01 * mc_std.max() if mc_std.max() > 0 else np.zeros(len(std), dtype=bool)
+    ratio = std[significant] / mc_std[significant]
+    lines = [f"Total flux: analytic {uncertainty.mean_total_flux:.4e} ± {uncertainty.std_total_flux:.3e}, "
+             f"Monte Carlo mean {mc_mean.sum():.4e}"]
+    if len(ratio):
+        lines.append(f"Std Dev analytic / Monte Carlo over {len(ratio)} groups: median {np.median(ratio):.3f}, "
+                     f"10-90% {np.percentile(ratio, 10):.3f} - {np.percentile(ratio, 90):.3f}")
+    return lines
+
+
+def main(argv=None):
+    from spectrum_statistics import write_summary
+
+    parser = argparse.ArgumentParser(prog="python -m linear_uncertainty",
+                                     description="Linearized error bars of the unfolded spectrum (one solve).")
+    parser.add_argument("problem", help="activation product parameter CSV or problem bundle")
+    parser.add_argument("prior", nargs="?", default=None, help="initial spectrum file (optional for a bundle)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="output stem (default: <problem>_analytic): <stem>_mean_std.csv, <stem>_covariance.csv")
+    parser.add_argument("--loss-threshold", type=float, default=None)
+    parser.add_argument("--learning-rate", type=float, default=1.0)
+    parser.add_argument("--max-epochs", type=int, default=500000)
+    parser.add_argument("--compare", default=None, help="Monte Carlo _mean_std.csv of the same problem")
+    args = parser.parse_args(argv)
+
+    problem = load_problem(args.problem)
+    if args.prior is not None:
+        x0 = load_prior(args.prior, problem.A.shape[1]).reshape(1, -1)
+    elif problem.prior is not None:
+        x0 = np.array(problem.prior, dtype=np.float32).reshape(1, -1)
+    else:
+        parser.error("a prior file is required unless the problem bundle contains one")
+    loss_threshold = args.loss_threshold if args.loss_threshold is not None else problem.loss_threshold
+
+    unfolder = SpectrumUnfolder(problem.A, loss_threshold, learning_rate=args.learning_rate,
+                                max_epochs=args.max_epochs, b_error=problem.b_error)
+    uncertainty = analytic_uncertainty(unfolder, x0, problem.b, problem.b_error, problem.energies)
+    stem = args.output or os.path.splitext(args.problem)[0] + "_analytic"
+    write_summary(uncertainty, stem + "_mean_std.csv", stem + "_covariance.csv")
+
+    result = uncertainty.result
+    print(f"Unperturbed solve: {result.epochs} epochs ({result.stop_reason})")
+    print(f"Average total flux: {uncertainty.mean_total_flux:.3e} /cm²·s")
+    print(f"Total flux standard deviation: {uncertainty.std_total_flux:.3e} /cm²·s")
+    print(f"Relative standard deviation RSD: {uncertainty.total_flux_rsd:.2%}")
+    if args.compare:
+        print("\n".join(compare_with_monte_carlo(uncertainty, args.compare)))
+    print(f"Saved {stem}_mean_std.csv and {stem}_covariance.csv")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
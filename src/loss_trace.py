@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded loss history of a training run.
+
+A LossTrace keeps, whatever the number of epochs,
+
+- the last `recent` losses in a float32 ring buffer (trace[-1], trace[-k]);
+- the whole history as at most `buckets` consecutive epoch buckets with the
+  minimum and maximum loss of each bucket. When all buckets are used,
+  neighbouring pairs are merged and the bucket width doubles, so spikes and
+  the overall decay survive the decimation.
+
+Memory and plotting cost are therefore constant in the number of epochs.
+"""
+
+import numpy as np
+
+
+TRACE_BUCKETS = 256      # min/max buckets kept for the whole history
+RECENT_LOSSES = 1024     # exact losses kept for the last epochs
+SAVED_TRACE_BUCKETS = 128   # buckets stored with every run's result
+
+
+class LossTrace:
+    """Loss per epoch, stored as a ring buffer of recent values plus min/max buckets."""
+
+    def __init__(self, buckets=TRACE_BUCKETS, recent=RECENT_LOSSES):
+        if buckets < 2 or buckets % 2:
+            raise ValueError("The number of buckets must be an even number >= 2.")
+        self.capacity = buckets
+        self.width = 1                  # epochs per bucket (a power of two)
+        self.count = 0                  # epochs recorded
+        self.last = float("nan")        # latest loss in full precision
+        self._min = np.empty(buckets, dtype=np.float32)
+        self._max = np.empty(buckets, dtype=np.float32)
+        self._closed = 0                # completed buckets in _min / _max
+        self._fill = 0                  # epochs in the open bucket
+        self._open_min = 0.0
+        self._open_max = 0.0
+        self._recent = np.empty(recent, dtype=np.float32)
+
+    def append(self, loss):
+        self._recent[self.count % len(self._recent)] = loss
+        self.count += 1
+        self.last = loss
+        if self._fill == 0:
+            if self._closed == self.capacity:
+                self._merge_pairs()
+            self._open_min = self._open_max = loss
+        elif loss < self._open_min:
+            self._open_min = loss
+        elif loss > self._open_max:
+            self._open_max = loss
+        self._fill += 1
+        if self._fill == self.width:
+            self._min[self._closed] = self._open_min
+            self._max[self._closed] = self._open_max
+            self._closed += 1
+            self._fill = 0
+
+    def extend(self, losses):
+        for loss in losses:
+            self.append(float(loss))
+
+    def state(self):
+        """Arrays holding the complete trace (for checkpoints); LossTrace.from_state() restores it."""
+        return {
+            "min": self._min.copy(),
+            "max": self._max.copy(),
+            "recent": self._recent.copy(),
+            # width, count, closed, fill; the open bucket and last loss in full precision
+            "counters": np.array([self.width, self.count, self._closed, self._fill], dtype=np.int64),
+            "open": np.array([self._open_min, self._open_max, self.last], dtype=np.float64),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        trace = cls(len(state["min"]), len(state["recent"]))
+        trace._min[:] = state["min"]
+        trace._max[:] = state["max"]
+        trace._recent[:] = state["recent"]
+        trace.width, trace.count, trace._closed, trace._fill = (int(v) for v in state["counters"])
+        trace._open_min, trace._open_max, trace.last = (float(v) for v in state["open"])
+        return trace
+
+    def _merge_pairs(self):
+        # Buckets 2k and 2k+1 become bucket k of twice the width
+        half = self.capacity // 2
+        self._min[:half] = np.minimum(self._min[0::2], self._min[1::2])
+        self._max[:half] = np.maximum(self._max[0::2], self._max[1::2])
+        self._closed = half
+        self.width *= 2
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """Loss of one of the last `recent` epochs (negative or absolute epoch index)."""
+        if not isinstance(index, (int, np.integer)):
+            raise TypeError("LossTrace supports integer indices only; use recent() or buckets().")
+        epoch = index + self.count if index < 0 else index
+        kept = min(self.count, len(self._recent))
+        if not self.count - kept <= epoch < self.count:
+            raise IndexError(f"Only the last {kept} of {self.count} losses are kept.")
+        if epoch == self.count - 1:
+            return self.last
+        return float(self._recent[epoch % len(self._recent)])
+
+    def recent(self, k=None):
+        """The last k losses (all kept ones by default), oldest first."""
+        kept = min(self.count, len(self._recent))
+        k = kept if k is None else min(k, kept)
+        epochs = np.arange(self.count - k, self.count)
+        return self._recent[epochs % len(self._recent)].copy()
+
+    def buckets(self):
+        """(first epoch, min, max) of every bucket, the partly filled last one included."""
+        mins = self._min[:self._closed]
+        maxs = self._max[:self._closed]
+        if self._fill:
+            mins = np.append(mins, np.float32(self._open_min))
+            maxs = np.append(maxs, np.float32(self._open_max))
+        return np.arange(len(mins)) * self.width, mins, maxs
+
+    def plot_points(self, skip=0):
+        """(epochs, losses) for plotting: min then max of every bucket, exact values for short runs."""
+        if self.count <= len(self._recent) and self.count <= 2 * self.capacity:
+            losses = self.recent().astype(np.float64)
+            return np.arange(skip, self.count), losses[skip:]
+        starts, mins, maxs = self.buckets()
+        keep = starts + self.width > skip
+        epochs = np.repeat(starts[keep], 2) + np.tile([0, self.width // 2], keep.sum())
+        losses = np.column_stack([mins[keep], maxs[keep]]).ravel().astype(np.float64)
+        return epochs, losses
+
+    def to_record(self, buckets=SAVED_TRACE_BUCKETS):
+        """(width, mins, maxs) coarsened to at most `buckets` buckets, padded with NaN, for saving."""
+        _, mins, maxs = self.buckets()
+        width = self.width
+        while len(mins) > buckets:
+            if len(mins) % 2:
+                mins = np.append(mins, mins[-1])
+                maxs = np.append(maxs, maxs[-1])
+            mins = np.minimum(mins[0::2], mins[1::2])
+            maxs = np.maximum(maxs[0::2], maxs[1::2])
+            width *= 2
+        padded_min = np.full(buckets, np.nan, dtype=np.float32)
+        padded_max = np.full(buckets, np.nan, dtype=np.float32)
+        padded_min[:len(mins)] = mins
+        padded_max[:len(maxs)] = maxs
+        return width, padded_min, padded_max
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel Monte Carlo unfolding runs.
+
+Every run perturbs the activities with its own random stream derived from
+(seed, run id), so a run gives the same spectrum whatever the number of
+worker processes, and any subset of runs can be recomputed on another
+machine from the seed recorded in the output file. The A matrix is placed once in shared memory and attached
+by each worker instead of being pickled with every task.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from result_store import open_result_sink
+from unfolding_engine import SpectrumUnfolder
+
+
+# Spawn key of the random initial spectrum; run streams use their run id
+PRIOR_STREAM = 2 ** 32 - 1
+
+
+def base_seed(seed=None):
+    """Return an integer seed; a fresh one is drawn from OS entropy when seed is None."""
+    return np.random.SeedSequence(seed).entropy
+
+
+def run_generator(seed, run_id):
+    """Independent random stream of one Monte Carlo run."""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(run_id,)))
+
+
+def perturb_activities(b, b_error, seed, run_id):
+    """Activity vector of run `run_id`: b + N(0, b_error)."""
+    rng = run_generator(seed, run_id)
+    return b + rng.normal(loc=0.0, scale=b_error)
+
+
+def random_prior(num_unknowns, seed):
+    """Uniform random initial spectrum (1, n) drawn from its own stream of `seed`."""
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(PRIOR_STREAM,)))
+    return rng.uniform(1e-6, 1.0, size=(1, num_unknowns)).astype(np.float32)
+
+
+def resume_seed(sink, seed=None):
+    """Seed of the runs in a result sink: the one already recorded in it, else base_seed(seed)."""
+    if sink.seed is None:
+        return base_seed(seed)
+    if seed is not None and base_seed(seed) != sink.seed:
+        raise ValueError(f"{sink.path} was written with seed {sink.seed}, not {seed}.")
+    return sink.seed
+
+
+# State of a worker process, set once by _init_worker
+_worker = {}
+
+
+def _init_worker(shm_name, shape, dtype, b, b_error, x0, seed, solver_options, cancel=None):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    A = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker.update(
+        shm=shm,   # keep the mapping alive for the lifetime of the worker
+        unfolder=SpectrumUnfolder(A, cancel=cancel, **solver_options),
+        b=b,
+        b_error=b_error,
+        x0=x0,
+        seed=seed,
+    )
+
+
+def _solve_run(run_id):
+    w = _worker
+    perturbed_b = perturb_activities(w["b"], w["b_error"], w["seed"], run_id)
+    result = w["unfolder"].solve(w["x0"], perturbed_b)
+    return (run_id, result.x.flatten(), result.final_loss, result.epochs, result.stop_reason, perturbed_b,
+            result.loss_history)
+
+
+def run_parallel(A, b, b_error, x0, energies, save_path, num_runs, loss_threshold,
+                 seed=None, workers=None, on_result=None, resume=False, cancel=None, on_start=None,
+                 **solver_options):
+    """
+    Solve num_runs perturbed problems on a process pool.
+
+    Runs are appended to save_path through result_store (Run_<id> CSV or *.runs
+    binary) as soon as each one finishes, so rows may appear out of order.
+    With resume=True the runs already in save_path are skipped and their seed
+    is reused. on_result(run_id, x, final_loss, epochs, stop_reason) is called
+    in the parent process, on_start(pending_run_ids) once the output file is open.
+    cancel is a multiprocessing.Event shared with the workers: once it is set,
+    runs not yet started are dropped and running ones stop within
+    CANCEL_CHECK_INTERVAL epochs; only finished runs are written. Returns the
+    seed used, which reproduces every run.
+    """
+    sink = open_result_sink(save_path, energies, len(np.ravel(b)), resume=resume)
+    try:
+        seed = resume_seed(sink, seed)
+    except ValueError:
+        sink.close()
+        raise
+    pending = [run_id for run_id in range(num_runs) if run_id not in sink.completed]
+    if on_start is not None:
+        on_start(pending)
+    workers = max(1, min(workers or os.cpu_count(), len(pending)))
+    A = np.ascontiguousarray(A)
+    solver_options = dict(solver_options, loss_threshold=loss_threshold, b_error=b_error)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(A.nbytes, 1))
+    try:
+        np.ndarray(A.shape, dtype=A.dtype, buffer=shm.buf)[...] = A
+
+        with sink, ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(shm.name, A.shape, A.dtype, b, b_error, x0, seed, solver_options, cancel)) as pool:
+            futures = [pool.submit(_solve_run, run_id) for run_id in pending]
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                run_id, x, final_loss, epochs, stop_reason, perturbed_b, loss_trace = future.result()
+                if stop_reason == "cancelled":
+                    for other in futures:
+                        other.cancel()
+                    continue
+                sink.write(run_id, x, final_loss, epochs, stop_reason, seed, perturbed_b, loss_trace)
+                if on_result is not None:
+                    on_result(run_id, x, final_loss, epochs, stop_reason)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return seed
@@ -11,14 +11,37 @@ import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 from threading import Thread
+import multiprocessing
 import matplotlib
 matplotlib.use('TkAgg')  
 from tkinter import font  
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from scipy.stats import chi2
 import gc
+import os
+from unfolding_engine import SpectrumUnfolder, SOLVER_METHODS, UnfoldingProblem, select_formulation
+from monte_carlo import base_seed, perturb_activities, random_prior, resume_seed, run_parallel
+from problem_bundle import BUNDLE_FILE, is_bundle, load_bundle
+from result_store import BINARY_SUFFIX, open_result_sink
+from progress import ProgressChannel, sample_loss_history
+from warm_start import epochs_saved, warm_start_spectrum
+from checkpoint import Checkpointer, checkpoint_path, run_context, run_state, settings_changed, solver_settings
+from linear_uncertainty import analytic_uncertainty
+from cross_validation import leave_one_out, write_leave_one_out
+from incremental import IncrementalUnfolder
+from spectrum_statistics import write_summary
+
+
+PROGRESS_POLL_MS = 100   # how often the Tk side collects solver snapshots
+
+
+def format_duration(seconds):
+    """H:MM:SS of a number of seconds."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
 
 
 class NeuralSolverApp:
@@ -42,14 +65,28 @@ class NeuralSolverApp:
         self.A = None
         self.b = None
         self.b_error = None  # Add: activity error vector
+        self.foil_names = None  # first column of the parameter file
         self.x_dummy = None
-        self.stop_training_flag = False  # Add: variable to control manual stop
+        self.stop_training_flag = None  # multiprocessing.Event of the running training, set by the Stop button
         self.developer_mode = tk.BooleanVar(value=False)  #Developer Mode
         self.enable_live_plot = tk.BooleanVar(value=False)   # ➤ Enable plotting by default
         self.x_perturbation_scale = tk.DoubleVar(value=0.0)
         self.loss_threshold = tk.DoubleVar(value=1.0)
         self.initial_learning_rate = tk.DoubleVar(value=1.0)
         self.max_epochs = tk.IntVar(value=500000)
+        self.solver_method = tk.StringVar(value="gradient")   # Solver backend, see SOLVER_METHODS
+        self.batched_runs = tk.BooleanVar(value=False)   # Solve all Monte Carlo runs together
+        self.resume_runs = tk.BooleanVar(value=False)    # Keep the runs already in the output file
+        self.warm_start = tk.BooleanVar(value=False)     # Start every run from the unperturbed solution
+        self.incremental_mode = tk.BooleanVar(value=False)   # Re-unfold at once when the parameter file is reloaded
+        self.incremental = None       # IncrementalUnfolder of the current problem (incremental mode)
+        self.print_spectrum = tk.BooleanVar(value=True)  # Print dΦ/dlnE of every plotted spectrum
+        self.progress = None          # ProgressChannel of the running training
+        self.training_thread = None
+        self.training_error = None    # exception that ended the training thread
+        self.error_band = None        # (flux, std) of the last analytic error-bar run, drawn when it ends
+        self._live_lines = None       # Line2D objects updated by the live plot
+        self._live_background = None
         
         # Build the UI interface
         self.create_widgets()
@@ -72,6 +109,30 @@ class NeuralSolverApp:
             command=self.toggle_developer_widgets
         ).pack(pady=5)
 
+        tk.Checkbutton(
+            self.top_frame,
+            text="Batched runs (solve all iterations in one matrix operation)",
+            variable=self.batched_runs
+        ).pack(pady=5)
+
+        tk.Checkbutton(
+            self.top_frame,
+            text="Resume (skip the iterations already in the output file)",
+            variable=self.resume_runs
+        ).pack(pady=5)
+
+        tk.Checkbutton(
+            self.top_frame,
+            text="Warm start (start every iteration from the unperturbed solution)",
+            variable=self.warm_start
+        ).pack(pady=5)
+
+        tk.Checkbutton(
+            self.top_frame,
+            text="Incremental mode (reloading the parameter file updates the changed foils and re-unfolds at once)",
+            variable=self.incremental_mode
+        ).pack(pady=5)
+
         tk.Label(self.top_frame, text="Select input data").pack(pady=5)
         tk.Button(self.top_frame, text="Select activation product parameter file", command=self.load_user_input).pack(pady=5)
         tk.Button(self.top_frame, text="Select initial spectrum file", command=self.load_initial_guess).pack(pady=5)
@@ -80,9 +141,34 @@ class NeuralSolverApp:
         self.num_runs = tk.IntVar(value=1)
         tk.Entry(self.top_frame, textvariable=self.num_runs).pack()
 
+        tk.Label(self.top_frame, text="Number of worker processes (1 = sequential)").pack()
+        self.num_workers = tk.IntVar(value=1)
+        tk.Entry(self.top_frame, textvariable=self.num_workers).pack()
+
+        tk.Label(self.top_frame, text="Random seed (empty = new seed, recorded in the output file)").pack()
+        self.seed_text = tk.StringVar(value="")
+        tk.Entry(self.top_frame, textvariable=self.seed_text).pack()
+
         self.start_button = tk.Button(self.top_frame, text="Start training", command=self.run_multiple_trainings)
         self.start_button.pack(pady=10)
 
+        self.stop_button = tk.Button(self.top_frame, text="Stop training", command=self.stop_training, state=tk.DISABLED)
+        self.stop_button.pack(pady=5)
+
+        self.analytic_button = tk.Button(self.top_frame, text="Analytic error bars (one solve, no Monte Carlo)",
+                                         command=self.run_analytic_uncertainty)
+        self.analytic_button.pack(pady=5)
+
+        self.loo_button = tk.Button(self.top_frame, text="Leave-one-foil-out check (flag inconsistent foils)",
+                                    command=self.run_leave_one_out)
+        self.loo_button.pack(pady=5)
+
+        # Iterations done; epochs/s and ETA below
+        self.progress_bar = ttk.Progressbar(self.top_frame, length=400, mode="determinate", maximum=1)
+        self.progress_bar.pack(pady=5)
+        self.progress_label = tk.Label(self.top_frame, text="")
+        self.progress_label.pack()
+
         self.status_label = tk.Label(self.top_frame, text="Waiting for file selection...")
         self.status_label.pack(pady=5)
 
@@ -106,6 +192,14 @@ class NeuralSolverApp:
         add_dev_row("Initial Learning Rate", self.initial_learning_rate).pack(side=tk.LEFT, padx=10)
         add_dev_row("Max Epochs", self.max_epochs).pack(side=tk.LEFT, padx=10)
 
+        solver_row = tk.Frame(self.developer_frame)
+        tk.Label(solver_row, text="Solver").pack(side=tk.LEFT)
+        tk.OptionMenu(solver_row, self.solver_method, *SOLVER_METHODS).pack(side=tk.LEFT)
+        self.dev_widgets.append(solver_row)
+
+        self.dev_widgets.append(tk.Checkbutton(self.developer_frame, text="Print spectrum values to console",
+                                               variable=self.print_spectrum))
+
         # Hidden by default
         for widget in self.dev_widgets:
             widget.pack_forget()
@@ -123,9 +217,13 @@ class NeuralSolverApp:
         if hasattr(self, 'scaling_factor'):
             delattr(self, 'scaling_factor')
 
-        filename = filedialog.askopenfilename(title="Select the file containing equation data", filetypes=[("Text files", "*.txt;*.csv")])
+        filename = filedialog.askopenfilename(title="Select the file containing equation data",
+                                              filetypes=[("Text files", "*.txt;*.csv"), ("Problem bundle", BUNDLE_FILE)])
         if filename:
             try:
+                if is_bundle(filename):
+                    self.load_problem_bundle(filename)
+                    return
                 if filename.endswith(".csv"):
                     df = pd.read_csv(filename, header=None, skiprows=0)  # **Ensure the first line is read**
                 else:
@@ -142,6 +240,8 @@ class NeuralSolverApp:
                 self.A = data[:, :-2]  # Matrix A
                 self.b = data[:, -2].reshape(-1, 1)  # Target vector b
                 self.b_error = data[:, -1].reshape(-1, 1)  # The last column is the activity error.
+                foil_names = df.iloc[1:, 0].astype(str).tolist()
+                self.foil_names = foil_names
                 
                 # Calculate degrees of freedom (number of activation material entries)
                 dof = self.b.shape[0]  
@@ -153,14 +253,42 @@ class NeuralSolverApp:
                 computed_loss_threshold = chi2.ppf(confidence_level, dof)
  
                 self.loss_threshold.set(computed_loss_threshold)
+
+                # Gradient data term via A (2mn per epoch) or the precomputed AᵀA (n² per epoch)
+                print(f"A matrix {self.A.shape}: using the '{select_formulation(self.A.shape)}' formulation")
 #                print(f"Computed Loss Threshold: {computed_loss_threshold}") 
         
                 self.status_label.config(text="Equation data loaded successfully")
                 self.check_ready()
+                if self.incremental_mode.get():
+                    self.update_incremental(foil_names)
             except Exception as e:
                 messagebox.showerror("Error", f"Error reading data: {str(e)}")
 
 
+    def load_problem_bundle(self, filename):
+        # Binary problem bundle (python -m problem_bundle): arrays are memory-mapped, no CSV parsing
+        problem = load_bundle(filename)
+        self.A_header = problem.energies
+        self.A = problem.A
+        self.b = problem.b
+        self.b_error = problem.b_error
+        self.foil_names = problem.names
+        self.loss_threshold.set(problem.loss_threshold)
+
+        if problem.prior is not None:
+            # The bundle's prior replaces the initial spectrum (copied: the mapping is read-only)
+            self.x_dummy = np.array(problem.prior, dtype=np.float32).reshape(1, -1)
+            self.original_x_dummy = self.x_dummy.copy()
+
+        print(f"A matrix {self.A.shape}: using the '{select_formulation(self.A.shape)}' formulation")
+        self.status_label.config(text="Problem bundle loaded successfully"
+                                 + (" (with initial spectrum)" if problem.prior is not None else ""))
+        self.check_ready()
+        if self.incremental_mode.get():
+            self.update_incremental(problem.names)
+
+
     def load_initial_guess(self):
         # ② If the initial spectrum file is changed, also clear the old scaling_factor
         if hasattr(self, 'scaling_factor'):
@@ -189,6 +317,7 @@ class NeuralSolverApp:
 
                 self.x_dummy = x_data.reshape(1, -1)
                 self.original_x_dummy = self.x_dummy.copy()  # Backup initial data
+                self.incremental = None   # new prior: the next incremental update starts cold
                 self.status_label.config(text="Initial spectrum loaded successfully")
 
             except Exception as e:
@@ -197,12 +326,43 @@ class NeuralSolverApp:
         else:
             # If no file is selected, determine number of unknowns dynamically from A or A_header
             num_unknowns = self.A.shape[1] if self.A is not None else len(self.A_header)
-            self.x_dummy = np.random.uniform(1e-6, 1.0, size=(1, num_unknowns)).astype(np.float32)
-            self.status_label.config(text="No initial file selected — using random initial spectrum")
+            try:
+                seed = base_seed(self.requested_seed())
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.x_dummy = random_prior(num_unknowns, seed)
+            print(f"Random initial spectrum drawn with seed {seed}")
+            self.status_label.config(text=f"No initial file selected — using random initial spectrum (seed {seed})")
 
         self.check_ready()
 
 
+    def requested_seed(self):
+        # Empty entry: None, a fresh seed is drawn from OS entropy
+        text = self.seed_text.get().strip()
+        try:
+            return int(text) if text else None
+        except ValueError:
+            raise ValueError("The random seed must be an integer.") from None
+
+    def open_output(self, save_path):
+        """(sink, seed) of the output file, or None after an error message."""
+        try:
+            seed = self.requested_seed()
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return None
+        sink = open_result_sink(save_path, self.A_header, self.b.shape[0], resume=self.resume_runs.get())
+        try:
+            seed = resume_seed(sink, seed)
+        except ValueError as e:
+            sink.close()
+            messagebox.showerror("Resume", str(e))
+            return None
+        print(f"Random seed of this inversion: {seed}")
+        return sink, seed
+
     def check_ready(self):
         if self.A is not None and self.b is not None and self.x_dummy is not None:
             self.start_button.config(state=tk.NORMAL)
@@ -216,24 +376,75 @@ class NeuralSolverApp:
                 widget.pack_forget()
 
     
-    def start_training(self):
-        self.stop_training_flag = False  
-        loss_threshold_value = self.loss_threshold.get()
-        
-        print(f"Using Loss Threshold: {loss_threshold_value}")  
-
+    def start_training(self, target, *args):
+        # ✅ target(*args) runs on a worker thread; the Tk thread only draws what it publishes through self.progress
+        self.stop_training_flag = multiprocessing.Event()   # also seen by the worker processes of parallel runs
+        self.training_error = None
+        self.progress = ProgressChannel(live=self.enable_live_plot.get())
+        self._live_lines = None
+        self._live_background = None
         self.start_button.config(state=tk.DISABLED)
-        self.root.after(0, lambda: self.status_label.config(text="訓練中...請稍候"))
-        
-        # 使用多執行緒來運行 train_model
-        Thread(target=self.train_model, args=(loss_threshold_value,)).start()
+        self.analytic_button.config(state=tk.DISABLED)
+        self.loo_button.config(state=tk.DISABLED)
+        self.stop_button.config(state=tk.NORMAL)
+        self.status_label.config(text="Training... please wait")
+        self.training_thread = Thread(target=self.training_worker, args=(target,) + args, daemon=True)
+        self.training_thread.start()
+        self.root.after(PROGRESS_POLL_MS, self.poll_progress)
+
+    def training_worker(self, target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            self.training_error = e   # reported by poll_progress on the Tk thread
+            raise
 
     def stop_training(self):
-        self.stop_training_flag = True  
+        # Cooperative: the solver checks the flag every CANCEL_CHECK_INTERVAL epochs, finished iterations stay saved
+        if self.stop_training_flag is not None:
+            self.stop_training_flag.set()
+            self.stop_button.config(state=tk.DISABLED)
+            self.status_label.config(text="⏹ Stopping... finished iterations are kept")
+
+    def update_progress_bar(self):
+        progress = self.progress
+        eta = progress.eta()
+        self.progress_bar.config(maximum=max(progress.total, 1), value=progress.done)
+        self.progress_label.config(
+            text=f"Iteration {progress.done}/{progress.total} · {progress.epochs_per_second():,.0f} epochs/s · "
+                 f"ETA {'--' if eta is None else format_duration(eta)}")
+
+    def finish_training(self):
+        self.start_button.config(state=tk.NORMAL)
+        self.analytic_button.config(state=tk.NORMAL)
+        self.loo_button.config(state=tk.NORMAL)
+        self.stop_button.config(state=tk.DISABLED)
+        done, total = self.progress.done, self.progress.total
+        if self.training_error is not None:
+            self.status_label.config(text=f"❌ Training failed: {self.training_error}")
+            messagebox.showerror("Error", str(self.training_error))
+        elif self.stop_training_flag.is_set():
+            self.status_label.config(text=f"⏹ Training stopped: {done} of {total} iterations saved")
+        else:
+            self.status_label.config(text=f"✅ Training finished: {done} iterations saved")
+        if self.error_band is not None:
+            self.draw_error_band(*self.error_band)
+            self.error_band = None
+
+    def draw_error_band(self, flux, std):
+        # ±1σ band of the analytic error bars around the plotted group flux
+        x_labels = np.array(self.A_header, dtype=float)
+        self.ax2.fill_between(x_labels, np.maximum(flux - std, 1), flux + std, step='mid', color='red', alpha=0.3,
+                              label="±1σ (linearized)")
+        self.ax2.legend()
+        self.canvas.draw()
 
-    def plot_results(self, loss_history, x_values):
+    def plot_results(self, loss_history, x_values, loss_epochs=None):
+        self._live_lines = None
         self.ax1.clear()
-        self.ax1.plot(loss_history[5:], label="Training Loss", color='blue', linewidth=2)
+        if loss_epochs is None:
+            loss_epochs, loss_history = sample_loss_history(loss_history)
+        self.ax1.plot(loss_epochs, loss_history, label="Training Loss", color='blue', linewidth=2)
         self.ax1.set_xlabel("Epochs")
         self.ax1.set_ylabel("Loss Value")
         self.ax1.set_title("Loss Function vs Training Epochs")
@@ -272,85 +483,119 @@ class NeuralSolverApp:
         self.root.update_idletasks()
         
         # --- print data ---
-        print("Energy(MeV)            dΦ/dlnE")
-        for e, u in zip(x_labels[mask], phi_u[mask]):
-            print(f"{e:12.5e}    {u:12.5e}")
+        if self.print_spectrum.get():
+            print("Energy(MeV)            dΦ/dlnE")
+            for e, u in zip(x_labels[mask], phi_u[mask]):
+                print(f"{e:12.5e}    {u:12.5e}")
+
+    def init_live_plot(self, snapshot):
+        # Axes and empty animated lines; later snapshots only move the line data
+        x_labels = np.array(self.A_header, dtype=float)
+        self.ax1.clear()
+        self.ax1.set_xlabel("Epochs")
+        self.ax1.set_ylabel("Loss Value")
+        self.ax1.set_title("Loss Function vs Training Epochs")
+        self.ax1.set_yscale("log")   # the loss falls by orders of magnitude while the plot is live
+        self.ax1.grid(True)
+        loss_line, = self.ax1.plot([], [], color='blue', linewidth=2, label="Training Loss", animated=True)
+        self.ax1.legend()
 
+        self.ax2.clear()
+        flux_line, = self.ax2.plot(x_labels, np.full(len(x_labels), np.nan), drawstyle='steps-mid',
+                                   color='orange', label="Group Flux (Φᵢ)", animated=True)
+        lethargy_line, = self.ax2.plot(x_labels, np.full(len(x_labels), np.nan), linestyle="-", color="green",
+                                       label="dΦ/dlnE (per lethargy)", animated=True)
+        self.ax2.set_xlabel("Neutron Energy (MeV)")
+        self.ax2.set_ylabel("Flux")
+        self.ax2.set_yscale("log")
+        self.ax2.set_xscale("log")
+        self.ax2.set_xlim(x_labels[x_labels > 0].min(), x_labels.max())
+        self.ax2.set_title(f"Neutron Spectrum Prediction (iteration {snapshot.run + 1})")
+        self.ax2.grid(True)
+        self.ax2.legend()
+        self._live_lines = (loss_line, flux_line, lethargy_line)
+
+    def update_live_plot(self, snapshot):
+        if self._live_lines is None:
+            self.init_live_plot(snapshot)
+        loss_line, flux_line, lethargy_line = self._live_lines
+
+        x_labels = np.array(self.A_header, dtype=float)
+        E_edges = np.insert(x_labels, 0, x_labels[0] * 0.9)
+        phi_u = snapshot.x / np.diff(np.log(E_edges))
+        loss_line.set_data(snapshot.loss_epochs, snapshot.loss_values)
+        flux_line.set_ydata(np.where(snapshot.x > 0, snapshot.x, np.nan))
+        lethargy_line.set_ydata(np.where(phi_u > 0, phi_u, np.nan))
+
+        # Full redraw only when the data leave the current limits, otherwise blit the three lines
+        positive_loss = snapshot.loss_values[snapshot.loss_values > 0]
+        loss_min, loss_max = (positive_loss.min(), positive_loss.max()) if len(positive_loss) else (0.1, 1.0)
+        flux_max = np.nanmax(np.concatenate([snapshot.x, phi_u, [1.0]]))
+        x1_max = self.ax1.get_xlim()[1]
+        y1_min, y1_max = self.ax1.get_ylim()
+        y2_max = self.ax2.get_ylim()[1]
+        if (self._live_background is None or snapshot.epoch > x1_max or loss_max > y1_max or loss_min < y1_min
+                or flux_max > y2_max or flux_max < y2_max / 1e3):
+            self.ax1.set_xlim(0, max(2 * snapshot.epoch, 100))
+            self.ax1.set_ylim(loss_min / 10, 2 * loss_max)
+            self.ax2.set_ylim(1, 10 * flux_max)
+            self.canvas.draw()
+            self._live_background = self.canvas.copy_from_bbox(self.fig.bbox)
+        else:
+            self.canvas.restore_region(self._live_background)
+        for line in self._live_lines:
+            line.axes.draw_artist(line)
+        self.canvas.blit(self.fig.bbox)
+
+    def poll_progress(self):
+        # Runs on the Tk thread: draw the newest snapshot, the end of every finished run as a full plot
+        if self.progress is not None:
+            snapshots = self.progress.poll()
+            finals = [i for i, s in enumerate(snapshots) if s.final]
+            if finals:
+                last = snapshots[finals[-1]]
+                self.plot_results(last.loss_values, last.x, loss_epochs=last.loss_epochs)
+                self._live_background = None
+                snapshots = snapshots[finals[-1] + 1:]
+            if snapshots:
+                self.update_live_plot(snapshots[-1])
+            self.update_progress_bar()
+
+        if self.training_thread is not None and self.training_thread.is_alive():
+            self.root.after(PROGRESS_POLL_MS, self.poll_progress)
+        elif self.training_thread is not None:
+            self.training_thread = None
+            self.poll_progress()   # snapshots published just before the thread ended
+            self.finish_training()
 
-        
-    def run_one_training(self, loss_threshold, b_vector):
-        num_unknowns = self.x_dummy.shape[1]
-        max_epochs = self.max_epochs.get()
-        learning_rate = self.initial_learning_rate.get()
-        
-        zero_mask = (self.x_dummy == 0)  
-
-        x_variable = np.maximum(self.x_dummy, 1e-6)    
-        x_variable[zero_mask] = 0  
-
-        loss_history = []
-        min_loss = float('inf')
-        no_improvement_epochs = 0
-
-        for epoch in range(max_epochs):
-            Ax_pred = np.dot(x_variable, self.A.T)
-            error = Ax_pred - b_vector.T 
-            smoothness_penalty = np.mean(np.square(np.diff(np.log(x_variable + 1e-12))))
-           
-            
-            λ = 0.01  # Smoothness weight, adjustable
-            loss = np.mean(np.square(error)) + λ * smoothness_penalty
-
-            gradient = 2 * np.dot(error, self.A) / self.A.shape[0]
-            x_variable -= learning_rate * gradient
-            x_variable = np.maximum(x_variable, 1e-6)
-            
-            x_variable[zero_mask] = 0  
-
-            loss_history.append(loss)
-
-            if loss < min_loss:
-                min_loss = loss
-                no_improvement_epochs = 0
-            else:
-                no_improvement_epochs += 1
-
-            if no_improvement_epochs >= 1000:
-                no_improvement_epochs = 0
-                min_loss = float('inf')
-                x_variable = np.maximum(self.x_dummy, 1e-6)
-                if hasattr(self, 'scaling_factor'):
-                    x_variable = np.maximum(x_variable / self.scaling_factor, 1e-6)
-
-            if epoch == 0 :
-                scaling_values = Ax_pred / b_vector.T
-                scaling_factor = np.mean(scaling_values)
-                print("sacling factor=",scaling_factor)   
-                x_variable = np.maximum(x_variable / scaling_factor, 1e-6)
-                print( x_variable)
-               
-            
-            if len(loss_history) >= 500:
-                recent_losses = loss_history[-500:]
-                max_loss = max(recent_losses)
-                min_loss = min(recent_losses)
-                if abs(max_loss - min_loss) / max_loss < 1e-5:
-                    print(f"🟡 Loss function changed very little in the last 500 epochs, stopping training early")
-                    break
-            
-            if self.enable_live_plot.get() and ((epoch + 1) % 100 == 0):
-                
-                self.plot_results(loss_history, x_variable.flatten())
 
-            
-            if epoch == max_epochs - 1 and self.enable_live_plot.get():
-                self.plot_results(loss_history, x_variable.flatten())
+        
+    def solver_options(self):
+        # Tk variables are read on the Tk thread, before the training thread starts
+        return dict(
+            learning_rate=self.initial_learning_rate.get(),
+            max_epochs=self.max_epochs.get(),
+            method=self.solver_method.get()
+        )
 
+    def run_one_training(self, loss_threshold, b_vector, solver_options=None, callback=None, checkpoint=None,
+                         state=None):
+        # The epoch loop itself runs in the headless engine; callback receives (loss_history, x)
+        unfolder = SpectrumUnfolder(
+            self.A,
+            loss_threshold,
+            verbose=True,
+            b_error=self.b_error,
+            cancel=self.stop_training_flag,
+            **(solver_options or self.solver_options())
+        )
+        return unfolder.solve(self.x_dummy, b_vector, callback=callback, checkpoint=checkpoint, state=state)
 
-            if loss < loss_threshold:
-                break
-        print("Final Loss Function Value (single run):", loss_history[-1])
-        return x_variable, loss_history
+    def warm_start_point(self, loss_threshold, solver_options):
+        # 🔥 Unperturbed solve once; the perturbed iterations start from its solution without rescaling
+        reference = self.run_one_training(loss_threshold, self.b, solver_options)
+        print(f"🔥 Warm start: unperturbed solution in {reference.epochs} epochs ({reference.stop_reason})")
+        return reference, warm_start_spectrum(reference.x, self.x_dummy)
         
     def run_multiple_trainings(self):
         
@@ -367,8 +612,9 @@ class NeuralSolverApp:
         
         save_path = filedialog.asksaveasfilename(
             defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv")],
-            title="Save all inversion results to CSV"
+            filetypes=[("CSV files", "*.csv"), ("Binary run records", "*" + BINARY_SUFFIX)],
+            title="Save all inversion results to CSV",
+            confirmoverwrite=not self.resume_runs.get()
         )
         
         if self.b_error is None:
@@ -381,50 +627,321 @@ class NeuralSolverApp:
         
         loss_threshold = self.loss_threshold.get()
         num_runs = self.num_runs.get()
-        all_results = []
         
+        if self.batched_runs.get() and self.solver_method.get() != "gradient":
+            messagebox.showwarning("Batched runs", "Batched runs are only available for the gradient solver.")
+            return
+
+        warm_start = self.warm_start.get()
+        if self.num_workers.get() > 1 and not self.batched_runs.get():
+            try:
+                seed = self.requested_seed()
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.start_training(self.run_parallel_trainings, loss_threshold, num_runs, save_path, seed,
+                                self.num_workers.get(), self.resume_runs.get(), self.solver_options(), warm_start)
+            return
+
+        output = self.open_output(save_path)
+        if output is None:
+            return
+        sink, seed = output
+
+        if self.batched_runs.get():
+            self.start_training(self.run_batched_trainings, loss_threshold, num_runs, sink, seed,
+                                self.solver_options(), warm_start)
+        else:
+            self.start_training(self.run_sequential_trainings, loss_threshold, num_runs, sink, seed,
+                                self.solver_options(), warm_start, self.resume_runs.get())
+
+    def run_analytic_uncertainty(self):
+        # 📐 Error bars from one unperturbed solve, linearized around b (see linear_uncertainty)
+        if self.b_error is None:
+            messagebox.showwarning("Analytic error bars", "b_error not loaded, cannot propagate activity errors.")
+            return
+        if self.solver_method.get() != "gradient":
+            messagebox.showwarning("Analytic error bars", "Analytic error bars are only available for the gradient solver.")
+            return
+        save_path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv")],
+            initialfile="analytic_mean_std.csv",
+            title="Save analytic mean/std CSV (the covariance matrix goes next to it)"
+        )
+        if not save_path:
+            return
+        self.start_training(self.run_analytic_worker, save_path, self.loss_threshold.get(), self.solver_options())
+
+    def run_analytic_worker(self, save_path, loss_threshold, solver_options):
+        # Worker thread, like run_sequential_trainings
+        unfolder = SpectrumUnfolder(self.A, loss_threshold, verbose=True, b_error=self.b_error,
+                                    cancel=self.stop_training_flag, **solver_options)
+        self.progress.start(1)
+        uncertainty = analytic_uncertainty(unfolder, self.x_dummy, self.b, self.b_error, self.A_header,
+                                           callback=self.progress)
+        result = uncertainty.result
+        if result.stop_reason == "cancelled":
+            print("⏹ Analytic error bars stopped, nothing saved")
+            return
+        self.progress.publish(result.loss_history, result.x, final=True)
+        self.progress.run_finished(result.epochs)
+
+        stem = save_path[:-len("_mean_std.csv")] if save_path.endswith("_mean_std.csv") else os.path.splitext(save_path)[0]
+        write_summary(uncertainty, stem + "_mean_std.csv", stem + "_covariance.csv")
+        self.error_band = (uncertainty.mean, uncertainty.std())
+        print(f"📐 Linearized around the unperturbed solution ({result.epochs} epochs, {result.stop_reason})")
+        print(f"Average total flux: {uncertainty.mean_total_flux:.3e} /cm²·s")
+        print(f"Total flux standard deviation: {uncertainty.std_total_flux:.3e} /cm²·s")
+        print(f"Relative standard deviation RSD: {uncertainty.total_flux_rsd:.2%}")
+        print(f"Analytic error bars saved to：{stem}_mean_std.csv and {stem}_covariance.csv")
+
+    def run_leave_one_out(self):
+        # 🔍 Predict every foil's activity from the other foils (see cross_validation)
+        if self.A is None or self.x_dummy is None:
+            messagebox.showwarning("Leave-one-foil-out check", "Please select both the parameter file and the initial spectrum file.")
+            return
+        if self.solver_method.get() != "gradient":
+            messagebox.showwarning("Leave-one-foil-out check", "The leave-one-foil-out check is only available for the gradient solver.")
+            return
+        save_path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv")],
+            initialfile="foils_loo.csv",
+            title="Save leave-one-out CSV (the spectra without each foil go next to it)"
+        )
+        if not save_path:
+            return
+        self.start_training(self.run_leave_one_out_worker, save_path, self.loss_threshold.get(), self.solver_options())
+
+    def run_leave_one_out_worker(self, save_path, loss_threshold, solver_options):
+        # Worker thread, like run_sequential_trainings
+        self.progress.start(1)
+        incremental = self.incremental
+        if (self.incremental_mode.get() and incremental is not None and incremental.result is not None
+                and incremental.loss_threshold == loss_threshold):
+            # The incremental solution is the current one: no new solve
+            loo = incremental.leave_one_out()
+            result = incremental.result
+        else:
+            unfolder = SpectrumUnfolder(self.A, loss_threshold, verbose=True, b_error=self.b_error,
+                                        cancel=self.stop_training_flag, **solver_options)
+            result = unfolder.solve(self.x_dummy, self.b, callback=self.progress)
+            if result.stop_reason == "cancelled":
+                print("⏹ Leave-one-foil-out check stopped, nothing saved")
+                return
+            loo = leave_one_out(unfolder, self.x_dummy, self.b, self.b_error, self.foil_names, self.A_header,
+                                result=result)
+        self.progress.publish(result.loss_history, result.x, final=True)
+        self.progress.run_finished(result.epochs)
+
+        stem = save_path[:-len("_loo.csv")] if save_path.endswith("_loo.csv") else os.path.splitext(save_path)[0]
+        write_leave_one_out(loo, stem)
+        print("🔍 Leave-one-foil-out check (activity of every foil predicted from the others):")
+        print("\n".join(loo.lines()))
+        inconsistent = loo.inconsistent()
+        if inconsistent:
+            print(f"⚠️ Inconsistent with the other foils: {', '.join(inconsistent)} "
+                  "(check mass, irradiation and cooling times)")
+        else:
+            print("✅ Every checked foil agrees with the others")
+        if loo.unchecked():
+            print(f"Not checked (no other foil constrains their groups): {', '.join(loo.unchecked())}")
+        print(f"Leave-one-out results saved to：{stem}_loo.csv and {stem}_loo_spectra.csv")
+
+    def update_incremental(self, foil_names):
+        # ♻️ Incremental mode: apply the foils added / removed / changed since the last load, warm start from the last spectrum
+        if self.x_dummy is None:
+            return   # waiting for the initial spectrum
+        if self.training_thread is not None:
+            messagebox.showwarning("Incremental mode", "A training is running; reload the file when it has finished.")
+            return
+        problem = UnfoldingProblem(self.A, self.b, self.b_error, self.A_header, foil_names)
+        try:
+            changes = self.incremental.sync(problem) if self.incremental is not None else None
+        except ValueError as e:
+            print(f"♻️ {e}")
+            changes = None
+        if changes is None:
+            self.incremental = IncrementalUnfolder(problem, self.x_dummy)
+            print(f"♻️ Incremental mode: {len(foil_names)} foils, first solve from the initial spectrum")
+        elif not changes:
+            print("♻️ Incremental mode: no foil changed")
+            return
+        else:
+            print("♻️ Incremental update: " + ", ".join(f"{action} {name}" for action, name in changes))
+        self.start_training(self.run_incremental_worker, self.loss_threshold.get(), self.solver_options())
+
+    def run_incremental_worker(self, loss_threshold, solver_options):
+        # Worker thread, like run_sequential_trainings
+        incremental = self.incremental
+        incremental.loss_threshold = loss_threshold
+        incremental.solver_options = dict(solver_options, verbose=True)
+        self.progress.start(1)
+        result = incremental.solve(callback=self.progress, cancel=self.stop_training_flag)
+        if result.stop_reason == "cancelled":
+            print("⏹ Incremental update stopped")
+            return
+        self.progress.publish(result.loss_history, result.x, final=True)
+        self.progress.run_finished(result.epochs)
+        print(f"♻️ {'Warm' if incremental.warm else 'Cold'} start: {result.epochs} epochs ({result.stop_reason}), "
+              f"Total Flux: {result.x.sum():.3e}")
+        if solver_options["method"] == "gradient":
+            uncertainty = incremental.uncertainty()
+            self.error_band = (uncertainty.mean, uncertainty.std())
+            print(f"Relative standard deviation RSD (linearized): {uncertainty.total_flux_rsd:.2%}")
+
+    def run_sequential_trainings(self, loss_threshold, num_runs, sink, seed, solver_options, warm_start=False,
+                                 resume=False):
+        # Worker thread: no Tk calls here, plots and progress go through self.progress
         # ✅ Back up the original x_dummy to avoid distortion from consecutive perturbations
         original_x_dummy = self.x_dummy.copy()
+        start_x = original_x_dummy
+        reference = None
+        epochs_used = []
+        self.progress.start(num_runs, len(sink.completed))
+        # 💾 The running iteration is checkpointed every minute and on Stop; Resume continues it from there
+        checkpointer = Checkpointer(checkpoint_path(sink.path))
+        try:
+            saved = checkpointer.load() if resume else None
+            if warm_start and len(sink.completed) < num_runs:
+                reference, start_x = self.warm_start_point(loss_threshold, solver_options)
+                solver_options = dict(solver_options, rescale=False)
+            settings = solver_settings(SpectrumUnfolder(self.A, loss_threshold, **solver_options))
+            if saved is not None and settings_changed(saved, settings):
+                # e.g. Developer Mode values or the solver method changed since the Stop
+                print(f"⚠️ Checkpoint {checkpointer.path} was written with other solver settings "
+                      f"({', '.join(settings_changed(saved, settings))}), the iteration starts over")
+                saved = None
 
-    # ✅ Save all initial spectrum lists
-        initial_spectra_list = []
+            # ✅ Save all initial spectrum lists
+            initial_spectra_list = []
 
-        for run in range(num_runs):
-            print(f"✅ Iteration {run + 1}")
-            print(f"Initial spectrum (Iteration {run + 1}):\n{self.x_dummy.flatten()}\n")
-           
-            self.x_dummy = original_x_dummy.copy()
+            # ✅ Every iteration is written to the output file as soon as it finishes
+            if sink.completed:
+                print(f"⏩ Resuming: {len(sink.completed)} iterations already in {sink.path}")
 
-            
-            initial_spectra_list.append(self.x_dummy.flatten().copy())
-            
-            
-            print("📋 Original activity b (total {} entries):".format(len(self.b)))
-            for i, val in enumerate(self.b):
-                print(f"  [{i+1}] {val.item():.4e}")
+            for run in range(num_runs):
+                if run in sink.completed:
+                    continue
+                self.progress.run = run
+                print(f"✅ Iteration {run + 1}")
+                print(f"Initial spectrum (Iteration {run + 1}):\n{self.x_dummy.flatten()}\n")
 
-            perturbed_b = self.b + np.random.normal(loc=0.0, scale=self.b_error)
+                self.x_dummy = start_x.copy()
 
 
-            x_variable, loss_history = self.run_one_training(loss_threshold, perturbed_b)
+                initial_spectra_list.append(self.x_dummy.flatten().copy())
 
-            self.plot_results(loss_history, x_variable.flatten())
-            all_results.append(x_variable.flatten())
-            print("Total Flux: {:.3e}".format(x_variable.sum()))
-           
 
-        
-        self.export_all_spectra_to_csv(all_results, save_path)
+                print("📋 Original activity b (total {} entries):".format(len(self.b)))
+                for i, val in enumerate(self.b):
+                    print(f"  [{i+1}] {val.item():.4e}")
+
+                # Own random stream per iteration: the same (seed, iteration) always gives the same b
+                perturbed_b = perturb_activities(self.b, self.b_error, seed, run)
+
+
+                state = run_state(saved, run, seed, perturbed_b, self.x_dummy, settings)
+                if state is not None:
+                    print(f"💾 Continuing iteration {run + 1} from the checkpoint at epoch {int(state['epoch'])}")
+                checkpointer.context = run_context(run, seed, perturbed_b, self.x_dummy, sink.completed, settings)
+                result = self.run_one_training(loss_threshold, perturbed_b, solver_options, callback=self.progress,
+                                               checkpoint=checkpointer, state=state)
+                if result.stop_reason == "cancelled":
+                    print(f"⏹ Iteration {run + 1} stopped after {result.epochs} epochs, checkpointed for Resume")
+                    break
+                x_variable = result.x
+                epochs_used.append(result.epochs)
+
+                self.progress.publish(result.loss_history, x_variable, final=True)
+                sink.write(run, x_variable, result.final_loss, result.epochs, result.stop_reason, seed,
+                           perturbed_b, loss_trace=result.loss_history)
+                self.progress.run_finished(result.epochs)
+                print("Total Flux: {:.3e}".format(x_variable.sum()))
+            if len(sink.completed) >= num_runs:
+                checkpointer.remove()
+        finally:
+            self.x_dummy = original_x_dummy
+            sink.close()
+
+        if reference is not None:
+            print(epochs_saved(reference.epochs, epochs_used))
+        print(f"All inversion results have been saved to：{sink.path}")
+
+    def run_batched_trainings(self, loss_threshold, num_runs, sink, seed, solver_options, warm_start=False):
+        # Worker thread, like run_sequential_trainings
+        unfolder = SpectrumUnfolder(
+            self.A,
+            loss_threshold,
+            verbose=True,
+            b_error=self.b_error,
+            rescale=not warm_start,
+            cancel=self.stop_training_flag,
+            **solver_options
+        )
+        with sink:
+            runs = [run for run in range(num_runs) if run not in sink.completed]
+            self.progress.start(num_runs, len(sink.completed))
+            if not runs:
+                print(f"All {num_runs} iterations are already in {sink.path}")
+                return
+            x0, reference = self.x_dummy, None
+            if warm_start:
+                reference, x0 = self.warm_start_point(loss_threshold, solver_options)
+            # All perturbed activity vectors stacked as rows of one (runs, m) matrix,
+            # each drawn from the same per-iteration stream as the sequential runs
+            perturbed_b = {run: perturb_activities(self.b, self.b_error, seed, run) for run in runs}
+            result = unfolder.solve_batch(x0, np.hstack([perturbed_b[run] for run in runs]).T,
+                                          callback=self.progress)
+
+            for i, run in enumerate(runs):
+                if result.stop_reason[i] == "cancelled":
+                    continue
+                sink.write(run, result.x[i], result.final_loss[i], result.epochs[i], result.stop_reason[i],
+                           seed, perturbed_b[run])
+                self.progress.run_finished(result.epochs[i])
+                print(f"✅ Iteration {run + 1}: epochs={result.epochs[i]}, loss={result.final_loss[i]:.4e}, "
+                      f"Total Flux: {result.x[i].sum():.3e}")
+
+        self.progress.publish(result.mean_loss_history, result.x[-1], final=True)
+        if reference is not None:
+            print(epochs_saved(reference.epochs, result.epochs))
+        print(f"All inversion results have been saved to：{sink.path}")
+
+    def run_parallel_trainings(self, loss_threshold, num_runs, save_path, seed, workers, resume, solver_options,
+                               warm_start=False):
+        # Worker thread: independent runs spread over a process pool; rows are written to save_path as they finish
+        epochs_used = []
+
+        def started(pending):
+            self.progress.start(num_runs, num_runs - len(pending))
+
+        def report(run_id, x, final_loss, epochs, stop_reason):
+            epochs_used.append(epochs)
+            self.progress.run_finished(epochs)
+            print(f"✅ Iteration {run_id + 1}: epochs={epochs}, loss={final_loss:.4e}, Total Flux: {x.sum():.3e}")
+
+        x0, reference = self.x_dummy, None
+        if warm_start:
+            reference, x0 = self.warm_start_point(loss_threshold, solver_options)
+        seed = run_parallel(
+            self.A, self.b, self.b_error, x0, self.A_header, save_path,
+            num_runs, loss_threshold,
+            seed=seed,
+            workers=workers,
+            on_result=report,
+            on_start=started,
+            resume=resume,
+            cancel=self.stop_training_flag,
+            rescale=not warm_start,
+            **solver_options
+        )
+        print(f"Random seed of this inversion: {seed}")
+        if reference is not None:
+            print(epochs_saved(reference.epochs, epochs_used))
+        print(f"All inversion results have been saved to：{save_path}")
 
-    def export_all_spectra_to_csv(self, all_results, save_path):
-        try:
-            df = pd.DataFrame(all_results, columns=self.A_header)
-            df.index = [f"Run_{i+1}" for i in range(len(all_results))]
-            df.to_csv(save_path)
-            print(f"All inversion results have been saved to：{save_path}")
-        except Exception as e:
-            print(f"Save failed: {e}")        
-    
     def save_canvas_plot(self):
         from tkinter import filedialog
         file_path = filedialog.asksaveasfilename(
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Problem bundles: an unfolding problem stored once in binary form.
+
+A bundle is a directory (by convention <name>.speckit) holding
+
+    A.npy, b.npy, b_error.npy, energies.npy   float32 arrays
+    prior.npy                                  initial spectrum (optional)
+    problem.json                               foil names, chi-square threshold, shapes
+
+The arrays are memory-mapped read-only on load, so opening a bundle costs
+no parsing. Bundles are made from the CSV written by the Data Preparation tab:
+
+    python -m problem_bundle parameters.csv --prior prior.txt -o problem.speckit
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from unfolding_engine import UnfoldingProblem, load_prior, load_problem
+
+
+BUNDLE_FILE = "problem.json"
+BUNDLE_SUFFIX = ".speckit"
+BUNDLE_VERSION = 1
+_ARRAYS = ("A", "b", "b_error", "energies", "prior")
+
+
+def _bundle_dir(path):
+    # A bundle is addressed by its directory or by its problem.json
+    return os.path.dirname(path) if os.path.basename(path) == BUNDLE_FILE else path
+
+
+def is_bundle(path):
+    return os.path.isfile(os.path.join(_bundle_dir(path), BUNDLE_FILE))
+
+
+def save_bundle(path, problem, prior=None):
+    """Write an UnfoldingProblem (and optionally its prior spectrum) as a bundle directory."""
+    prior = prior if prior is not None else problem.prior
+    arrays = {
+        "A": problem.A,
+        "b": problem.b,
+        "b_error": problem.b_error,
+        "energies": problem.energies,
+        "prior": None if prior is None else np.ravel(prior),
+    }
+    if arrays["prior"] is not None and len(arrays["prior"]) != problem.A.shape[1]:
+        raise ValueError(f"Number of initial values ({len(arrays['prior'])}) does not match "
+                         f"the number of unknowns in A ({problem.A.shape[1]}).")
+
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        target = os.path.join(path, name + ".npy")
+        if array is None:
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        np.save(target, np.ascontiguousarray(array, dtype=np.float32))
+
+    meta = {
+        "version": BUNDLE_VERSION,
+        "shape": list(problem.A.shape),
+        "names": list(problem.names),
+        "loss_threshold": float(problem.loss_threshold),
+        "has_prior": prior is not None,
+    }
+    # problem.json is written last: a bundle without it is incomplete
+    tmp = os.path.join(path, BUNDLE_FILE + ".tmp")
+    with open(tmp, 'w') as file:
+        json.dump(meta, file, indent=1)
+    os.replace(tmp, os.path.join(path, BUNDLE_FILE))
+    return path
+
+
+def load_bundle(path, mmap_mode='r'):
+    """UnfoldingProblem of a bundle; arrays are memory-mapped (mmap_mode=None loads them into memory)."""
+    path = _bundle_dir(path)
+    with open(os.path.join(path, BUNDLE_FILE), 'r') as file:
+        meta = json.load(file)
+    if meta.get("version", 0) > BUNDLE_VERSION:
+        raise ValueError(f"Problem bundle version {meta['version']} is newer than this program supports.")
+
+    arrays = {}
+    for name in _ARRAYS:
+        target = os.path.join(path, name + ".npy")
+        if name == "prior" and not meta.get("has_prior"):
+            arrays[name] = None
+            continue
+        arrays[name] = np.load(target, mmap_mode=mmap_mode)
+
+    if list(arrays["A"].shape) != meta["shape"]:
+        raise ValueError(f"A.npy has shape {arrays['A'].shape}, problem.json says {tuple(meta['shape'])}.")
+    return UnfoldingProblem(arrays["A"], arrays["b"], arrays["b_error"], arrays["energies"],
+                            names=meta["names"], prior=arrays["prior"],
+                            loss_threshold=meta["loss_threshold"])
+
+
+def import_csv(problem_file, bundle_path, prior_file=None):
+    """Convert a parameter CSV (and prior spectrum file) into a bundle."""
+    problem = load_problem(problem_file)
+    prior = load_prior(prior_file, problem.A.shape[1]) if prior_file else None
+    return save_bundle(bundle_path, problem, prior)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m problem_bundle",
+                                     description="Convert an activation product parameter CSV into a problem bundle.")
+    parser.add_argument("problem", help="activation product parameter CSV (A, b, b_error)")
+    parser.add_argument("--prior", default=None, help="initial spectrum file stored with the problem")
+    parser.add_argument("-o", "--output", default=None,
+                        help=f"bundle directory (default: <problem>{BUNDLE_SUFFIX})")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.problem)[0] + BUNDLE_SUFFIX
+    import_csv(args.problem, output, args.prior)
+    problem = load_bundle(output)
+    print(f"{problem.A.shape[0]} foils x {problem.A.shape[1]} groups saved to {output}"
+          f"{' (with prior)' if problem.prior is not None else ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Progress channel between a solver thread and the GUI.
+
+The solver calls the channel as its callback (loss_history, x). A snapshot
+is queued at most every `interval` seconds, so the solver pays one clock
+read per callback; the Tk side collects snapshots with poll() from a
+root.after timer and never runs inside the solver thread.
+
+The channel also counts the campaign progress (runs done, epochs) written by
+the training thread and read by the Tk side for the progress bar, the
+epochs/s and the ETA.
+"""
+
+import queue
+import time
+
+import numpy as np
+
+from loss_trace import LossTrace
+
+
+class ProgressSnapshot:
+    """State of a run at one moment (copies, safe to use from another thread)."""
+
+    def __init__(self, run, epoch, loss, loss_epochs, loss_values, x, final=False):
+        self.run = run                  # Monte Carlo run index (from 0)
+        self.epoch = epoch
+        self.loss = loss
+        self.loss_epochs = loss_epochs  # sampled epochs of the loss curve
+        self.loss_values = loss_values
+        self.x = x                      # (n,) group flux
+        self.final = final              # last snapshot of the run
+
+
+def sample_loss_history(loss_history, max_points=2000, skip=5):
+    """At most max_points (epoch, loss) pairs of a loss history, first `skip` epochs left out."""
+    if isinstance(loss_history, LossTrace):
+        # Already bounded: min/max buckets, at most 2 points per bucket
+        return loss_history.plot_points(skip if len(loss_history) > skip else 0)
+    loss_history = np.asarray(loss_history)
+    count = len(loss_history)
+    if count <= skip:
+        return np.arange(count), loss_history.astype(np.float64)
+    if count - skip <= max_points:
+        epochs = np.arange(skip, count)
+    else:
+        epochs = np.unique(np.linspace(skip, count - 1, max_points).astype(np.int64))
+    return epochs, loss_history[epochs].astype(np.float64)
+
+
+class ProgressChannel:
+    """Time-throttled queue of ProgressSnapshot objects."""
+
+    def __init__(self, interval=0.2, max_points=2000, live=True):
+        self.interval = interval
+        self.max_points = max_points
+        self.live = live              # False: only count epochs, no snapshots of running runs
+        self.run = 0
+        self._queue = queue.Queue()
+        self._last = float("-inf")
+        self.start(0)
+
+    def start(self, total, done=0):
+        """Start of a campaign of `total` runs, `done` of them already finished (resume)."""
+        self.total = total
+        self.done = done
+        self.epochs = 0               # epochs of the runs finished since start()
+        self.epoch = 0                # epochs of the current run
+        self._started_done = done
+        self._started = time.monotonic()
+
+    def run_finished(self, epochs):
+        self.done += 1
+        self.epochs += int(epochs)
+        self.epoch = 0
+
+    def epochs_per_second(self):
+        elapsed = time.monotonic() - self._started
+        return (self.epochs + self.epoch) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """Seconds left, extrapolated from the runs finished since start(); None before the first one."""
+        finished = self.done - self._started_done
+        if finished <= 0:
+            return None
+        return (time.monotonic() - self._started) / finished * max(self.total - self.done, 0)
+
+    def __call__(self, loss_history, x):
+        # Solver callback: cheap unless a snapshot is due
+        self.epoch = len(loss_history)
+        if not self.live:
+            return
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        self.publish(loss_history, x)
+
+    def publish(self, loss_history, x, final=False):
+        epochs, values = sample_loss_history(loss_history, self.max_points)
+        loss = float(loss_history[-1]) if len(loss_history) else float("nan")
+        self._queue.put(ProgressSnapshot(self.run, len(loss_history), loss, epochs, values,
+                                         np.array(x, dtype=np.float64).ravel(), final))
+
+    def poll(self):
+        """All snapshots queued since the last poll, oldest first."""
+        snapshots = []
+        while True:
+            try:
+                snapshots.append(self._queue.get_nowait())
+            except queue.Empty:
+                return snapshots
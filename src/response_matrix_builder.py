@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Batch response-matrix builder.
+
+Builds the activation product parameter CSV (the file written row by row by
+the Data Preparation tab) for a whole set of foils and several group
+structures in one call:
+
+    python -m response_matrix_builder manifest.csv --groups prior_60.txt prior_113.txt -o out_dir
+
+The manifest is a CSV with one foil per row and the columns
+material, reaction_file, mass, atomic_mass, half_life, irradiation_time,
+cooling_time, activity, activity_error (times in hours, as in the tab).
+Every reaction file is parsed once, collapsed to all group structures, and
+the per-file work runs on a process pool.
+"""
+
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from cross_section_processing import (COLLAPSE_METHODS, WEIGHTINGS, activation_factor,
+                                      group_cross_sections, read_group_structure)
+
+
+MANIFEST_COLUMNS = ("material", "reaction_file", "mass", "atomic_mass", "half_life",
+                    "irradiation_time", "cooling_time", "activity", "activity_error")
+
+
+class Foil:
+    """One manifest row."""
+
+    def __init__(self, material, reaction_file, mass, atomic_mass, half_life,
+                 irradiation_time, cooling_time, activity, activity_error):
+        self.material = material
+        self.reaction_file = reaction_file
+        self.mass = float(mass)
+        self.atomic_mass = float(atomic_mass)
+        self.half_life = float(half_life)
+        self.irradiation_time = float(irradiation_time)
+        self.cooling_time = float(cooling_time)
+        self.activity = float(activity)
+        self.activity_error = float(activity_error)
+
+    @property
+    def activation_factor(self):
+        return activation_factor(self.mass, self.atomic_mass, self.half_life,
+                                 self.irradiation_time, self.cooling_time)
+
+
+def read_manifest(manifest_path, library_dir=None):
+    """Foils of a manifest; reaction files are looked up next to the manifest, then in library_dir."""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    foils = []
+    with open(manifest_path, newline='') as file:
+        reader = csv.DictReader(file)
+        missing = [c for c in MANIFEST_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Manifest is missing the columns: {', '.join(missing)}")
+        for row in reader:
+            if not row["material"]:
+                continue
+            path = row["reaction_file"]
+            if not os.path.isabs(path):
+                candidates = [os.path.join(base_dir, path)]
+                if library_dir:
+                    candidates.append(os.path.join(library_dir, path))
+                path = next((c for c in candidates if os.path.exists(c)), candidates[0])
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Reaction file not found for {row['material']}: {row['reaction_file']}")
+            foils.append(Foil(row["material"], path, *(row[c] for c in MANIFEST_COLUMNS[2:])))
+    return foils
+
+
+def _collapse_file(task):
+    # One reaction file collapsed to every group structure (runs in a worker process)
+    file_path, structures, method, weighting = task
+    return [group_cross_sections(file_path, bins, method, weighting,
+                                 prior=(bins, flux) if weighting == "prior" else None)
+            for bins, flux in structures]
+
+
+def build_response_matrices(foils, group_files, method="average", weighting="flat", workers=None):
+    """
+    Rows of the parameter CSV for every group structure.
+
+    Returns {group_file: (energy_bins_eV, rows)} where every row is
+    [material, group values..., activity, activity error].
+    """
+    structures = [read_group_structure(path) for path in group_files]
+    reaction_files = list(dict.fromkeys(foil.reaction_file for foil in foils))
+    tasks = [(path, structures, method, weighting) for path in reaction_files]
+
+    workers = min(workers or os.cpu_count(), len(tasks)) if tasks else 1
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            collapsed = list(pool.map(_collapse_file, tasks))
+    else:
+        collapsed = [_collapse_file(task) for task in tasks]
+    by_file = dict(zip(reaction_files, collapsed))
+
+    matrices = {}
+    for s, group_file in enumerate(group_files):
+        rows = []
+        for foil in foils:
+            factor = foil.activation_factor
+            values = [x * factor for x in by_file[foil.reaction_file][s].tolist()]
+            rows.append([foil.material] + values + [foil.activity, foil.activity_error])
+        matrices[group_file] = (structures[s][0], rows)
+    return matrices
+
+
+def write_parameter_csv(output_path, energy_bins, rows):
+    """Write the matrix in the Data Preparation CSV layout."""
+    header = ["material message"] + [f"{e * 1e-6:.3e}" for e in energy_bins] + ["Measured Activity (Bq)", "Activity Error (Bq)"]
+    with open(output_path, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def output_paths(manifest_path, group_files, output):
+    """A single .csv output for one structure, otherwise <manifest>_<group file>.csv in the output directory."""
+    if len(group_files) == 1 and output.endswith(".csv"):
+        return {group_files[0]: output}
+    os.makedirs(output, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(manifest_path))[0]
+    return {g: os.path.join(output, f"{stem}_{os.path.splitext(os.path.basename(g))[0]}.csv") for g in group_files}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m response_matrix_builder",
+        description="Build activation product parameter CSVs for a foil manifest.")
+    parser.add_argument("manifest", help="foil manifest CSV")
+    parser.add_argument("--groups", nargs="+", required=True, help="energy bin file(s) (MeV)")
+    parser.add_argument("-o", "--output", required=True,
+                        help="output CSV (one group structure) or output directory")
+    parser.add_argument("--library", default=None, help="directory with the reaction cross-section files")
+    parser.add_argument("--method", choices=COLLAPSE_METHODS, default="average")
+    parser.add_argument("--weighting", choices=WEIGHTINGS, default="flat")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    foils = read_manifest(args.manifest, args.library)
+    matrices = build_response_matrices(foils, args.groups, args.method, args.weighting, args.workers)
+    for group_file, path in output_paths(args.manifest, args.groups, args.output).items():
+        energy_bins, rows = matrices[group_file]
+        write_parameter_csv(path, energy_bins, rows)
+        print(f"{len(rows)} foils x {len(energy_bins)} groups saved to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
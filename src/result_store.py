@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming storage of Monte Carlo unfolding results.
+
+Every finished run is appended to disk at once (spectrum, final loss, epochs,
+stop reason, seed, perturbed activities and the decimated loss trace), so a
+crash loses at most the run being written and memory does not grow with the
+number of runs.
+
+Two formats, chosen by the file name:
+
+    *.csv    spectra in the Run_<id> layout read by the Error Bar Viewer, plus
+             a sidecar <name>_runs.csv with the per-run metadata and activities
+             and <name>_loss.csv with the min/max loss buckets of every run
+    *.runs   fixed-size binary records (see RECORD layout in BinaryResultSink),
+             read back column by column with read_binary_results()
+
+With resume=True the existing file is kept, a partly written last row or
+record is cut off and the run IDs already on disk are listed in
+sink.completed so that they can be skipped. A file written for another group
+structure or number of activities is refused (ValueError), and the CSV
+sidecars are cut back to the runs present in the spectra file.
+"""
+
+import csv
+import json
+import os
+import struct
+
+import numpy as np
+
+from loss_trace import SAVED_TRACE_BUCKETS
+
+
+BINARY_SUFFIX = ".runs"
+RUNS_SIDECAR_SUFFIX = "_runs.csv"
+LOSS_SIDECAR_SUFFIX = "_loss.csv"
+_MAGIC = b"SPKRUNS1"
+
+
+def sidecar_path(path):
+    """Metadata file written next to a CSV result file."""
+    return os.path.splitext(path)[0] + RUNS_SIDECAR_SUFFIX
+
+
+def loss_sidecar_path(path):
+    """Loss-trace file written next to a CSV result file."""
+    return os.path.splitext(path)[0] + LOSS_SIDECAR_SUFFIX
+
+
+def complete_length(path):
+    """Bytes of `path` up to and including its last newline (a partly written last line excluded)."""
+    with open(path, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        while position > 0:
+            step = min(65536, position)
+            file.seek(position - step)
+            newline = file.read(step).rfind(b"\n")
+            if newline >= 0:
+                return position - step + newline + 1
+            position -= step
+    return 0
+
+
+def _truncate_partial_line(path):
+    # Drop an unterminated last line (run interrupted while writing)
+    length = complete_length(path)
+    if length < os.path.getsize(path):
+        with open(path, 'rb+') as file:
+            file.truncate(length)
+
+
+def _keep_completed_rows(path, completed):
+    # Drop the sidecar rows of runs missing from the spectra file (crash between the two writes)
+    with open(path, newline='') as file:
+        rows = list(csv.reader(file))
+    kept = rows[:1] + [row for row in rows[1:]
+                       if row and row[0].startswith("Run_") and int(row[0][4:]) - 1 in completed]
+    if len(kept) < len(rows):
+        temporary = path + ".tmp"
+        with open(temporary, 'w', newline='') as file:
+            csv.writer(file).writerows(kept)
+        os.replace(temporary, path)
+
+
+def _seed_text(seed):
+    return "" if seed is None else str(int(seed))
+
+
+class CsvResultSink:
+    """Run_<id> spectra CSV with a <name>_runs.csv metadata sidecar."""
+
+    def __init__(self, path, energies, num_activities, resume=False):
+        self.path = path
+        self.energies = np.asarray(energies)
+        self.num_activities = num_activities
+        self.completed = set()
+        self.seed = None
+
+        sidecar = sidecar_path(path)
+        resuming = resume and os.path.exists(path) and os.path.getsize(path) > 0
+        if resuming:
+            _truncate_partial_line(path)
+            with open(path, newline='') as file:
+                rows = csv.reader(file)
+                header = next(rows, [])
+                saved = np.array(header[1:], dtype=np.float64)
+                if len(saved) != len(self.energies) or not np.allclose(saved, self.energies.astype(np.float64),
+                                                                        rtol=1e-6, atol=0.0):
+                    raise ValueError(f"{path} holds {len(saved)} groups with other energies than the problem "
+                                     f"({len(self.energies)} groups).")
+                for row in rows:
+                    if len(row) == len(self.energies) + 1 and row[0].startswith("Run_"):
+                        self.completed.add(int(row[0][4:]) - 1)
+            if os.path.exists(sidecar) and os.path.getsize(sidecar) > 0:
+                _truncate_partial_line(sidecar)
+                with open(sidecar, newline='') as file:
+                    columns = next(csv.reader(file), [])
+                activities = len([c for c in columns if c.startswith("b_")])
+                if activities != num_activities:
+                    raise ValueError(f"{sidecar} holds {activities} activities, the problem has {num_activities}.")
+                _keep_completed_rows(sidecar, self.completed)
+                with open(sidecar, newline='') as file:
+                    for row in csv.DictReader(file):
+                        if row.get("seed"):
+                            self.seed = int(row["seed"])
+                            break
+            loss_path = loss_sidecar_path(path)
+            if os.path.exists(loss_path) and os.path.getsize(loss_path) > 0:
+                _truncate_partial_line(loss_path)
+                _keep_completed_rows(loss_path, self.completed)
+
+        mode = 'a' if resuming else 'w'
+        self._file = open(path, mode, newline='')
+        self._writer = csv.writer(self._file)
+        new_sidecar = not (resuming and os.path.exists(sidecar) and os.path.getsize(sidecar) > 0)
+        self._meta_file = open(sidecar, 'w' if new_sidecar else 'a', newline='')
+        self._meta_writer = csv.writer(self._meta_file)
+        if not resuming:
+            self._writer.writerow([""] + [str(e) for e in self.energies])
+            self._file.flush()
+        if new_sidecar:
+            self._meta_writer.writerow(["run", "seed", "final_loss", "epochs", "stop_reason"]
+                                       + [f"b_{i + 1}" for i in range(num_activities)])
+            self._meta_file.flush()
+        self._resuming = resuming
+        self._loss_file = None     # opened with the first loss trace
+
+    def _write_loss_trace(self, run_id, loss_trace):
+        if self._loss_file is None:
+            loss_path = loss_sidecar_path(self.path)
+            append = self._resuming and os.path.exists(loss_path) and os.path.getsize(loss_path) > 0
+            if append:
+                _truncate_partial_line(loss_path)
+            self._loss_file = open(loss_path, 'a' if append else 'w', newline='')
+            self._loss_writer = csv.writer(self._loss_file)
+            if not append:
+                self._loss_writer.writerow(["run", "epochs", "bucket_width"]
+                                           + [f"min_{i + 1}" for i in range(SAVED_TRACE_BUCKETS)]
+                                           + [f"max_{i + 1}" for i in range(SAVED_TRACE_BUCKETS)])
+        width, mins, maxs = loss_trace.to_record()
+        used = int(np.count_nonzero(~np.isnan(mins)))
+        padding = [""] * (SAVED_TRACE_BUCKETS - used)
+        self._loss_writer.writerow([f"Run_{run_id + 1}", len(loss_trace), width]
+                                   + [repr(float(v)) for v in mins[:used]] + padding
+                                   + [repr(float(v)) for v in maxs[:used]] + padding)
+        self._loss_file.flush()
+
+    def write(self, run_id, x, final_loss=None, epochs=None, stop_reason=None, seed=None, perturbed_b=None,
+              loss_trace=None):
+        """Append one run (run_id counts from 0, stored as Run_<run_id + 1>)."""
+        b = [] if perturbed_b is None else [str(v) for v in np.ravel(perturbed_b)]
+        if loss_trace is not None:
+            self._write_loss_trace(run_id, loss_trace)
+        # Metadata first: a crash in between leaves an extra sidecar row, never a spectrum without one
+        self._meta_writer.writerow([f"Run_{run_id + 1}", _seed_text(seed),
+                                    "" if final_loss is None else str(final_loss),
+                                    "" if epochs is None else int(epochs),
+                                    stop_reason or ""] + b)
+        self._meta_file.flush()
+        self._writer.writerow([f"Run_{run_id + 1}"] + [str(v) for v in np.ravel(x)])
+        self._file.flush()
+        self.completed.add(run_id)
+
+    def close(self):
+        self._file.close()
+        self._meta_file.close()
+        if self._loss_file is not None:
+            self._loss_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def record_dtype(num_groups, num_activities, trace_buckets=0):
+    """Layout of one binary record (version 1 files have no loss trace: trace_buckets=0)."""
+    fields = [
+        ("run", "<i8"),
+        ("seed", "S40"),          # decimal, SeedSequence entropy can exceed 64 bits
+        ("final_loss", "<f8"),
+        ("epochs", "<i8"),
+        ("stop_reason", "S12"),
+        ("x", "<f8", (num_groups,)),
+        ("b", "<f8", (num_activities,)),
+    ]
+    if trace_buckets:
+        fields += [
+            ("trace_width", "<i8"),                  # epochs per loss bucket, 0 without a trace
+            ("trace_min", "<f4", (trace_buckets,)),  # NaN after the last bucket
+            ("trace_max", "<f4", (trace_buckets,)),
+        ]
+    return np.dtype(fields)
+
+
+def _read_binary_header(file):
+    magic = file.read(len(_MAGIC))
+    if magic != _MAGIC:
+        raise ValueError("Not a SpecKit binary result file.")
+    (length,) = struct.unpack("<I", file.read(4))
+    meta = json.loads(file.read(length).decode("utf-8"))
+    return meta, len(_MAGIC) + 4 + length
+
+
+class BinaryResultSink:
+    """Fixed-size binary records after a small JSON header (energies, record sizes)."""
+
+    def __init__(self, path, energies, num_activities, resume=False):
+        self.path = path
+        self.energies = np.asarray(energies, dtype=np.float64)
+        self.num_activities = num_activities
+        self.trace_buckets = SAVED_TRACE_BUCKETS
+        self.completed = set()
+        self.seed = None
+
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as file:
+                meta, offset = _read_binary_header(file)
+            if (meta["groups"], meta["activities"]) != (len(self.energies), num_activities):
+                raise ValueError(f"{path} holds {meta['groups']} groups x {meta['activities']} activities, "
+                                 f"the problem has {len(self.energies)} x {num_activities}.")
+            self.trace_buckets = meta.get("trace_buckets", 0)
+            self.dtype = record_dtype(len(self.energies), num_activities, self.trace_buckets)
+            count = (os.path.getsize(path) - offset) // self.dtype.itemsize
+            with open(path, 'rb+') as file:
+                file.truncate(offset + count * self.dtype.itemsize)   # drop a partial record
+            if count:
+                records = np.memmap(path, dtype=self.dtype, mode='r', offset=offset, shape=(count,))
+                self.completed = set(records["run"].tolist())
+                seeds = [s for s in records["seed"][:1].tolist() if s]
+                self.seed = int(seeds[0]) if seeds else None
+                del records
+            self._file = open(path, 'ab')
+        else:
+            self.dtype = record_dtype(len(self.energies), num_activities, self.trace_buckets)
+            self._file = open(path, 'wb')
+            header = json.dumps({"version": 2, "groups": len(self.energies), "activities": num_activities,
+                                 "trace_buckets": self.trace_buckets,
+                                 "energies": self.energies.tolist()}).encode("utf-8")
+            self._file.write(_MAGIC + struct.pack("<I", len(header)) + header)
+            self._file.flush()
+
+    def write(self, run_id, x, final_loss=None, epochs=None, stop_reason=None, seed=None, perturbed_b=None,
+              loss_trace=None):
+        record = np.zeros(1, dtype=self.dtype)
+        record["run"] = run_id
+        record["seed"] = _seed_text(seed).encode()
+        record["final_loss"] = np.nan if final_loss is None else final_loss
+        record["epochs"] = -1 if epochs is None else epochs
+        record["stop_reason"] = (stop_reason or "").encode()
+        record["x"] = np.ravel(x)
+        record["b"] = np.nan if perturbed_b is None else np.ravel(perturbed_b)
+        if self.trace_buckets:
+            if loss_trace is None:
+                record["trace_min"] = record["trace_max"] = np.nan
+            else:
+                record["trace_width"], record["trace_min"], record["trace_max"] = \
+                    loss_trace.to_record(self.trace_buckets)
+        self._file.write(record.tobytes())
+        self._file.flush()
+        self.completed.add(run_id)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_result_sink(path, energies, num_activities, resume=False):
+    """CsvResultSink, or BinaryResultSink for a *.runs path."""
+    sink = BinaryResultSink if path.endswith(BINARY_SUFFIX) else CsvResultSink
+    return sink(path, energies, num_activities, resume)
+
+
+def read_binary_results(path):
+    """(energies, records) of a *.runs file; records is a read-only memory-mapped structured array."""
+    with open(path, 'rb') as file:
+        meta, offset = _read_binary_header(file)
+    dtype = record_dtype(meta["groups"], meta["activities"], meta.get("trace_buckets", 0))
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    energies = np.array(meta["energies"])
+    if count == 0:
+        return energies, np.zeros(0, dtype=dtype)
+    return energies, np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Alternative solver backends for SpectrumUnfolder.
+
+All backends start from the rescaled prior, keep zero prior groups at zero,
+evaluate the same loss as the gradient-descent solver (mean squared activity
+residual + λ·log-smoothness) and stop with the same rules: loss below the
+chi-square threshold, a 500-epoch plateau, or max_epochs. Backends that
+end for another reason report it as such: "lbfgsb_stop" when scipy's
+L-BFGS-B stops on its own (line search failure, maxfun, stationary point),
+"unconverged" when even the weakest nnls anchor misses the threshold.
+
+    "fista"  accelerated projected gradient with adaptive restart
+    "lbfgsb" bound-constrained L-BFGS-B (scipy)
+    "nnls"   prior-anchored non-negative least squares (scipy), anchor weight
+             chosen by bisection so that the loss meets the threshold
+    "mlem"   multiplicative MLEM update
+    "gravel" multiplicative GRAVEL (SAND-II type) update weighted by b_error
+"""
+
+from collections import deque
+
+import numpy as np
+
+from loss_trace import LossTrace
+from unfolding_engine import (CANCEL_CHECK_INTERVAL, MIN_FLUX, PLATEAU_TOLERANCE, PLATEAU_WINDOW,
+                              UnfoldingResult)
+
+
+def unfolding_loss(A, b, x, smoothness):
+    """Loss of the gradient-descent solver for a 1-D spectrum x."""
+    error = A @ x - b
+    penalty = np.mean(np.square(np.diff(np.log(x + 1e-12))))
+    return np.mean(np.square(error)) + smoothness * penalty
+
+
+def unfolding_loss_gradient(A, b, x, smoothness):
+    """Loss and its gradient (data term and log-smoothness term)."""
+    m = A.shape[0]
+    error = A @ x - b
+    log_x = np.log(x + 1e-12)
+    d = np.diff(log_x)
+    loss = np.mean(np.square(error)) + smoothness * np.mean(np.square(d))
+
+    gradient = (2.0 / m) * (A.T @ error)
+    if len(d):
+        # ∂/∂x_j mean(d²) = 2 (d_{j-1} - d_j) / ((n-1) (x_j + 1e-12))
+        dd = np.zeros_like(x)
+        dd[1:] += d
+        dd[:-1] -= d
+        gradient += smoothness * 2.0 * dd / (len(d) * (x + 1e-12))
+    return loss, gradient
+
+
+def activity_erre(A, x, b):
+    """ERRE: mean relative deviation |Ax - b| / b of the recalculated activities."""
+    b = np.ravel(b)
+    calculated = A @ np.ravel(x)
+    return np.mean(np.abs(calculated - b) / np.abs(b))
+
+
+class _Problem:
+    """Quantities shared by the backends for one activity vector."""
+
+    def __init__(self, unfolder, x0, b_vector):
+        self.A = np.asarray(unfolder.A, dtype=np.float64)
+        self.b = np.ravel(np.asarray(b_vector, dtype=np.float64))
+        self.smoothness = unfolder.smoothness
+        self.threshold = unfolder.loss_threshold
+        self.max_epochs = unfolder.max_epochs
+        self.verbose = unfolder.verbose
+        self.cancel = unfolder.cancel
+        self.b_error = None if unfolder.b_error is None else np.ravel(np.asarray(unfolder.b_error, dtype=np.float64))
+
+        x0 = np.ravel(np.asarray(x0, dtype=np.float64))
+        self.free = x0 != 0
+        x_start = np.where(self.free, np.maximum(x0, MIN_FLUX), 0.0)
+        # Same epoch-0 normalisation as the gradient solver: match the mean activity ratio
+        scaling_factor = np.mean((self.A @ x_start) / self.b) if unfolder.rescale else 1.0
+        self.x_start = np.where(self.free, np.maximum(x_start / scaling_factor, MIN_FLUX), 0.0)
+        self.matrix_products = 1
+
+    def loss(self, x):
+        return unfolding_loss(self.A, self.b, x, self.smoothness)
+
+    def result(self, x, loss_history, stop_reason):
+        if not isinstance(loss_history, LossTrace):
+            losses, loss_history = loss_history, LossTrace()
+            loss_history.extend(losses)
+        if self.verbose:
+            print("Final Loss Function Value (single run):", loss_history[-1])
+        return UnfoldingResult(x.reshape(1, -1), loss_history, len(loss_history), stop_reason,
+                               matrix_products=self.matrix_products)
+
+
+class _StoppingRule:
+    """Threshold, plateau and cancel checks shared by the iterative backends."""
+
+    def __init__(self, threshold, cancel=None):
+        self.threshold = threshold
+        self.cancel = cancel
+        self.loss_history = LossTrace()
+        self.window = deque(maxlen=PLATEAU_WINDOW)   # full-precision losses for the plateau check
+
+    def __call__(self, loss):
+        self.loss_history.append(loss)
+        self.window.append(loss)
+        if loss < self.threshold:
+            return "threshold"
+        if len(self.window) == PLATEAU_WINDOW:
+            recent_losses = self.window
+            max_loss = max(recent_losses)
+            if abs(max_loss - min(recent_losses)) / max_loss < PLATEAU_TOLERANCE:
+                return "plateau"
+        if self.cancel is not None and len(self.loss_history) % CANCEL_CHECK_INTERVAL == 0 and self.cancel.is_set():
+            return "cancelled"
+        return None
+
+
+def solve_fista(unfolder, x0, b_vector):
+    p = _Problem(unfolder, x0, b_vector)
+    A, b, λ = p.A, p.b, p.smoothness
+    stop = _StoppingRule(p.threshold, p.cancel)
+
+    # Diagonal preconditioning by the starting spectrum (iterate on x / x_start);
+    # step from the Lipschitz constant of the data term, shrunk by backtracking when needed
+    D = np.where(p.free, p.x_start, 0.0)
+    step = A.shape[0] / (2.0 * np.linalg.norm(A * D, 2) ** 2)
+    x = p.x_start.copy()
+    y = x.copy()
+    t = 1.0
+    loss_x = p.loss(x)
+    stop_reason = "max_epochs"
+
+    for epoch in range(p.max_epochs):
+        loss_y, gradient = unfolding_loss_gradient(A, b, y, λ)
+        p.matrix_products += 2
+        while True:
+            x_new = np.where(p.free, np.maximum(y - step * D * D * gradient, MIN_FLUX), 0.0)
+            loss_new = p.loss(x_new)
+            p.matrix_products += 1
+            delta = x_new - y
+            quadratic = np.sum(np.divide(delta * delta, D * D, out=np.zeros_like(delta), where=D > 0))
+            if loss_new <= loss_y + gradient @ delta + quadratic / (2 * step) or step < 1e-30:
+                break
+            step *= 0.5
+
+        t_new = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        if loss_new > loss_x:
+            # Adaptive restart: drop the momentum when the loss goes up
+            t_new = 1.0
+            y = x.copy()
+        else:
+            y = x_new + ((t - 1) / t_new) * (x_new - x)
+            y = np.where(p.free, np.maximum(y, MIN_FLUX), 0.0)
+            x, loss_x = x_new, loss_new
+        t = t_new
+
+        stop_reason = stop(loss_x) or stop_reason
+        if stop_reason != "max_epochs":
+            break
+
+    return p.result(x, stop.loss_history, stop_reason)
+
+
+class _ThresholdReached(Exception):
+    pass
+
+
+def solve_lbfgsb(unfolder, x0, b_vector):
+    from scipy.optimize import minimize
+
+    p = _Problem(unfolder, x0, b_vector)
+    A, b, λ = p.A, p.b, p.smoothness
+    stop = _StoppingRule(p.threshold, p.cancel)
+    free = p.free
+    # Work in units of the starting spectrum so that all groups are O(1)
+    scale = p.x_start[free]
+    state = {"x": p.x_start.copy(), "reason": "max_epochs"}
+
+    def expand(z):
+        x = np.zeros_like(p.x_start)
+        x[free] = z * scale
+        return x
+
+    def fun(z):
+        loss, gradient = unfolding_loss_gradient(A, b, expand(z), λ)
+        p.matrix_products += 2
+        return loss, gradient[free] * scale
+
+    def callback(z):
+        x = expand(z)
+        state["x"] = x
+        p.matrix_products += 1
+        reason = stop(p.loss(x))
+        if reason is not None:
+            state["reason"] = reason
+            raise _ThresholdReached()
+
+    z0 = np.ones(free.sum())
+    bounds = [(MIN_FLUX / s, None) for s in scale]
+    try:
+        res = minimize(fun, z0, jac=True, method="L-BFGS-B", bounds=bounds, callback=callback,
+                       options={"maxiter": p.max_epochs, "maxfun": 2 * p.max_epochs,
+                                "ftol": 0.0, "gtol": 0.0})
+        state["x"] = expand(res.x)
+        p.matrix_products += 1
+        stop.loss_history.append(p.loss(state["x"]))
+        if stop.loss_history[-1] < p.threshold:
+            state["reason"] = "threshold"
+        elif res.status != 1 or res.nit < p.max_epochs:
+            # status 1 with nit = maxiter is max_epochs; anything else is scipy giving up
+            state["reason"] = "lbfgsb_stop"
+            if p.verbose:
+                print(f"L-BFGS-B stopped after {res.nit} iterations: {res.message}")
+    except _ThresholdReached:
+        pass
+
+    return p.result(state["x"], stop.loss_history, state["reason"])
+
+
+def solve_nnls(unfolder, x0, b_vector):
+    from scipy.optimize import nnls
+
+    p = _Problem(unfolder, x0, b_vector)
+    A, b = p.A, p.b
+    free = p.free
+    A_free = A[:, free]
+    x_prior = p.x_start[free]
+    # Anchor rows pull every group towards the prior in relative terms: μ·(x_j / x_prior_j - 1)
+    W = np.diag(1.0 / x_prior)
+    loss_history = []
+
+    def solve_anchored(mu):
+        M = np.vstack([A_free, np.sqrt(mu) * W])
+        rhs = np.concatenate([b, np.sqrt(mu) * np.ones(len(x_prior))])
+        z, _ = nnls(M, rhs, maxiter=50 * M.shape[1])
+        p.matrix_products += 1
+        x = np.zeros_like(p.x_start)
+        x[free] = np.maximum(z, MIN_FLUX)
+        loss = p.loss(x)
+        loss_history.append(loss)
+        return x, loss
+
+    # Discrepancy principle: the strongest anchor whose solution still meets the threshold
+    lo, hi = -12.0, 12.0
+    x_best, loss_best = solve_anchored(10.0 ** lo)
+    if loss_best >= p.threshold:
+        return p.result(x_best, loss_history, "unconverged")
+    x_hi, loss_hi = solve_anchored(10.0 ** hi)
+    if loss_hi < p.threshold:
+        return p.result(x_hi, loss_history, "threshold")
+    for _ in range(40):
+        if hi - lo < 0.05 or len(loss_history) >= p.max_epochs:
+            break
+        mid = (lo + hi) / 2
+        x_mid, loss_mid = solve_anchored(10.0 ** mid)
+        if loss_mid < p.threshold:
+            lo, x_best = mid, x_mid
+        else:
+            hi = mid
+    loss_history.append(p.loss(x_best))
+    return p.result(x_best, loss_history, "threshold")
+
+
+def _solve_multiplicative(unfolder, x0, b_vector, update):
+    p = _Problem(unfolder, x0, b_vector)
+    stop = _StoppingRule(p.threshold, p.cancel)
+    x = p.x_start.copy()
+    stop_reason = "max_epochs"
+    for epoch in range(p.max_epochs):
+        x = update(p, x)
+        p.matrix_products += 2
+        reason = stop(p.loss(x))
+        if reason is not None:
+            stop_reason = reason
+            break
+    return p.result(x, stop.loss_history, stop_reason)
+
+
+def _mlem_update(p, x):
+    A = p.A
+    b = np.maximum(p.b, 1e-30)
+    sensitivity = A.sum(axis=0)
+    calculated = np.maximum(A @ x, 1e-30)
+    correction = A.T @ (b / calculated)
+    ratio = np.divide(correction, sensitivity, out=np.ones_like(x), where=sensitivity > 0)
+    return np.where(p.free, np.maximum(x * ratio, MIN_FLUX), 0.0)
+
+
+def _gravel_update(p, x):
+    A = p.A
+    b = np.maximum(p.b, 1e-30)
+    if p.b_error is not None and np.all(p.b_error > 0):
+        sigma = p.b_error
+    else:
+        sigma = b   # no uncertainties given: equal relative weights
+    calculated = np.maximum(A @ x, 1e-30)
+    W = (A * x) / calculated[:, None] * (b ** 2 / sigma ** 2)[:, None]
+    numerator = W.T @ np.log(b / calculated)
+    denominator = W.sum(axis=0)
+    exponent = np.divide(numerator, denominator, out=np.zeros_like(x), where=denominator > 0)
+    return np.where(p.free, np.maximum(x * np.exp(exponent), MIN_FLUX), 0.0)
+
+
+def solve_mlem(unfolder, x0, b_vector):
+    return _solve_multiplicative(unfolder, x0, b_vector, _mlem_update)
+
+
+def solve_gravel(unfolder, x0, b_vector):
+    return _solve_multiplicative(unfolder, x0, b_vector, _gravel_update)
+
+
+BACKENDS = {
+    "fista": solve_fista,
+    "lbfgsb": solve_lbfgsb,
+    "nnls": solve_nnls,
+    "mlem": solve_mlem,
+    "gravel": solve_gravel,
+}
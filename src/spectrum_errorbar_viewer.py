@@ -11,6 +11,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from spectrum_statistics import summarize_file, write_summary
 
 
 class SpectrumErrorBarApp:
@@ -46,7 +47,7 @@ class SpectrumErrorBarApp:
     def load_csv(self):
         file_path = filedialog.askopenfilename(
             title="Select inversion result CSV file",
-            filetypes=[("CSV files", "*.csv")]
+            filetypes=[("CSV files", "*.csv"), ("Binary run records", "*.runs")]
         )
 
         if not file_path:
@@ -54,38 +55,28 @@ class SpectrumErrorBarApp:
             return
 
         try:
-            # ✅ Read in: The first column is the simulation ID and is not used in numerical calculations
-            df = pd.read_csv(file_path, index_col=0)
+            # ✅ Runs are read in chunks: mean, std, covariance and percentiles are accumulated on the fly
+            #    (the first column is the simulation ID and is not used in numerical calculations)
+            stats = summarize_file(file_path)
 
-
-            # ✅ Attempt to convert column names to energy values (for verification)
-            try:
-                energy_bins = df.columns.astype(float)
-            except Exception as e:
-                raise ValueError("The column names in the CSV file (starting from the 2nd column) must be numeric energy values") from e
-
-            # ✅ Calculate the average spectrum and standard deviation (each column corresponds to an energy bin)
-            mean_spectrum = df.mean(axis=0)
-            std_spectrum = df.std(axis=0, ddof=1)
-
-            # ✅ Calculate the total flux for each simulation (sum of each row)
-            total_flux_per_run = df.sum(axis=1)
-            mean_total_flux = total_flux_per_run.mean()
-            std_total_flux = total_flux_per_run.std(ddof=1)
-            rsd = std_total_flux / mean_total_flux
+            # ✅ Total flux of each simulation (sum of each row)
+            mean_total_flux = stats.mean_total_flux
+            std_total_flux = stats.std_total_flux
+            rsd = stats.total_flux_rsd
 
             # ✅ Combine the results table
             result_df = pd.DataFrame({
-                "Energy": energy_bins,
-                "Mean Flux": mean_spectrum.values,
-                "Std Dev": std_spectrum.values
+                "Energy": stats.energies,
+                "Mean Flux": stats.mean,
+                "Std Dev": stats.std()
             })
 
-            # save
+            # save (group-to-group covariance and percentiles next to the mean/std table)
             self.last_result_df = result_df
             self.last_result_path = file_path
-            output_path = file_path.replace(".csv", "_mean_std.csv")
-            result_df.to_csv(output_path, index=False)
+            stem = file_path.rsplit(".", 1)[0]
+            output_path = stem + "_mean_std.csv"
+            write_summary(stats, output_path, stem + "_covariance.csv", stem + "_percentiles.csv")
 
             # Display in status bar and console
             self.status_label.config(
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming statistics of Monte Carlo spectra.
+
+The run file is read in chunks of rows, so its size is not limited by memory:
+
+- mean, standard deviation and full group-to-group covariance are merged
+  chunk by chunk (Welford / Chan et al. pairwise update);
+- percentiles come from a log-bucket quantile sketch (DDSketch type) with a
+  bounded relative error;
+- the total flux of every run is followed with its own running moments, for
+  the total-flux RSD reported by the Error Bar Viewer.
+
+    python -m spectrum_statistics result.csv
+"""
+
+import math
+import sys
+
+import numpy as np
+
+
+CHUNK_ROWS = 4096
+PERCENTILES = (2.5, 16.0, 50.0, 84.0, 97.5)
+
+
+class RunningMoments:
+    """Count, mean and co-moment matrix of row vectors, updated one chunk at a time."""
+
+    def __init__(self, num_groups, covariance=True):
+        self.count = 0
+        self.mean = np.zeros(num_groups)
+        self.covariance_enabled = covariance
+        # Sum of squared deviations: full matrix, or only its diagonal
+        self._m2 = np.zeros((num_groups, num_groups)) if covariance else np.zeros(num_groups)
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64).reshape(-1, len(self.mean))
+        k = chunk.shape[0]
+        if k == 0:
+            return
+        chunk_mean = chunk.mean(axis=0)
+        centred = chunk - chunk_mean
+        chunk_m2 = centred.T @ centred if self.covariance_enabled else np.einsum('ij,ij->j', centred, centred)
+        self._merge(k, chunk_mean, chunk_m2)
+
+    def merge(self, other):
+        """Combine with the moments of another part of the runs."""
+        self._merge(other.count, other.mean, other._m2)
+
+    def _merge(self, k, mean, m2):
+        if k == 0:
+            return
+        total = self.count + k
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (k / total)
+        if self.covariance_enabled:
+            self._m2 += m2 + np.outer(delta, delta) * (self.count * k / total)
+        else:
+            self._m2 += m2 + delta * delta * (self.count * k / total)
+        self.count = total
+
+    def variance(self, ddof=1):
+        if self.count <= ddof:
+            return np.full(len(self.mean), np.nan)
+        diagonal = np.diagonal(self._m2) if self.covariance_enabled else self._m2
+        return diagonal / (self.count - ddof)
+
+    def std(self, ddof=1):
+        return np.sqrt(self.variance(ddof))
+
+    def covariance(self, ddof=1):
+        if not self.covariance_enabled:
+            raise ValueError("Covariance was not accumulated (covariance=False).")
+        if self.count <= ddof:
+            return np.full(self._m2.shape, np.nan)
+        return self._m2 / (self.count - ddof)
+
+    def correlation(self, ddof=1):
+        covariance = self.covariance(ddof)
+        std = np.sqrt(np.diagonal(covariance))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return covariance / np.outer(std, std)
+
+
+class QuantileSketch:
+    """
+    Per-group log-bucket sketch: every value v > 0 falls in bucket
+    ceil(log_γ v) with γ = (1 + α) / (1 - α), so a quantile is returned
+    with relative error at most α. Values <= 0 are counted separately.
+    """
+
+    def __init__(self, num_groups, relative_accuracy=0.005):
+        self.alpha = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.num_groups = num_groups
+        self.zeros = np.zeros(num_groups, dtype=np.int64)
+        self.counts = np.zeros((num_groups, 0), dtype=np.int64)
+        self.offset = 0   # bucket index of column 0
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64).reshape(-1, self.num_groups)
+        positive = chunk > 0
+        self.zeros += (~positive).sum(axis=0)
+        if not positive.any():
+            return
+        rows, groups = np.nonzero(positive)
+        index = np.ceil(np.log(chunk[rows, groups]) / self._log_gamma).astype(np.int64)
+        low, high = index.min(), index.max()
+        self._extend(low, high)
+        width = self.counts.shape[1]
+        flat = groups * width + (index - self.offset)
+        self.counts += np.bincount(flat, minlength=self.num_groups * width).reshape(self.num_groups, width)
+
+    def _extend(self, low, high):
+        width = self.counts.shape[1]
+        if width == 0:
+            self.offset = low
+            self.counts = np.zeros((self.num_groups, high - low + 1), dtype=np.int64)
+            return
+        before = max(0, self.offset - low)
+        after = max(0, high - (self.offset + width - 1))
+        if before or after:
+            self.counts = np.pad(self.counts, ((0, 0), (before, after)))
+            self.offset -= before
+
+    def merge(self, other):
+        self.zeros += other.zeros
+        if other.counts.shape[1]:
+            self._extend(other.offset, other.offset + other.counts.shape[1] - 1)
+            start = other.offset - self.offset
+            self.counts[:, start:start + other.counts.shape[1]] += other.counts
+
+    def quantile(self, q):
+        """Value of quantile q (0..1) of every group."""
+        result = np.zeros(self.num_groups)
+        totals = self.zeros + self.counts.sum(axis=1)
+        cumulative = np.cumsum(self.counts, axis=1)
+        for g in range(self.num_groups):
+            if totals[g] == 0:
+                result[g] = np.nan
+                continue
+            rank = q * (totals[g] - 1)
+            if rank < self.zeros[g]:
+                continue   # within the values <= 0
+            column = np.searchsorted(cumulative[g], rank - self.zeros[g], side='right')
+            column = min(column, self.counts.shape[1] - 1)
+            result[g] = 2 * self.gamma ** (self.offset + column) / (self.gamma + 1)
+        return result
+
+
+class SpectrumStatistics:
+    """Group statistics and total-flux statistics of a stream of spectra."""
+
+    def __init__(self, energies, covariance=True, relative_accuracy=0.005):
+        self.energies = np.asarray(energies, dtype=np.float64)
+        n = len(self.energies)
+        self.moments = RunningMoments(n, covariance)
+        self.sketch = QuantileSketch(n, relative_accuracy)
+        self.total_flux = RunningMoments(1, covariance=False)
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64).reshape(-1, len(self.energies))
+        self.moments.update(chunk)
+        self.sketch.update(chunk)
+        self.total_flux.update(chunk.sum(axis=1).reshape(-1, 1))
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        self.total_flux.merge(other.total_flux)
+
+    @property
+    def mean(self):
+        return self.moments.mean
+
+    def std(self, ddof=1):
+        return self.moments.std(ddof)
+
+    def covariance(self, ddof=1):
+        return self.moments.covariance(ddof)
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """{p: group values} for p in percent."""
+        return {p: self.sketch.quantile(p / 100.0) for p in percentiles}
+
+    @property
+    def mean_total_flux(self):
+        return self.total_flux.mean[0]
+
+    @property
+    def std_total_flux(self):
+        return self.total_flux.std()[0]
+
+    @property
+    def total_flux_rsd(self):
+        return self.std_total_flux / self.mean_total_flux
+
+
+def iter_run_chunks(path, chunk_rows=CHUNK_ROWS):
+    """(energies, chunk iterator) of a run file: Run_<id> CSV or *.runs binary records."""
+    from result_store import BINARY_SUFFIX, read_binary_results
+
+    if path.endswith(BINARY_SUFFIX):
+        energies, records = read_binary_results(path)
+
+        def chunks():
+            for start in range(0, len(records), chunk_rows):
+                yield np.asarray(records["x"][start:start + chunk_rows])
+        return energies, chunks()
+
+    import pandas as pd
+    # The first column is the run ID and is not used in numerical calculations
+    header = pd.read_csv(path, index_col=0, nrows=0)
+    try:
+        energies = header.columns.astype(float).to_numpy()
+    except Exception as e:
+        raise ValueError("The column names in the CSV file (starting from the 2nd column) must be numeric energy values") from e
+
+    def chunks():
+        for frame in pd.read_csv(path, index_col=0, chunksize=chunk_rows):
+            yield frame.to_numpy(dtype=np.float64)
+    return energies, chunks()
+
+
+def summarize_file(path, covariance=True, chunk_rows=CHUNK_ROWS, relative_accuracy=0.005):
+    """SpectrumStatistics of every run in a result file, read chunk_rows runs at a time."""
+    energies, chunks = iter_run_chunks(path, chunk_rows)
+    stats = SpectrumStatistics(energies, covariance, relative_accuracy)
+    for chunk in chunks:
+        stats.update(chunk)
+    if stats.count == 0:
+        raise ValueError(f"{path} contains no runs.")
+    return stats
+
+
+def write_summary(stats, mean_std_path, covariance_path=None, percentiles_path=None):
+    """Mean/std table (Energy, Mean Flux, Std Dev), covariance matrix and percentile table as CSV."""
+    import pandas as pd
+
+    pd.DataFrame({"Energy": stats.energies, "Mean Flux": stats.mean, "Std Dev": stats.std()}).to_csv(
+        mean_std_path, index=False)
+    if covariance_path is not None:
+        pd.DataFrame(stats.covariance(), index=stats.energies, columns=stats.energies).to_csv(covariance_path)
+    if percentiles_path is not None:
+        table = {"Energy": stats.energies}
+        table.update({f"P{p:g}": values for p, values in stats.percentiles().items()})
+        pd.DataFrame(table).to_csv(percentiles_path, index=False)
+
+
+def main(argv=None):
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(prog="python -m spectrum_statistics",
+                                     description="Mean, std, covariance and percentiles of a run file.")
+    parser.add_argument("results", help="Run_<id> CSV or *.runs file")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    stats = summarize_file(args.results, chunk_rows=args.chunk_rows)
+    stem = os.path.splitext(args.results)[0]
+    write_summary(stats, stem + "_mean_std.csv", stem + "_covariance.csv", stem + "_percentiles.csv")
+    print(f"{stats.count} runs x {len(stats.energies)} groups")
+    print(f"Average total flux: {stats.mean_total_flux:.3e} /cm²·s")
+    print(f"Total flux standard deviation: {stats.std_total_flux:.3e} /cm²·s")
+    print(f"Relative standard deviation RSD: {stats.total_flux_rsd:.2%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
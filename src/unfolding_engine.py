@@ -0,0 +1,676 @@
+# -*- coding: utf-8 -*-
+"""
+Headless spectrum inversion engine.
+
+Pure NumPy version of the gradient-descent unfolding used by NeuralSolverApp,
+usable without a display (no tkinter / matplotlib import):
+
+    python -m unfolding_engine problem.csv prior.txt -o result.csv --runs 100
+
+The problem file is the A/b/b_error CSV written by the Data Preparation tab,
+the prior file is the energy-group file used as initial spectrum.
+"""
+
+import argparse
+import csv
+import sys
+from collections import deque
+
+import numpy as np
+
+from loss_trace import LossTrace
+
+
+SMOOTHNESS_WEIGHT = 0.01   # λ of the log-smoothness penalty
+RESTART_PATIENCE = 1000    # epochs without improvement before restarting from the prior
+PLATEAU_WINDOW = 500       # epochs inspected by the early-stopping plateau check
+PLATEAU_TOLERANCE = 1e-5   # relative loss change regarded as a plateau
+MIN_FLUX = 1e-6            # lower bound of every non-zero group flux
+CANCEL_CHECK_INTERVAL = 100   # epochs between two checks of the cancel event
+CHECKPOINT_CHECK_INTERVAL = 1000   # epochs between two checks whether a checkpoint is due
+
+# "gradient" is the original fixed-step solver; the others live in solver_backends
+SOLVER_METHODS = ("gradient", "fista", "lbfgsb", "nnls", "mlem", "gravel")
+
+# Data-term evaluation of the gradient solver: with A (m, n) "primal" costs two
+# products with A (2mn) per epoch, "gram" one product with the precomputed AᵀA (n²)
+FORMULATIONS = ("auto", "primal", "gram")
+
+
+def select_formulation(shape):
+    """Cheaper formulation for an A matrix of the given (m, n) shape."""
+    m, n = shape
+    return "gram" if n < 2 * m else "primal"
+
+
+def chi_square_threshold(dof, confidence_level=0.95):
+    """Loss threshold used as stopping rule (chi-square quantile, default 95%)."""
+    from scipy.stats import chi2
+    return chi2.ppf(confidence_level, dof)
+
+
+class UnfoldingProblem:
+    """A matrix, activity vector and activity errors read from a parameter file or a bundle."""
+
+    def __init__(self, A, b, b_error, energies, names=None, prior=None, loss_threshold=None):
+        self.A = A
+        self.b = b                  # column vector (m, 1)
+        self.b_error = b_error      # column vector (m, 1)
+        self.energies = energies    # group energies in MeV (A_header)
+        self.names = names if names is not None else [f"Foil_{i+1}" for i in range(A.shape[0])]
+        self.prior = prior          # initial spectrum (n,), only stored in problem bundles
+        self._loss_threshold = loss_threshold
+
+    @property
+    def loss_threshold(self):
+        if self._loss_threshold is not None:
+            return self._loss_threshold
+        return chi_square_threshold(self.b.shape[0])
+
+
+def _read_rows(filename):
+    if filename.endswith(".csv"):
+        with open(filename, newline='') as file:
+            return [row for row in csv.reader(file) if row]
+    with open(filename, 'r') as file:
+        return [line.split() for line in file if line.strip()]
+
+
+def load_problem(filename):
+    """Read the activation product parameter file (same layout as load_user_input) or a problem bundle."""
+    # Imported here: problem_bundle itself builds on this module
+    from problem_bundle import is_bundle, load_bundle
+    if is_bundle(filename):
+        return load_bundle(filename)
+
+    rows = _read_rows(filename)
+    if len(rows) < 2 or len(rows[0]) < 2:
+        raise ValueError("CSV file must contain at least two columns of data")
+
+    # First row: "material message", energies..., activity, activity error
+    energies = np.array(rows[0][1:-2], dtype=np.float32)
+    names = [row[0] for row in rows[1:]]
+    data = np.array([row[1:] for row in rows[1:]], dtype=np.float32)
+
+    A = np.ascontiguousarray(data[:, :-2])
+    b = data[:, -2].reshape(-1, 1)
+    b_error = data[:, -1].reshape(-1, 1)
+    return UnfoldingProblem(A, b, b_error, energies, names)
+
+
+def load_prior(filename, num_unknowns=None):
+    """Read the initial spectrum file; the 2nd column (after the header line) is the flux."""
+    values = []
+    with open(filename, 'r') as file:
+        for line in file.readlines()[1:]:
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) < 2:
+                raise ValueError("File format error. Each line must contain at least two numbers (energy & flux).")
+            values.append(float(parts[1]))
+
+    x_data = np.array(values, dtype=np.float32)
+    if num_unknowns is not None and len(x_data) != num_unknowns:
+        raise ValueError(f"Number of initial values ({len(x_data)}) does not match "
+                         f"the number of unknowns in A ({num_unknowns}).")
+    return x_data
+
+
+class UnfoldingResult:
+    """Spectrum returned by SpectrumUnfolder.solve."""
+
+    def __init__(self, x, loss_history, epochs, stop_reason, matrix_products=None):
+        self.x = x                          # (1, n) group flux
+        self.loss_history = loss_history    # LossTrace (bounded: recent losses + min/max buckets)
+        self.epochs = epochs
+        self.stop_reason = stop_reason      # "threshold", "plateau", "max_epochs" or "cancelled" (see also solver_backends)
+        self.matrix_products = matrix_products if matrix_products is not None else 2 * epochs
+
+    @property
+    def final_loss(self):
+        return self.loss_history[-1]
+
+
+class BatchUnfoldingResult:
+    """Spectra of several activity vectors solved together by SpectrumUnfolder.solve_batch."""
+
+    def __init__(self, x, final_loss, epochs, stop_reason, mean_loss_history):
+        self.x = x                              # (runs, n) group flux
+        self.final_loss = final_loss            # (runs,)
+        self.epochs = epochs                    # (runs,)
+        self.stop_reason = stop_reason          # list of "threshold" / "plateau" / "max_epochs" / "cancelled"
+        self.mean_loss_history = mean_loss_history  # LossTrace of the mean loss of the still-running runs
+
+
+class SpectrumUnfolder:
+    """
+    Projected gradient descent with log-smoothness penalty (extracted from run_one_training).
+
+    method selects the solver backend (see SOLVER_METHODS); b_error is only
+    used by the GRAVEL weights. formulation selects how the gradient method
+    evaluates the data term (see FORMULATIONS); "auto" picks it from A's shape.
+    rescale=False skips the epoch-0 normalisation of x0 to the mean activity
+    ratio, for a warm start from a previous solution (see warm_start).
+    cancel is a threading/multiprocessing Event checked every
+    CANCEL_CHECK_INTERVAL epochs; once it is set the run stops with
+    stop_reason "cancelled".
+    """
+
+    def __init__(self, A, loss_threshold, learning_rate=1.0, max_epochs=500000,
+                 smoothness=SMOOTHNESS_WEIGHT, verbose=False, method="gradient", b_error=None,
+                 formulation="auto", rescale=True, cancel=None):
+        if method not in SOLVER_METHODS:
+            raise ValueError(f"Unknown solver method '{method}', expected one of {', '.join(SOLVER_METHODS)}")
+        if formulation not in FORMULATIONS:
+            raise ValueError(f"Unknown formulation '{formulation}', expected one of {', '.join(FORMULATIONS)}")
+        if formulation == "auto":
+            formulation = select_formulation(np.shape(A))
+        self.formulation = formulation
+        self._gram = None
+        self.method = method
+        self.b_error = b_error
+        self.A = A
+        self.loss_threshold = loss_threshold
+        self.learning_rate = learning_rate
+        self.max_epochs = max_epochs
+        self.smoothness = smoothness
+        self.verbose = verbose
+        self.rescale = rescale
+        self.cancel = cancel
+
+    def gram_matrix(self):
+        """AᵀA in float64, computed once and shared by every run."""
+        if self._gram is None:
+            A = np.asarray(self.A, dtype=np.float64)
+            self._gram = A.T @ A
+        return self._gram
+
+    def solve(self, x0, b_vector, callback=None, callback_interval=100, checkpoint=None, state=None):
+        """
+        Unfold one activity vector.
+
+        x0: initial spectrum, shape (1, n); zero groups stay zero.
+        b_vector: activities, shape (m, 1).
+        callback(loss_history, x): called every callback_interval epochs and on the last epoch,
+        loss_history being the run's LossTrace
+        (gradient method only).
+        checkpoint: Checkpointer (see checkpoint) receiving the loop state when
+        one is due and when the run is cancelled; state: such a saved state, to
+        continue the run exactly where it was taken (gradient method only;
+        ValueError if it was saved with other solver settings).
+        """
+        if self.method != "gradient":
+            from solver_backends import BACKENDS
+            return BACKENDS[self.method](self, x0, b_vector)
+
+        A = np.ascontiguousarray(self.A, dtype=np.float64)   # cast once, not every epoch
+        m, n = A.shape
+        b = np.ravel(np.asarray(b_vector, dtype=np.float64))
+        x0 = np.ravel(np.asarray(x0, dtype=np.float64))
+        max_epochs = self.max_epochs
+        learning_rate = self.learning_rate
+        λ = self.smoothness
+        penalty_scale = 1.0 / (n - 1) if n > 1 else 0.0
+        cancel = self.cancel
+
+        zero_mask = (x0 == 0)
+        x_restart = np.maximum(x0, MIN_FLUX)
+
+        # Work buffers, reused every epoch
+        x_variable = x_restart.copy()
+        x_variable[zero_mask] = 0
+        initial_prediction = A @ x_variable     # for the epoch-0 rescaling
+        use_gram = self.formulation == "gram"
+        if use_gram:
+            G = self.gram_matrix()
+            Atb = A.T @ b
+            btb = float(b @ b)
+        Ax_pred = np.empty(m)
+        error = np.empty(m)
+        gradient = np.empty(n)
+        x_shifted = np.empty(n)         # x + 1e-12
+        log_x = np.empty(n)
+        log_diff = np.empty(max(n - 1, 0))
+        penalty_gradient = np.zeros(n)
+        loss_history = LossTrace()
+
+        # Monotonic queues of (epoch, loss) giving the max / min over the plateau window
+        window_max = deque()
+        window_min = deque()
+
+        min_loss = float('inf')
+        no_improvement_epochs = 0
+        stop_reason = "max_epochs"
+        start_epoch = 0
+
+        if state is not None:
+            # Settings saved with the state (checkpoint.SOLVER_SETTINGS): the loop state is only valid for them
+            changed = [key[len("solver_"):] for key in state if key.startswith("solver_")
+                       and np.asarray(state[key]).item() != getattr(self, key[len("solver_"):])]
+            if changed:
+                raise ValueError(f"The saved state was written with other solver settings ({', '.join(changed)}).")
+            start_epoch = int(state["epoch"])
+            x_variable[:] = state["x"]
+            min_loss = float(state["min_loss"])
+            no_improvement_epochs = int(state["no_improvement_epochs"])
+            loss_history = LossTrace.from_state({key[6:]: value for key, value in state.items()
+                                                 if key.startswith("trace_")})
+            window_max.extend((int(e), float(l)) for e, l in state["window_max"])
+            window_min.extend((int(e), float(l)) for e, l in state["window_min"])
+
+        def loop_state():
+            # Everything the next epoch depends on
+            saved = {"trace_" + key: value for key, value in loss_history.state().items()}
+            saved.update(epoch=epoch + 1, x=x_variable.copy(), min_loss=min_loss,
+                         no_improvement_epochs=no_improvement_epochs,
+                         window_max=np.array(window_max, dtype=np.float64).reshape(-1, 2),
+                         window_min=np.array(window_min, dtype=np.float64).reshape(-1, 2))
+            return saved
+
+        epoch = start_epoch - 1
+        for epoch in range(start_epoch, max_epochs):
+            if use_gram:
+                # ‖Ax - b‖² = xᵀGx - 2xᵀAᵀb + bᵀb and Aᵀ(Ax - b) = Gx - Aᵀb
+                np.dot(G, x_variable, out=gradient)
+                data_loss = (float(np.dot(x_variable, gradient)) - 2.0 * float(np.dot(x_variable, Atb)) + btb) / m
+                gradient -= Atb
+            else:
+                np.dot(A, x_variable, out=Ax_pred)
+                np.subtract(Ax_pred, b, out=error)
+                data_loss = float(np.dot(error, error)) / m
+                np.dot(error, A, out=gradient)
+            np.add(x_variable, 1e-12, out=x_shifted)
+            np.log(x_shifted, out=log_x)
+            np.subtract(log_x[1:], log_x[:-1], out=log_diff)
+            smoothness_penalty = float(np.dot(log_diff, log_diff)) * penalty_scale
+            loss = data_loss + λ * smoothness_penalty
+
+            # Data term 2·Aᵀ(Ax - b)/m plus the penalty term 2λ(d_{j-1} - d_j) / ((n-1)(x_j + 1e-12))
+            gradient *= 2.0 / m
+            if n > 1:
+                penalty_gradient[0] = -log_diff[0]
+                penalty_gradient[-1] = log_diff[-1]
+                np.subtract(log_diff[:-1], log_diff[1:], out=penalty_gradient[1:-1])
+                penalty_gradient /= x_shifted
+                penalty_gradient *= 2.0 * λ * penalty_scale
+                gradient += penalty_gradient
+
+            gradient *= learning_rate
+            x_variable -= gradient
+            np.maximum(x_variable, MIN_FLUX, out=x_variable)
+            x_variable[zero_mask] = 0
+
+            loss_history.append(loss)
+
+            if loss < min_loss:
+                min_loss = loss
+                no_improvement_epochs = 0
+            else:
+                no_improvement_epochs += 1
+
+            if no_improvement_epochs >= RESTART_PATIENCE:
+                no_improvement_epochs = 0
+                min_loss = float('inf')
+                x_variable[:] = x_restart
+
+            if epoch == 0 and self.rescale:
+                scaling_factor = np.mean(initial_prediction / b)
+                if self.verbose:
+                    print("sacling factor=", scaling_factor)
+                x_variable /= scaling_factor
+                np.maximum(x_variable, MIN_FLUX, out=x_variable)
+
+            while window_max and window_max[-1][1] <= loss:
+                window_max.pop()
+            window_max.append((epoch, loss))
+            while window_min and window_min[-1][1] >= loss:
+                window_min.pop()
+            window_min.append((epoch, loss))
+            if window_max[0][0] <= epoch - PLATEAU_WINDOW:
+                window_max.popleft()
+            if window_min[0][0] <= epoch - PLATEAU_WINDOW:
+                window_min.popleft()
+
+            if epoch + 1 >= PLATEAU_WINDOW:
+                max_loss = window_max[0][1]
+                min_loss = window_min[0][1]
+                if abs(max_loss - min_loss) / max_loss < PLATEAU_TOLERANCE:
+                    if self.verbose:
+                        print(f"🟡 Loss function changed very little in the last {PLATEAU_WINDOW} epochs, stopping training early")
+                    stop_reason = "plateau"
+                    break
+
+            if callback is not None and ((epoch + 1) % callback_interval == 0 or epoch == max_epochs - 1):
+                callback(loss_history, x_variable.reshape(1, -1))
+
+            if loss < self.loss_threshold:
+                stop_reason = "threshold"
+                break
+
+            if cancel is not None and (epoch + 1) % CANCEL_CHECK_INTERVAL == 0 and cancel.is_set():
+                stop_reason = "cancelled"
+                if checkpoint is not None:
+                    checkpoint.save(loop_state())
+                break
+
+            if checkpoint is not None and (epoch + 1) % CHECKPOINT_CHECK_INTERVAL == 0 and checkpoint.due():
+                checkpoint.save(loop_state())
+
+        if self.verbose:
+            print("Final Loss Function Value (single run):", loss_history[-1])
+        matrix_products = len(loss_history) * (1 if use_gram else 2) + 1
+        return UnfoldingResult(x_variable.reshape(1, -1), loss_history, len(loss_history), stop_reason,
+                               matrix_products=matrix_products)
+
+    def solve_batch(self, x0, b_matrix, callback=None, callback_interval=100, row_mask=None):
+        """
+        Unfold many activity vectors at once (Monte Carlo perturbations).
+
+        Every row of b_matrix (runs, m) follows the same update rule as solve(),
+        but all runs advance through a single (runs, n)·(n, m) product per epoch.
+        Runs that reach the threshold or a plateau are frozen and dropped from
+        the working set, so the remaining runs keep the product small.
+        callback(mean_loss_history, x) receives the mean spectrum of the runs
+        still iterating; on cancel those runs end with stop_reason "cancelled".
+        row_mask (runs, m) bool leaves the False rows of A out of a run: its data
+        term and epoch-0 rescaling average over the rows kept (leave-one-out
+        subproblems, see cross_validation).
+        """
+        if self.method != "gradient":
+            raise ValueError("Batched runs are only available for the gradient method")
+
+        A = np.ascontiguousarray(self.A, dtype=np.float64)
+        n = A.shape[1]
+        x0 = np.asarray(x0, dtype=np.float64).reshape(1, -1)
+        b_all = np.atleast_2d(np.asarray(b_matrix, dtype=np.float64))
+        num_runs = b_all.shape[0]
+        learning_rate = self.learning_rate
+        λ = self.smoothness
+        penalty_scale = 1.0 / (n - 1) if n > 1 else 0.0
+
+        zero_mask = (x0 == 0)
+        x_restart = np.maximum(x0, MIN_FLUX)
+
+        x_variable = np.repeat(x_restart, num_runs, axis=0)
+        x_variable[:, zero_mask[0]] = 0
+
+        # Final state of every run, filled in as runs finish
+        x_final = np.zeros((num_runs, x0.shape[1]))
+        final_loss = np.full(num_runs, np.nan)
+        epochs_used = np.zeros(num_runs, dtype=np.int64)
+        stop_reason = ["max_epochs"] * num_runs
+
+        # Working set: run ids still iterating and their per-run state
+        run_ids = np.arange(num_runs)
+        b_rows = b_all
+        if row_mask is not None:
+            mask_rows = np.asarray(row_mask, dtype=np.float64)
+            rows_kept = mask_rows.sum(axis=1)
+        min_loss = np.full(num_runs, np.inf)
+        no_improvement_epochs = np.zeros(num_runs, dtype=np.int64)
+        recent_losses = np.empty((num_runs, PLATEAU_WINDOW))
+        mean_loss_history = LossTrace()
+        loss = np.full(num_runs, np.nan)
+
+        initial_prediction = np.dot(x_variable, A.T)     # for the epoch-0 rescaling
+        use_gram = self.formulation == "gram" and row_mask is None   # AᵀA differs between masked runs
+        if use_gram:
+            G = self.gram_matrix()
+            Atb_rows = np.dot(b_rows, A)
+            btb_rows = np.sum(np.square(b_rows), axis=1)
+
+        for epoch in range(self.max_epochs):
+            if use_gram:
+                Gx = np.dot(x_variable, G)
+                data_loss = (np.sum(x_variable * Gx, axis=1) - 2.0 * np.sum(x_variable * Atb_rows, axis=1)
+                             + btb_rows) / A.shape[0]
+                gradient = 2 * (Gx - Atb_rows) / A.shape[0]
+            elif row_mask is not None:
+                error = (np.dot(x_variable, A.T) - b_rows) * mask_rows
+                data_loss = np.sum(np.square(error), axis=1) / rows_kept
+                gradient = 2 * np.dot(error, A) / rows_kept[:, None]
+            else:
+                error = np.dot(x_variable, A.T) - b_rows
+                data_loss = np.mean(np.square(error), axis=1)
+                gradient = 2 * np.dot(error, A) / A.shape[0]
+            x_shifted = x_variable + 1e-12
+            log_diff = np.diff(np.log(x_shifted), axis=1)
+            smoothness_penalty = np.sum(np.square(log_diff), axis=1) * penalty_scale
+            loss = data_loss + λ * smoothness_penalty
+
+            if n > 1:
+                penalty_gradient = np.empty_like(x_variable)
+                penalty_gradient[:, 0] = -log_diff[:, 0]
+                penalty_gradient[:, -1] = log_diff[:, -1]
+                np.subtract(log_diff[:, :-1], log_diff[:, 1:], out=penalty_gradient[:, 1:-1])
+                gradient += (2.0 * λ * penalty_scale) * penalty_gradient / x_shifted
+            x_variable -= learning_rate * gradient
+            x_variable = np.maximum(x_variable, MIN_FLUX)
+            x_variable[:, zero_mask[0]] = 0
+
+            recent_losses[:, epoch % PLATEAU_WINDOW] = loss
+            mean_loss_history.append(float(loss.mean()))
+
+            improved = loss < min_loss
+            min_loss[improved] = loss[improved]
+            no_improvement_epochs[improved] = 0
+            no_improvement_epochs[~improved] += 1
+
+            restart = no_improvement_epochs >= RESTART_PATIENCE
+            if restart.any():
+                no_improvement_epochs[restart] = 0
+                min_loss[restart] = np.inf
+                x_variable[restart] = x_restart
+
+            if epoch == 0 and self.rescale:
+                if row_mask is not None:
+                    scaling_factor = np.sum(mask_rows * initial_prediction / b_rows, axis=1, keepdims=True) / rows_kept[:, None]
+                else:
+                    scaling_factor = np.mean(initial_prediction / b_rows, axis=1, keepdims=True)
+                x_variable = np.maximum(x_variable / scaling_factor, MIN_FLUX)
+
+            finished = np.zeros(len(run_ids), dtype=bool)
+            if epoch + 1 >= PLATEAU_WINDOW:
+                max_loss = recent_losses.max(axis=1)
+                min_loss = recent_losses.min(axis=1)
+                plateau = np.abs(max_loss - min_loss) / max_loss < PLATEAU_TOLERANCE
+                finished |= plateau
+                for i in np.flatnonzero(plateau):
+                    stop_reason[run_ids[i]] = "plateau"
+
+            converged = ~finished & (loss < self.loss_threshold)
+            finished |= converged
+            for i in np.flatnonzero(converged):
+                stop_reason[run_ids[i]] = "threshold"
+
+            if finished.any():
+                done = run_ids[finished]
+                x_final[done] = x_variable[finished]
+                final_loss[done] = loss[finished]
+                epochs_used[done] = epoch + 1
+
+                keep = ~finished
+                run_ids = run_ids[keep]
+                if len(run_ids) == 0:
+                    break
+                x_variable = x_variable[keep]
+                b_rows = b_rows[keep]
+                if row_mask is not None:
+                    mask_rows = mask_rows[keep]
+                    rows_kept = rows_kept[keep]
+                if use_gram:
+                    Atb_rows = Atb_rows[keep]
+                    btb_rows = btb_rows[keep]
+                min_loss = min_loss[keep]
+                no_improvement_epochs = no_improvement_epochs[keep]
+                recent_losses = recent_losses[keep]
+                loss = loss[keep]
+
+            if callback is not None and (epoch + 1) % callback_interval == 0:
+                callback(mean_loss_history, x_variable.mean(axis=0, keepdims=True))
+
+            if self.cancel is not None and (epoch + 1) % CANCEL_CHECK_INTERVAL == 0 and self.cancel.is_set():
+                for run_id in run_ids:
+                    stop_reason[run_id] = "cancelled"
+                x_final[run_ids] = x_variable
+                final_loss[run_ids] = loss
+                epochs_used[run_ids] = epoch + 1
+                run_ids = run_ids[:0]
+                break
+
+        if len(run_ids):
+            x_final[run_ids] = x_variable
+            final_loss[run_ids] = loss
+            epochs_used[run_ids] = self.max_epochs
+
+        if self.verbose:
+            print(f"Batched runs finished: {num_runs} runs, "
+                  f"{np.mean(epochs_used):.0f} epochs on average")
+        return BatchUnfoldingResult(x_final, final_loss, epochs_used, stop_reason, mean_loss_history)
+
+
+def export_spectra_csv(save_path, energies, spectra):
+    """Write one row per run (Run_1, Run_2, ...) with energies as header, like export_all_spectra_to_csv."""
+    with open(save_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([""] + [str(e) for e in np.asarray(energies)])
+        for i, spectrum in enumerate(spectra):
+            writer.writerow([f"Run_{i+1}"] + [str(v) for v in np.ravel(spectrum)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m unfolding_engine",
+        description="Unfold a neutron spectrum from activation data without the GUI.")
+    parser.add_argument("problem", help="activation product parameter CSV (A, b, b_error) or problem bundle")
+    parser.add_argument("prior", nargs="?", default=None,
+                        help="initial spectrum file (energy, flux columns); optional for a bundle with a prior")
+    parser.add_argument("-o", "--output", required=True,
+                        help="CSV file receiving the unfolded spectra (*.runs: binary records)")
+    parser.add_argument("--resume", action="store_true",
+                        help="keep the runs already in the output file and compute only the missing ones")
+    parser.add_argument("--runs", type=int, default=1, help="number of Monte Carlo runs (b perturbed by b_error)")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the activity perturbations")
+    parser.add_argument("--loss-threshold", type=float, default=None,
+                        help="stopping loss (default: 95%% chi-square quantile)")
+    parser.add_argument("--learning-rate", type=float, default=1.0)
+    parser.add_argument("--max-epochs", type=int, default=500000)
+    parser.add_argument("--smoothness", type=float, default=SMOOTHNESS_WEIGHT)
+    parser.add_argument("--method", choices=SOLVER_METHODS, default="gradient", help="solver backend")
+    parser.add_argument("--formulation", choices=FORMULATIONS, default="auto",
+                        help="data-term evaluation of the gradient method (auto: from the shape of A)")
+    parser.add_argument("--batch", action="store_true",
+                        help="advance all runs together in one matrix product per epoch")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes for the Monte Carlo runs")
+    parser.add_argument("--warm-start", action="store_true",
+                        help="start every run from the unperturbed solution instead of the rescaled prior")
+    parser.add_argument("--checkpoint-interval", type=float, default=None,
+                        help="seconds between checkpoints of the running run (sequential runs; default 60, "
+                             "0 = off); --resume continues from the checkpoint")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    # Imported here: monte_carlo itself builds on this module
+    from checkpoint import (CHECKPOINT_INTERVAL, Checkpointer, checkpoint_path, run_context, run_state,
+                            settings_changed, solver_settings)
+    from monte_carlo import perturb_activities, resume_seed, run_parallel
+    from result_store import open_result_sink
+    from solver_backends import activity_erre
+    from warm_start import epochs_saved, warm_start_spectrum
+
+    problem = load_problem(args.problem)
+    if args.prior is not None:
+        x0 = load_prior(args.prior, problem.A.shape[1]).reshape(1, -1)
+    elif problem.prior is not None:
+        x0 = np.array(problem.prior, dtype=np.float32).reshape(1, -1)
+    else:
+        parser.error("a prior file is required unless the problem bundle contains one")
+    loss_threshold = args.loss_threshold if args.loss_threshold is not None else problem.loss_threshold
+
+    solver_options = dict(learning_rate=args.learning_rate, max_epochs=args.max_epochs,
+                          smoothness=args.smoothness, verbose=args.verbose,
+                          method=args.method, formulation=args.formulation)
+
+    reference = None
+    epochs_used = []
+    if args.warm_start:
+        # The perturbed runs differ by a few percent of b: all start from the unperturbed solution
+        reference = SpectrumUnfolder(problem.A, loss_threshold, b_error=problem.b_error,
+                                     **solver_options).solve(x0, problem.b)
+        print(f"Warm start: unperturbed solution in {reference.epochs} epochs ({reference.stop_reason})")
+        x0 = warm_start_spectrum(reference.x, x0)
+        solver_options["rescale"] = False
+
+    if args.workers > 1:
+        def report(run_id, x, final_loss, epochs, stop_reason):
+            epochs_used.append(epochs)
+            print(f"Run {run_id + 1}: epochs={epochs} loss={final_loss:.4e} "
+                  f"({stop_reason}) total flux={x.sum():.3e}")
+
+        seed = run_parallel(problem.A, problem.b, problem.b_error, x0, problem.energies, args.output,
+                            args.runs, loss_threshold, seed=args.seed, workers=args.workers,
+                            on_result=report, resume=args.resume, **solver_options)
+        print(f"Seed: {seed}")
+        if reference is not None:
+            print(epochs_saved(reference.epochs, epochs_used))
+        print(f"All inversion results have been saved to：{args.output}")
+        return 0
+
+    # Every run is appended to the output as soon as it is done
+    with open_result_sink(args.output, problem.energies, problem.b.shape[0], resume=args.resume) as sink:
+        try:
+            seed = resume_seed(sink, args.seed)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Seed: {seed}")
+        runs = [run for run in range(args.runs) if run not in sink.completed]
+        if len(runs) < args.runs:
+            print(f"Resuming: {args.runs - len(runs)} runs already in {args.output}")
+
+        unfolder = SpectrumUnfolder(problem.A, loss_threshold, b_error=problem.b_error, **solver_options)
+        perturbed = {run: perturb_activities(problem.b, problem.b_error, seed, run) for run in runs}
+
+        if args.batch and runs:
+            result = unfolder.solve_batch(x0, np.hstack([perturbed[run] for run in runs]).T)
+            epochs_used.extend(result.epochs)
+            for i, run in enumerate(runs):
+                sink.write(run, result.x[i], result.final_loss[i], result.epochs[i],
+                           result.stop_reason[i], seed, perturbed[run])
+                print(f"Run {run + 1}: epochs={result.epochs[i]} loss={result.final_loss[i]:.4e} "
+                      f"({result.stop_reason[i]}) total flux={result.x[i].sum():.3e}")
+        else:
+            interval = CHECKPOINT_INTERVAL if args.checkpoint_interval is None else args.checkpoint_interval
+            checkpointer = Checkpointer(checkpoint_path(args.output), interval) if interval > 0 else None
+            saved = checkpointer.load() if checkpointer is not None and args.resume else None
+            settings = solver_settings(unfolder)
+            if saved is not None and settings_changed(saved, settings):
+                print(f"Checkpoint {checkpointer.path} was written with other solver settings "
+                      f"({', '.join(settings_changed(saved, settings))}): not continued")
+                saved = None
+            for run in runs:
+                state = run_state(saved, run, seed, perturbed[run], x0, settings)
+                if state is not None:
+                    print(f"Run {run + 1}: continuing from the checkpoint at epoch {int(state['epoch'])}")
+                if checkpointer is not None:
+                    checkpointer.context = run_context(run, seed, perturbed[run], x0, sink.completed, settings)
+                result = unfolder.solve(x0, perturbed[run], checkpoint=checkpointer, state=state)
+                epochs_used.append(result.epochs)
+                sink.write(run, result.x, result.final_loss, result.epochs, result.stop_reason,
+                           seed, perturbed[run], loss_trace=result.loss_history)
+                print(f"Run {run + 1}: epochs={result.epochs} matrix products={result.matrix_products} "
+                      f"loss={result.final_loss:.4e} ({result.stop_reason}) "
+                      f"ERRE={activity_erre(problem.A, result.x, perturbed[run]):.2%} "
+                      f"total flux={result.x.sum():.3e}")
+            if checkpointer is not None:
+                checkpointer.remove()   # every run is in the output file
+
+    if reference is not None:
+        print(epochs_saved(reference.epochs, epochs_used))
+    print(f"All inversion results have been saved to：{args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
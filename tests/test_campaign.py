@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Lock files, stale-lock takeover and merging of sharded campaigns (campaign.py).
+"""
+
+import csv
+import os
+import sys
+import time
+from multiprocessing import get_context
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import campaign
+import unfolding_engine
+from campaign import (_owns_lock, claim_shard, init_campaign, load_campaign, merge_campaign, shard_path, shard_runs,
+                      work)
+from result_store import LOSS_SIDECAR_SUFFIX, RUNS_SIDECAR_SUFFIX
+
+
+PROBLEM = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "Ma", "Ma_60groups.csv")
+PRIOR = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "prior_spectra", "prior_60groups.txt")
+RUNS = 12
+SHARD_SIZE = 5
+SEED = 2024
+MAX_EPOCHS = 300
+
+
+@pytest.fixture
+def problem_file(tmp_path):
+    # Ma_60 with 5% activity errors, so that every run is perturbed differently
+    with open(PROBLEM, newline='') as file:
+        rows = list(csv.reader(file))
+    for row in rows[1:]:
+        row[-1] = repr(0.05 * float(row[-2]))
+    path = str(tmp_path / "problem.csv")
+    with open(path, 'w', newline='') as file:
+        csv.writer(file).writerows(rows)
+    return path
+
+
+@pytest.fixture
+def campaign_dir(tmp_path, problem_file):
+    path = str(tmp_path / "campaign")
+    init_campaign(path, problem_file, PRIOR, runs=RUNS, shard_size=SHARD_SIZE, seed=SEED, max_epochs=MAX_EPOCHS)
+    return path
+
+
+def outputs(path):
+    stem = os.path.splitext(path)[0]
+    return [path, stem + RUNS_SIDECAR_SUFFIX, stem + LOSS_SIDECAR_SUFFIX]
+
+
+def read_lines(path):
+    with open(path, 'rb') as file:
+        return file.read().splitlines(keepends=True)
+
+
+def sequential_run_file(tmp_path, problem_file):
+    path = str(tmp_path / "sequential.csv")
+    unfolding_engine.main([problem_file, PRIOR, "-o", path, "--runs", str(RUNS), "--seed", str(SEED),
+                           "--max-epochs", str(MAX_EPOCHS), "--checkpoint-interval", "0"])
+    return path
+
+
+def _claim_all(campaign_dir, shards, start):
+    while time.time() < start:
+        pass
+    return [shard for shard in range(shards) if claim_shard(campaign_dir, shard) is not None]
+
+
+def test_two_workers_never_claim_the_same_shard(campaign_dir):
+    shards = 200
+    start = time.time() + 1.0
+    with get_context("spawn").Pool(2) as pool:
+        claimed = pool.starmap(_claim_all, [(campaign_dir, shards, start)] * 2)
+    assert sorted(claimed[0] + claimed[1]) == list(range(shards))
+
+
+def test_taken_shard_is_not_claimed_again(campaign_dir):
+    token = claim_shard(campaign_dir, 0)
+    assert token is not None
+    assert claim_shard(campaign_dir, 0) is None
+    assert claim_shard(campaign_dir, 0, stale_after=60.0) is None
+    assert _owns_lock(shard_path(campaign_dir, 0, ".lock"), token)
+
+
+def test_stale_lock_is_taken_over(campaign_dir):
+    lock = shard_path(campaign_dir, 0, ".lock")
+    token = claim_shard(campaign_dir, 0)
+    expired = time.time() - 120.0
+    os.utime(lock, (expired, expired))
+
+    assert claim_shard(campaign_dir, 0) is None
+    new_token = claim_shard(campaign_dir, 0, stale_after=60.0)
+    assert new_token is not None and new_token != token
+    assert _owns_lock(lock, new_token)
+    assert not _owns_lock(lock, token)
+    assert not campaign._heartbeat(lock, token)
+
+
+def test_worker_that_lost_its_lock_does_not_write(campaign_dir, monkeypatch):
+    lock = shard_path(campaign_dir, 0, ".lock")
+    thief = {}
+
+    class TakenOverDuringSolve(campaign.SpectrumUnfolder):
+        def solve(self, *args, **kwargs):
+            result = super().solve(*args, **kwargs)
+            if not thief:
+                # Another worker takes the lock over while this run is being solved
+                os.remove(lock)
+                thief["token"] = claim_shard(campaign_dir, 0)
+            return result
+
+    monkeypatch.setattr(campaign, "SpectrumUnfolder", TakenOverDuringSolve)
+    monkeypatch.setattr(campaign, "num_shards", lambda config: 1)
+    assert work(campaign_dir) == 0
+
+    assert _owns_lock(lock, thief["token"])
+    assert not os.path.exists(shard_path(campaign_dir, 0, ".done"))
+    for path in outputs(shard_path(campaign_dir, 0, ".csv")):
+        assert not os.path.exists(path) or len(read_lines(path)) <= 1   # header only
+
+
+def test_merge_equals_sequential_run_file(tmp_path, problem_file, campaign_dir):
+    assert work(campaign_dir) == RUNS
+    merged = str(tmp_path / "merged.csv")
+    assert merge_campaign(campaign_dir, merged) == RUNS
+    sequential = sequential_run_file(tmp_path, problem_file)
+    for merged_path, sequential_path in zip(outputs(merged), outputs(sequential)):
+        assert read_lines(merged_path) == read_lines(sequential_path)
+
+
+def test_merge_cuts_a_shard_with_a_truncated_tail(tmp_path, problem_file, campaign_dir):
+    work(campaign_dir)
+    # Shard 1 interrupted while writing the spectrum of its last run: the sidecars already hold that run
+    config = load_campaign(campaign_dir)
+    os.remove(shard_path(campaign_dir, 1, ".done"))
+    spectra = shard_path(campaign_dir, 1, ".csv")
+    size = os.path.getsize(spectra)
+    with open(spectra, 'rb+') as file:
+        file.truncate(size - len(read_lines(spectra)[-1]) // 2)
+    lost = f"Run_{shard_runs(config, 1)[-1] + 1},".encode()
+
+    with pytest.raises(ValueError):
+        merge_campaign(campaign_dir, str(tmp_path / "merged.csv"))
+    merged = str(tmp_path / "merged.csv")
+    assert merge_campaign(campaign_dir, merged, partial=True) == RUNS - 1
+    sequential = sequential_run_file(tmp_path, problem_file)
+    for merged_path, sequential_path in zip(outputs(merged), outputs(sequential)):
+        expected = [line for line in read_lines(sequential_path) if not line.startswith(lost)]
+        assert read_lines(merged_path) == expected
+
+    # Resuming the shard completes the campaign
+    assert work(campaign_dir) == 1
+    assert merge_campaign(campaign_dir, merged) == RUNS
+    for merged_path, sequential_path in zip(outputs(merged), outputs(sequential)):
+        assert read_lines(merged_path) == read_lines(sequential_path)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Exact resume of an interrupted gradient run from its checkpoint (checkpoint.py).
+"""
+
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from checkpoint import Checkpointer, run_context, run_state, settings_changed, solver_settings
+from monte_carlo import perturb_activities
+from unfolding_engine import SpectrumUnfolder, load_prior, load_problem
+
+
+PROBLEM = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "Ma", "Ma_60groups.csv")
+PRIOR = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "prior_spectra", "prior_60groups.txt")
+MAX_EPOCHS = 6000
+STOP_AT = 2500      # epochs before the interruption
+SEED = 7
+RUN = 3
+
+
+@pytest.fixture(scope="module")
+def case():
+    problem = load_problem(PROBLEM)
+    x0 = load_prior(PRIOR, problem.A.shape[1]).reshape(1, -1)
+    b = perturb_activities(problem.b, 0.05 * problem.b, SEED, RUN)
+    return problem, x0, b
+
+
+def unfolder(problem, cancel=None, **options):
+    options = dict(dict(max_epochs=MAX_EPOCHS), **options)
+    return SpectrumUnfolder(problem.A, problem.loss_threshold, cancel=cancel, **options)
+
+
+@pytest.fixture(scope="module")
+def interrupted(case, tmp_path_factory):
+    """Checkpoint of the run stopped after STOP_AT epochs (as by the Stop button), loaded back."""
+    problem, x0, b = case
+    cancel = threading.Event()
+    solver = unfolder(problem, cancel)
+    checkpointer = Checkpointer(str(tmp_path_factory.mktemp("checkpoint") / "results_checkpoint.npz"), interval=0.0)
+    checkpointer.context = run_context(RUN, SEED, b, x0, set(), solver_settings(solver))
+
+    def stop(loss_history, x):
+        if len(loss_history) >= STOP_AT:
+            cancel.set()
+
+    result = solver.solve(x0, b, callback=stop, checkpoint=checkpointer)
+    assert result.stop_reason == "cancelled"
+    return checkpointer.load()
+
+
+def test_resume_is_bit_identical(case, interrupted):
+    problem, x0, b = case
+    reference = unfolder(problem).solve(x0, b)
+
+    solver = unfolder(problem)
+    state = run_state(interrupted, RUN, SEED, b, x0, solver_settings(solver))
+    assert state is not None and 0 < int(state["epoch"]) < reference.epochs
+    resumed = solver.solve(x0, b, state=state)
+
+    assert np.array_equal(resumed.x, reference.x)
+    assert resumed.epochs == reference.epochs
+    assert resumed.stop_reason == reference.stop_reason
+    assert resumed.final_loss == reference.final_loss
+    for name, values in reference.loss_history.state().items():
+        assert np.array_equal(resumed.loss_history.state()[name], values), name
+
+
+def test_state_of_another_run_is_not_used(case, interrupted):
+    problem, x0, b = case
+    settings = solver_settings(unfolder(problem))
+    assert run_state(interrupted, RUN + 1, SEED, b, x0, settings) is None
+    assert run_state(interrupted, RUN, SEED + 1, b, x0, settings) is None
+    assert run_state(interrupted, RUN, SEED, b * 1.01, x0, settings) is None
+
+
+@pytest.mark.parametrize("options", [dict(learning_rate=0.5), dict(smoothness=0.0), dict(rescale=False),
+                                     dict(formulation="gram")], ids=lambda options: next(iter(options)))
+def test_other_solver_settings_are_refused(case, interrupted, options):
+    problem, x0, b = case
+    solver = unfolder(problem, **options)
+    settings = solver_settings(solver)
+    assert settings_changed(interrupted, settings) == list(options)
+    assert run_state(interrupted, RUN, SEED, b, x0, settings) is None
+    with pytest.raises(ValueError):
+        solver.solve(x0, b, state=interrupted)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Regression test of the vectorized group collapsing (cross_section_processing.py).
+
+Every bundled cross-section file is collapsed onto the Example and manuscript
+group structures and compared with the point-by-point loop the Data Preparation
+tab used before collapse_to_groups existed (copied below as reference_collapse and
+reference_process_file); the results must be identical, not just close.
+"""
+
+import glob
+import math
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from cross_section_processing import collapse_to_groups, process_file, read_cross_section, read_energy_bins
+
+
+CROSS_SECTION_FILES = sorted(glob.glob(os.path.join(ROOT, "cross_section", "*.txt"))) \
+    + [os.path.join(ROOT, "Example", "Au-197_Au-198.txt")]
+PRIOR_SPECTRA = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "prior_spectra")
+GROUP_STRUCTURES = [
+    os.path.join(ROOT, "Example", "prior.txt"),
+    os.path.join(PRIOR_SPECTRA, "prior_60groups.txt"),
+    os.path.join(PRIOR_SPECTRA, "prior_113group.txt"),
+    os.path.join(PRIOR_SPECTRA, "prior_240groups.txt"),
+]
+
+# Au-197 foil of the Example folder
+FOIL = dict(material_mass=0.1, atomic_mass=196.97, half_life=64.68, irradiation_time=2.0, cooling_time=1.0)
+
+
+def reference_energy_bins(energy_file_path):
+    bins = []
+    with open(energy_file_path, 'r') as file:
+        lines = file.readlines()[1:]
+        for line in lines:
+            parts = line.strip().split()
+            if len(parts) >= 3:
+                try:
+                    bins.append(float(parts[0]) * 1e6)
+                except ValueError:
+                    continue
+    return bins
+
+
+def reference_collapse(file_path, energy_bins):
+    with open(file_path, 'r') as file:
+        lines = file.readlines()
+
+    data = []
+    for line in lines[8:]:
+        parts = line.strip().split()
+        if len(parts) >= 2:
+            try:
+                x1 = float(parts[0].replace('D', 'E'))
+                x2 = float(parts[1].replace('D', 'E'))
+                data.append((x1, x2))
+            except ValueError:
+                continue
+
+    result_list = [0]
+    for i in range(len(energy_bins) - 1):
+        lower, upper = energy_bins[i], energy_bins[i + 1]
+        filtered_values = [x2 for x1, x2 in data if lower <= x1 < upper]
+
+        if filtered_values:
+            avg_value = sum(filtered_values) / len(filtered_values)
+        else:
+            midpoint = (lower + upper) / 2
+            left = None
+            right = None
+            for x1, x2 in data:
+                if x1 < midpoint:
+                    left = (x1, x2)
+                elif x1 > midpoint and right is None:
+                    right = (x1, x2)
+                    break
+            if left and right:
+                x0, y0 = left
+                x1, y1 = right
+                avg_value = y0 + (midpoint - x0) * (y1 - y0) / (x1 - x0)
+            else:
+                avg_value = 0
+
+        result_list.append(avg_value)
+    return result_list
+
+
+def reference_process_file(file_path, material_mass, atomic_mass, half_life, irradiation_time, cooling_time, energy_bins):
+    result_list = reference_collapse(file_path, energy_bins)
+    decay_constant = 0.693 / half_life
+    avogadro_number = 6.022e23
+    last_input = (material_mass / atomic_mass) * avogadro_number * (1 - math.exp(-decay_constant * irradiation_time)) \
+        * math.exp(-decay_constant * cooling_time) * 10**-24
+    return [x * last_input for x in result_list]
+
+
+@pytest.fixture(scope="module", params=GROUP_STRUCTURES, ids=os.path.basename)
+def structure(request):
+    return request.param
+
+
+def test_energy_bins_match_reference(structure):
+    assert read_energy_bins(structure).tolist() == reference_energy_bins(structure)
+
+
+@pytest.mark.parametrize("file_path", CROSS_SECTION_FILES, ids=os.path.basename)
+def test_collapse_matches_reference_loop(file_path, structure):
+    energy_bins = read_energy_bins(structure)
+    energy, sigma = read_cross_section(file_path)
+    groups = collapse_to_groups(energy, sigma, energy_bins)
+    assert groups.tolist() == reference_collapse(file_path, energy_bins.tolist())
+
+
+@pytest.mark.parametrize("file_path", CROSS_SECTION_FILES, ids=os.path.basename)
+def test_process_file_matches_reference_loop(file_path, structure):
+    energy_bins = read_energy_bins(structure)
+    expected = reference_process_file(file_path, energy_bins=energy_bins.tolist(), **FOIL)
+    assert process_file(file_path, energy_bins=energy_bins, **FOIL) == expected
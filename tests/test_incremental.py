@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Row Gram matrix K = A_F A_Fᵀ kept by IncrementalUnfolder (incremental.py)
+through foils added, removed and changed, and its use once groups end at MIN_FLUX.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from incremental import IncrementalUnfolder
+from linear_uncertainty import active_row_gram, solution_jacobian
+from unfolding_engine import MIN_FLUX, UnfoldingProblem, UnfoldingResult, load_prior, load_problem
+
+
+PROBLEM = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "Ma", "Ma_60groups.csv")
+PRIOR = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "prior_spectra", "prior_60groups.txt")
+SEED = 60
+STEPS = 200
+RTOL = 1e-12
+MAX_EPOCHS = 300
+
+
+@pytest.fixture(scope="module")
+def case():
+    problem = load_problem(PROBLEM)
+    problem.b_error = 0.05 * problem.b
+    return problem, load_prior(PRIOR, problem.A.shape[1])
+
+
+def first_foils(problem, m):
+    return UnfoldingProblem(problem.A[:m], problem.b[:m], problem.b_error[:m], problem.energies, problem.names[:m])
+
+
+def assert_row_gram(incremental):
+    A_free = incremental.A[:, incremental.free]
+    np.testing.assert_allclose(incremental.K, A_free @ A_free.T, rtol=RTOL, atol=0)
+
+
+def test_row_gram_follows_random_updates(case):
+    problem, prior = case
+    rng = np.random.default_rng(SEED)
+    incremental = IncrementalUnfolder(first_foils(problem, 4), prior)
+    rows = {name: np.asarray(a, dtype=np.float64) for name, a in zip(problem.names, problem.A)}
+    spare = list(problem.names[4:])
+    assert_row_gram(incremental)
+
+    for step in range(STEPS):
+        action = rng.choice(["add", "remove", "response", "activity"])
+        if action == "add" and spare:
+            name = spare.pop(rng.integers(len(spare)))
+            index = rng.integers(len(incremental.names) + 1)
+            incremental.add_row(name, rows[name], rng.uniform(1.0, 2.0), index=index)
+        elif action == "remove" and len(incremental.names) > 1:
+            name = incremental.names[rng.integers(len(incremental.names))]
+            incremental.remove_row(name)
+            spare.append(name)
+        elif action == "response":
+            name = incremental.names[rng.integers(len(incremental.names))]
+            rows[name] = rows[name] * rng.uniform(0.5, 1.5, size=len(rows[name]))
+            incremental.update_row(name, a=rows[name])
+        else:
+            name = incremental.names[rng.integers(len(incremental.names))]
+            K = incremental.K.copy()
+            incremental.update_row(name, b=rng.uniform(1.0, 2.0))
+            assert np.array_equal(incremental.K, K)
+        for name, a in zip(incremental.names, incremental.A):
+            assert np.array_equal(a, rows[name]), step
+        assert_row_gram(incremental)
+
+    # sync() back to the whole problem (foils it adds go last)
+    incremental.sync(problem)
+    assert sorted(incremental.names) == sorted(problem.names)
+    for name, a in zip(incremental.names, incremental.A):
+        assert np.array_equal(a, problem.A[problem.names.index(name)])
+    assert_row_gram(incremental)
+
+
+@pytest.mark.parametrize("dropped", [2, 30], ids=["downdated", "recomputed"])
+def test_groups_at_min_flux(case, dropped):
+    problem, prior = case
+    incremental = IncrementalUnfolder(problem, prior, max_epochs=MAX_EPOCHS)
+    A, free = incremental.A, incremental.free
+    active = free.copy()
+    active[np.flatnonzero(free)[np.random.default_rng(dropped).permutation(free.sum())[:dropped]]] = False
+    assert np.count_nonzero(free & ~active) == dropped
+    np.testing.assert_allclose(active_row_gram(A, free, active, incremental.K), A[:, active] @ A[:, active].T,
+                               rtol=RTOL, atol=0)
+
+    # A solution with those groups at MIN_FLUX: same error bars from the kept K as from A
+    result = incremental.solve()
+    x = np.where(active, np.maximum(np.ravel(result.x), 2 * MIN_FLUX), np.ravel(result.x))
+    x[free & ~active] = MIN_FLUX
+    incremental.result = UnfoldingResult(x.reshape(1, -1), result.loss_history, result.epochs, result.stop_reason)
+    jacobian = solution_jacobian(incremental.unfolder(), incremental.prior, incremental.b, incremental.result,
+                                 epochs=incremental.epochs)
+    assert not jacobian[free & ~active].any()
+    np.testing.assert_allclose(incremental.uncertainty().jacobian, jacobian, rtol=1e-9,
+                               atol=1e-9 * np.abs(jacobian).max())
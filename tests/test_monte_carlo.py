@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducibility of the Monte Carlo runs (monte_carlo.py): run k is drawn from
+its own (seed, k) stream, so it does not depend on how the runs are scheduled.
+"""
+
+import csv
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import unfolding_engine
+from monte_carlo import PRIOR_STREAM, base_seed, perturb_activities, random_prior, run_generator, run_parallel
+from result_store import read_binary_results
+from unfolding_engine import SpectrumUnfolder, load_prior, load_problem
+
+
+PROBLEM = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "Ma", "Ma_60groups.csv")
+PRIOR = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "prior_spectra", "prior_60groups.txt")
+RUNS = 8
+SEED = 31415
+MAX_EPOCHS = 300
+
+
+@pytest.fixture(scope="module")
+def problem_file(tmp_path_factory):
+    # Ma_60 with 5% activity errors
+    with open(PROBLEM, newline='') as file:
+        rows = list(csv.reader(file))
+    for row in rows[1:]:
+        row[-1] = repr(0.05 * float(row[-2]))
+    path = str(tmp_path_factory.mktemp("problem") / "problem.csv")
+    with open(path, 'w', newline='') as file:
+        csv.writer(file).writerows(rows)
+    return path
+
+
+@pytest.fixture(scope="module")
+def sequential(problem_file, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("sequential") / "sequential.runs")
+    unfolding_engine.main([problem_file, PRIOR, "-o", path, "--runs", str(RUNS), "--seed", str(SEED),
+                           "--max-epochs", str(MAX_EPOCHS), "--checkpoint-interval", "0"])
+    return read_binary_results(path)[1]
+
+
+@pytest.fixture(scope="module")
+def pool(problem_file, tmp_path_factory):
+    problem = load_problem(problem_file)
+    x0 = load_prior(PRIOR, problem.A.shape[1]).reshape(1, -1)
+    path = str(tmp_path_factory.mktemp("pool") / "pool.runs")
+    run_parallel(problem.A, problem.b, problem.b_error, x0, problem.energies, path, RUNS, problem.loss_threshold,
+                 seed=SEED, workers=3, max_epochs=MAX_EPOCHS)
+    records = read_binary_results(path)[1]
+    return records[np.argsort(records["run"])]   # written in the order the runs finished
+
+
+def test_run_alone_sequential_and_pool_agree(problem_file, sequential, pool):
+    problem = load_problem(problem_file)
+    x0 = load_prior(PRIOR, problem.A.shape[1]).reshape(1, -1)
+    unfolder = SpectrumUnfolder(problem.A, problem.loss_threshold, b_error=problem.b_error, max_epochs=MAX_EPOCHS)
+    assert sequential["run"].tolist() == pool["run"].tolist() == list(range(RUNS))
+    assert {int(s) for s in sequential["seed"]} == {int(s) for s in pool["seed"]} == {base_seed(SEED)}
+
+    for run in reversed(range(RUNS)):   # each run alone, in another order
+        alone = perturb_activities(problem.b, problem.b_error, SEED, run)
+        assert np.array_equal(np.ravel(alone), sequential["b"][run])
+        assert np.array_equal(np.ravel(alone), pool["b"][run])
+        x = np.ravel(unfolder.solve(x0, alone).x)
+        assert np.array_equal(x, sequential["x"][run])
+        assert np.array_equal(x, pool["x"][run])
+
+
+def test_runs_are_independent(problem_file):
+    problem = load_problem(problem_file)
+    first = perturb_activities(problem.b, problem.b_error, SEED, 0)
+    assert not np.array_equal(first, perturb_activities(problem.b, problem.b_error, SEED, 1))
+    assert not np.array_equal(first, perturb_activities(problem.b, problem.b_error, SEED + 1, 0))
+
+
+def test_prior_stream_does_not_collide_with_run_streams(problem_file):
+    problem = load_problem(problem_file)
+    n = problem.A.shape[1]
+    before = [perturb_activities(problem.b, problem.b_error, SEED, run) for run in range(RUNS)]
+    prior = random_prior(n, SEED)
+    after = [perturb_activities(problem.b, problem.b_error, SEED, run) for run in range(RUNS)]
+    assert all(np.array_equal(a, b) for a, b in zip(before, after))
+    assert np.array_equal(prior, random_prior(n, SEED))
+
+    # The prior stream is the run stream PRIOR_STREAM, far beyond any run id
+    expected = run_generator(SEED, PRIOR_STREAM).uniform(1e-6, 1.0, size=(1, n)).astype(np.float32)
+    assert np.array_equal(prior, expected)
+    states = {tuple(np.random.SeedSequence(SEED, spawn_key=(run,)).generate_state(4)) for run in range(10000)}
+    assert len(states) == 10000
+    assert tuple(np.random.SeedSequence(SEED, spawn_key=(PRIOR_STREAM,)).generate_state(4)) not in states
+    for run in range(100):
+        draws = run_generator(SEED, run).uniform(1e-6, 1.0, size=(1, n)).astype(np.float32)
+        assert not np.array_equal(prior, draws)
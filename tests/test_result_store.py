@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Resume of interrupted result files (result_store.py).
+
+A run cut off while any of its lines or records was being written must be
+dropped on resume, and finishing the remaining runs must give the same files
+as a run that was never interrupted.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from loss_trace import SAVED_TRACE_BUCKETS, LossTrace
+from result_store import (BinaryResultSink, CsvResultSink, loss_sidecar_path, read_binary_results, record_dtype,
+                          sidecar_path)
+
+
+ENERGIES = np.geomspace(1e-11, 20.0, 12)
+ACTIVITIES = 4
+RUNS = 6
+SEED = 12345
+
+
+def run_data(run_id):
+    rng = np.random.default_rng(run_id)
+    trace = LossTrace()
+    trace.extend(np.geomspace(100.0, 1.0, 50 + 10 * run_id) * (1 + rng.random()))
+    return dict(x=rng.random(len(ENERGIES)), final_loss=float(trace[-1]), epochs=len(trace),
+                stop_reason="threshold", seed=SEED, perturbed_b=rng.random(ACTIVITIES), loss_trace=trace)
+
+
+def write_runs(sink_class, path, runs, resume=False):
+    with sink_class(path, ENERGIES, ACTIVITIES, resume=resume) as sink:
+        for run_id in runs:
+            if run_id not in sink.completed:
+                sink.write(run_id, **run_data(run_id))
+        return sink
+
+
+def read_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def cut_last_line(path, keep):
+    """Keep `keep` (0..1) of the last line of `path`: 0 drops it, otherwise it ends mid-line."""
+    data = read_bytes(path)
+    start = data[:-1].rfind(b"\n") + 1
+    with open(path, 'rb+') as file:
+        file.truncate(start + int(keep * (len(data) - start)))
+
+
+def csv_files(path):
+    return [path, sidecar_path(path), loss_sidecar_path(path)]
+
+
+@pytest.fixture
+def reference(tmp_path):
+    path = str(tmp_path / "reference.csv")
+    write_runs(CsvResultSink, path, range(RUNS))
+    return [read_bytes(p) for p in csv_files(path)]
+
+
+# CsvResultSink.write writes the loss trace, the metadata row and the spectrum, in that order
+@pytest.mark.parametrize("interrupted", ["spectra", "metadata", "loss"])
+@pytest.mark.parametrize("keep", [0.0, 0.5])
+def test_csv_resume_after_interrupted_write(tmp_path, reference, interrupted, keep):
+    path = str(tmp_path / "results.csv")
+    write_runs(CsvResultSink, path, range(4))
+    spectra, metadata, loss = csv_files(path)
+    if interrupted == "spectra":
+        cut_last_line(spectra, keep)
+    elif interrupted == "metadata":
+        cut_last_line(spectra, 0.0)
+        cut_last_line(metadata, keep)
+    else:
+        cut_last_line(spectra, 0.0)
+        cut_last_line(metadata, 0.0)
+        cut_last_line(loss, keep)
+
+    sink = write_runs(CsvResultSink, path, range(RUNS), resume=True)
+    assert sink.seed == SEED
+    assert [read_bytes(p) for p in csv_files(path)] == reference
+
+
+def test_csv_resume_skips_completed_runs(tmp_path, reference):
+    path = str(tmp_path / "results.csv")
+    write_runs(CsvResultSink, path, range(3))
+    with CsvResultSink(path, ENERGIES, ACTIVITIES, resume=True) as sink:
+        assert sink.completed == {0, 1, 2}
+        for run_id in range(3, RUNS):
+            sink.write(run_id, **run_data(run_id))
+    assert [read_bytes(p) for p in csv_files(path)] == reference
+
+
+@pytest.mark.parametrize("energies", [ENERGIES[:-1], ENERGIES * 2.0], ids=["groups", "energies"])
+def test_csv_resume_refuses_other_group_structure(tmp_path, energies):
+    path = str(tmp_path / "results.csv")
+    write_runs(CsvResultSink, path, range(2))
+    with pytest.raises(ValueError):
+        CsvResultSink(path, energies, ACTIVITIES, resume=True)
+
+
+def test_csv_resume_refuses_other_number_of_activities(tmp_path):
+    path = str(tmp_path / "results.csv")
+    write_runs(CsvResultSink, path, range(2))
+    with pytest.raises(ValueError):
+        CsvResultSink(path, ENERGIES, ACTIVITIES + 1, resume=True)
+
+
+@pytest.mark.parametrize("keep", [0.0, 0.3, 0.9])
+def test_binary_resume_after_interrupted_record(tmp_path, keep):
+    reference = str(tmp_path / "reference.runs")
+    write_runs(BinaryResultSink, reference, range(RUNS))
+
+    path = str(tmp_path / "results.runs")
+    write_runs(BinaryResultSink, path, range(4))
+    itemsize = record_dtype(len(ENERGIES), ACTIVITIES, SAVED_TRACE_BUCKETS).itemsize
+    with open(path, 'rb+') as file:
+        file.truncate(os.path.getsize(path) - itemsize + int(keep * itemsize))
+
+    sink = write_runs(BinaryResultSink, path, range(RUNS), resume=True)
+    assert sink.seed == SEED
+    assert read_bytes(path) == read_bytes(reference)
+    _, records = read_binary_results(path)
+    assert records["run"].tolist() == list(range(RUNS))
+
+
+@pytest.mark.parametrize("energies, activities", [(ENERGIES[:-1], ACTIVITIES), (ENERGIES, ACTIVITIES + 1)],
+                         ids=["groups", "activities"])
+def test_binary_resume_refuses_other_layout(tmp_path, energies, activities):
+    path = str(tmp_path / "results.runs")
+    write_runs(BinaryResultSink, path, range(2))
+    with pytest.raises(ValueError):
+        BinaryResultSink(path, energies, activities, resume=True)
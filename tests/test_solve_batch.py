@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Batched Monte Carlo runs (SpectrumUnfolder.solve_batch) against one solve() per run.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from monte_carlo import perturb_activities
+from unfolding_engine import SpectrumUnfolder, load_prior, load_problem
+
+
+PROBLEM = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "Ma", "Ma_60groups.csv")
+PRIOR = os.path.join(ROOT, "manuscript_2026_energy_group_resolution", "prior_spectra", "prior_60groups.txt")
+RUNS = 8
+MAX_EPOCHS = 3000
+RTOL = 1e-12
+# The Gram formulation evaluates the loss as xᵀGx - 2xᵀAᵀb + bᵀb, which cancels to ~1e-11
+LOSS_RTOL = 1e-10
+
+
+@pytest.fixture(scope="module")
+def case():
+    problem = load_problem(PROBLEM)
+    x0 = load_prior(PRIOR, problem.A.shape[1]).reshape(1, -1)
+    # Threshold reached by the unperturbed problem after 1500 epochs: some runs stop on it, others at max_epochs
+    threshold = SpectrumUnfolder(problem.A, 0.0, max_epochs=1500).solve(x0, problem.b).loss_history[-1]
+    B = np.hstack([perturb_activities(problem.b, 0.05 * problem.b, 1, run) for run in range(RUNS)]).T
+    return problem, x0, B, threshold
+
+
+def assert_same_run(batch, i, single):
+    np.testing.assert_allclose(batch.x[i], np.ravel(single.x), rtol=RTOL, atol=0)
+    assert batch.epochs[i] == single.epochs
+    assert batch.stop_reason[i] == single.stop_reason
+    np.testing.assert_allclose(batch.final_loss[i], single.final_loss, rtol=LOSS_RTOL, atol=0)
+
+
+@pytest.mark.parametrize("formulation", ["primal", "gram"])
+def test_batch_matches_sequential_solves(case, formulation):
+    problem, x0, B, threshold = case
+    unfolder = SpectrumUnfolder(problem.A, threshold, max_epochs=MAX_EPOCHS, formulation=formulation)
+    batch = unfolder.solve_batch(x0, B)
+    assert set(batch.stop_reason) == {"threshold", "max_epochs"}
+    for i in range(RUNS):
+        assert_same_run(batch, i, unfolder.solve(x0, B[i].reshape(-1, 1)))
+
+
+def test_masked_batch_matches_solves_without_the_masked_rows(case):
+    problem, x0, B, threshold = case
+    A = np.asarray(problem.A, dtype=np.float64)
+    m = A.shape[0]
+    # Every foil left out once (leave-one-out subproblems), plus one run with all foils and one without two
+    row_mask = np.vstack([~np.eye(m, dtype=bool), np.ones(m, dtype=bool), np.arange(m) >= 2])
+    b_matrix = np.vstack([B, B])[:len(row_mask)]
+    unfolder = SpectrumUnfolder(A, threshold, max_epochs=MAX_EPOCHS, formulation="primal")
+    batch = unfolder.solve_batch(x0, b_matrix, row_mask=row_mask)
+    for i, keep in enumerate(row_mask):
+        single = SpectrumUnfolder(A[keep], threshold, max_epochs=MAX_EPOCHS, formulation="primal")
+        assert_same_run(batch, i, single.solve(x0, b_matrix[i, keep].reshape(-1, 1)))